@@ -1,6 +1,63 @@
+import io
+import json
+import os
+import queue
+import sys
+import threading
 import time
+from datetime import datetime
 from sodapy import Socrata
 import psycopg2
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# backend/ is not a package; put it on the path the way the benchmarks do so this
+# is the same `metrics` module the backend imports, whatever the working directory.
+# metrics itself needs only the standard library; batch timings go to METRICS_TEXTFILE when set
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+import metrics  # noqa: E402
+
+# Column order used by both the row-by-row INSERT path and the COPY path
+COLUMNS = (
+    "invoice_line_no", "date", "store", "name", "address", "city", "zipcode",
+    "store_location", "county_number", "county", "category", "category_name",
+    "vendor_no", "vendor_name", "itemno", "im_desc", "pack", "bottle_volume_ml",
+    "state_bottle_cost", "state_bottle_retail", "sale_bottles", "sale_dollars",
+    "sale_liters", "sale_gallons",
+)
+INT_COLUMNS = {"pack", "sale_bottles"}
+FLOAT_COLUMNS = {
+    "bottle_volume_ml", "state_bottle_cost", "state_bottle_retail",
+    "sale_dollars", "sale_liters", "sale_gallons",
+}
+
+DATASET_ID = "cc6f-sgik"
+PAGE_SIZE = 10000
+
+# Number of fetcher threads prefetching pages, and how many pages may wait for the writer
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", "4"))
+QUEUE_SIZE = int(os.getenv("QUEUE_SIZE", "8"))
+
+# Point at a JSON / JSON-lines file of rows to load from disk instead of Socrata
+SOCRATA_FIXTURE = os.getenv("SOCRATA_FIXTURE")
+
+# "copy" streams each page through a single COPY; "insert" is the original per-row path
+LOAD_MODE = os.getenv("LOAD_MODE", "copy")
+
+# "flat" matches create.sql; "partitioned" matches create_partitioned.sql, where
+# the unique key has to include the partition column
+LIQUOR_SCHEMA = os.getenv("LIQUOR_SCHEMA", "flat")
+CONFLICT_KEY = "invoice_line_no, date" if LIQUOR_SCHEMA == "partitioned" else "invoice_line_no"
+
+# "full" pages through the whole dataset; "incremental" only pulls rows past the
+# stored (date, invoice_line_no) watermark and upserts them
+SYNC_MODE = os.getenv("SYNC_MODE", "full")
+
+# When set, LiquorSales is also exported here after every load as Parquet, one
+# file per month (year=YYYY/month=MM/), for the backend's DuckDB SQL engine
+PARQUET_DIR = os.getenv("PARQUET_DIR")
+PARQUET_ROW_GROUP = int(os.getenv("PARQUET_ROW_GROUP", "131072"))
+
 
 def safe_int(val):
     """Convert value to int safely; returns None if conversion fails."""
@@ -16,37 +73,23 @@ def safe_float(val):
     except:
         return None
 
-# Sleep to allow MySQL time to initialize
-print("Waiting 30 seconds for MySQL to start...")
-time.sleep(30)
-
-# Connect to Socrata
-client = Socrata("data.iowa.gov", None)
-
-# Connect to MySQL
-print("Attempting to connect to PostgreSQL...")
-db_conn = psycopg2.connect(
-    host="db",
-    user="root",                 
-    password="cs620ibdc1234",         
-    dbname="IowaLiquorSales"       
-)
-cursor = db_conn.cursor()
 
-check = True
-ofst = 0
-
-while check:
-    # Fetch 10,000 rows at a time
-    results = client.get("cc6f-sgik", limit=10000, offset=10000 * ofst)
-    
-    if len(results) == 0:
-        check = False
-        break
+def extract_location(location_data):
+    """Return (lon, lat) from a Socrata store_location, or (None, None)."""
+    if (
+        isinstance(location_data, dict)
+        and "coordinates" in location_data
+        and len(location_data["coordinates"]) == 2
+    ):
+        lon = safe_float(location_data["coordinates"][0])
+        lat = safe_float(location_data["coordinates"][1])
+        if lon is not None and lat is not None:
+            return lon, lat
+    return None, None
 
-    ofst += 1
-    print(f"Inserting batch {ofst} ...")
 
+def insert_rows(cursor, results):
+    """Original loader: one INSERT per row."""
     for row in results:
         # Extract fields from the API response
         invoice_line_no   = row.get("invoice_line_no", None)
@@ -72,19 +115,8 @@ while check:
         sale_dollars      = safe_float(row.get("sale_dollars", None))
         sale_liters       = safe_float(row.get("sale_liters", None))
         sale_gallons      = safe_float(row.get("sale_gallons", None))
-        
-        
-        location_data = row.get("store_location", None)
-        if (
-            isinstance(location_data, dict)
-            and "coordinates" in location_data
-            and len(location_data["coordinates"]) == 2
-        ):
-            lon = safe_float(location_data["coordinates"][0])
-            lat = safe_float(location_data["coordinates"][1])
-        else:
-            lon = None
-            lat = None
+
+        lon, lat = extract_location(row.get("store_location", None))
 
         # Build the dynamic part for store_location:
         # If we have valid coordinates, store as point(lon, lat).
@@ -96,8 +128,6 @@ while check:
             location_expr = "NULL"
             location_params = ()
 
-
-        # Build SQL for insertion using ST_GeomFromText to convert WKT to a POINT
         sql = f"""
             INSERT INTO LiquorSales (
                 invoice_line_no, date, store, name, address, city, zipcode,
@@ -114,6 +144,7 @@ while check:
                 %s, %s, %s, %s,
                 %s, %s
             )
+            ON CONFLICT ({CONFLICT_KEY}) DO NOTHING
         """
 
         other_columns = (
@@ -128,8 +159,786 @@ while check:
         params = other_columns[:7] + location_params + other_columns[7:]
         cursor.execute(sql, params)
 
+
+def _copy_field(val):
+    """Render one value in PostgreSQL COPY text format."""
+    if val is None:
+        return "\\N"
+    return (
+        str(val)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def stage_rows(cursor, results, table="LiquorSales"):
+    """COPY a page into a temp staging table shaped like `table`, emptied on commit."""
+    cursor.execute(
+        f"CREATE TEMP TABLE IF NOT EXISTS liquorsales_stage "
+        f"(LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+    )
+    copy_rows(cursor, results, table="liquorsales_stage")
+
+
+def copy_new_rows(cursor, results, table="LiquorSales"):
+    """
+    Full-load path: COPY a page through the staging table and insert only the
+    invoice lines that aren't loaded yet, so a line the API repeats (or a page
+    fetched again after a restart) doesn't abort the load on the unique key.
+    """
+    stage_rows(cursor, results, table)
+    cols = ", ".join(COLUMNS)
+    cursor.execute(f"""
+        INSERT INTO {table} ({cols})
+        SELECT DISTINCT ON (invoice_line_no) {cols}
+        FROM liquorsales_stage
+        WHERE invoice_line_no IS NOT NULL
+        ORDER BY invoice_line_no
+        ON CONFLICT ({CONFLICT_KEY}) DO NOTHING
+    """)
+    # lines without a number never conflict; they were loaded as-is by the plain COPY too
+    cursor.execute(f"""
+        INSERT INTO {table} ({cols})
+        SELECT {cols} FROM liquorsales_stage WHERE invoice_line_no IS NULL
+    """)
+
+
+def upsert_rows(cursor, results, table="LiquorSales"):
+    """
+    COPY a page into a temp staging table, then merge it into LiquorSales on
+    invoice_line_no so rows that are already present are updated, not duplicated.
+    """
+    stage_rows(cursor, results, table)
+    cols = ", ".join(COLUMNS)
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in COLUMNS if c != "invoice_line_no")
+    # DISTINCT ON: a page can repeat an invoice line, and ON CONFLICT may touch a row only once
+    cursor.execute(f"""
+        INSERT INTO {table} ({cols})
+        SELECT DISTINCT ON (invoice_line_no) {cols}
+        FROM liquorsales_stage
+        WHERE invoice_line_no IS NOT NULL
+        ORDER BY invoice_line_no
+        ON CONFLICT ({CONFLICT_KEY}) DO UPDATE SET {updates}
+    """)
+
+
+def ensure_partitions(cursor, results):
+    """Create the month partitions a page needs before it is loaded."""
+    months = {r["date"][:7] for r in results if r.get("date")}
+    for month in sorted(months):
+        cursor.execute("SELECT liquorsales_ensure_partition(%s::date)", (month + "-01",))
+
+
+def with_partitions(load_page):
+    def load(cursor, results):
+        # the partitioned unique key is (invoice_line_no, date) and NULLs never conflict,
+        # so an undated row would be inserted again by every rerun; leave those out
+        dated = [r for r in results if r.get("date")]
+        if len(dated) < len(results):
+            undated = [r.get("invoice_line_no") for r in results if not r.get("date")]
+            print(f"Skipping {len(undated)} rows without a date: {', '.join(map(str, undated[:10]))}"
+                  + (" ..." if len(undated) > 10 else ""))
+        ensure_partitions(cursor, dated)
+        load_page(cursor, dated)
+    return load
+
+
+def _copy_point(location_data):
+    lon, lat = extract_location(location_data)
+    if lon is None:
+        return None
+    return f"({lon},{lat})"
+
+
+def page_to_columns(results):
+    """
+    Turn a page of Socrata rows into one list per column, coercing each
+    numeric column in a single pass instead of field by field per row.
+    """
+    columns = {}
+    for col in COLUMNS:
+        values = [row.get(col) for row in results]
+        if col in INT_COLUMNS:
+            values = list(map(safe_int, values))
+        elif col in FLOAT_COLUMNS:
+            values = list(map(safe_float, values))
+        elif col == "store_location":
+            values = list(map(_copy_point, values))
+        columns[col] = values
+    return columns
+
+
+def page_to_copy_buffer(results):
+    """Build an in-memory COPY text stream for a page of rows."""
+    columns = page_to_columns(results)
+    rendered = [list(map(_copy_field, columns[col])) for col in COLUMNS]
+    buf = io.StringIO()
+    buf.writelines("\t".join(values) + "\n" for values in zip(*rendered))
+    buf.seek(0)
+    return buf
+
+
+def copy_rows(cursor, results, table="LiquorSales"):
+    """Load a whole page with one COPY ... FROM STDIN."""
+    buf = page_to_copy_buffer(results)
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(COLUMNS)}) FROM STDIN", buf
+    )
+
+
+class LocalFixtureSource:
+    """
+    Stand-in for the Socrata client that serves rows from a local JSON array
+    or JSON-lines file. Only the parts of client.get() the loader uses are
+    supported.
+    """
+
+    def __init__(self, path):
+        with open(path) as f:
+            text = f.read()
+        if text.lstrip().startswith("["):
+            self.rows = json.loads(text)
+        else:
+            self.rows = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    def get(self, dataset_identifier, limit=1000, offset=0, **kwargs):
+        return self.rows[offset:offset + limit]
+
+
+def make_source():
+    if SOCRATA_FIXTURE:
+        print(f"Reading rows from fixture {SOCRATA_FIXTURE}")
+        return LocalFixtureSource(SOCRATA_FIXTURE)
+    return Socrata("data.iowa.gov", None)
+
+
+def ensure_checkpoint_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS load_checkpoints (
+            dataset TEXT NOT NULL,
+            page_offset BIGINT NOT NULL,
+            row_count INTEGER NOT NULL,
+            loaded_at TIMESTAMP NOT NULL DEFAULT now(),
+            PRIMARY KEY (dataset, page_offset)
+        )
+    """)
+
+
+def completed_offsets(cursor, dataset=DATASET_ID):
+    # a short page was the end of the dataset at the time; it is fetched again
+    # in case rows were appended to it since
+    cursor.execute(
+        "SELECT page_offset FROM load_checkpoints WHERE dataset = %s AND row_count = %s",
+        (dataset, PAGE_SIZE),
+    )
+    return {r[0] for r in cursor.fetchall()}
+
+
+def record_checkpoint(cursor, page_offset, row_count, dataset=DATASET_ID):
+    cursor.execute(
+        "INSERT INTO load_checkpoints (dataset, page_offset, row_count) VALUES (%s, %s, %s) "
+        "ON CONFLICT (dataset, page_offset) DO NOTHING",
+        (dataset, page_offset, row_count),
+    )
+
+
+def clear_checkpoints(cursor, dataset=DATASET_ID):
+    """Forget a finished load so the next full run starts from the first page."""
+    cursor.execute("DELETE FROM load_checkpoints WHERE dataset = %s", (dataset,))
+
+
+def ensure_version_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS data_version (
+            table_name TEXT PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0,
+            watermark_date TEXT,
+            watermark_invoice TEXT,
+            updated_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+    """)
+    cursor.execute(
+        "INSERT INTO data_version (table_name) VALUES ('liquorsales') "
+        "ON CONFLICT (table_name) DO NOTHING"
+    )
+
+
+def get_watermark(cursor):
+    """Return the (date, invoice_line_no) of the newest row loaded so far."""
+    cursor.execute(
+        "SELECT watermark_date, watermark_invoice FROM data_version "
+        "WHERE table_name = 'liquorsales'"
+    )
+    row = cursor.fetchone()
+    if row and row[0]:
+        return row[0], row[1]
+    # tables loaded before data_version existed: derive it once from the data
+    cursor.execute(
+        "SELECT to_char(date, 'YYYY-MM-DD\"T\"HH24:MI:SS.MS'), invoice_line_no FROM LiquorSales "
+        "WHERE date IS NOT NULL ORDER BY date DESC, invoice_line_no DESC LIMIT 1"
+    )
+    row = cursor.fetchone()
+    return (row[0], row[1]) if row else (None, None)
+
+
+def bump_data_version(cursor, watermark):
+    """
+    Increment the LiquorSales data version so caches and the embedding job
+    can tell the data changed, and store the new watermark.
+    """
+    cursor.execute(
+        "SELECT watermark_date, watermark_invoice FROM data_version "
+        "WHERE table_name = 'liquorsales' FOR UPDATE"
+    )
+    current = cursor.fetchone()
+    wm_date, wm_invoice = max((current[0] or "", current[1] or ""), tuple(watermark))
+    cursor.execute("""
+        UPDATE data_version
+        SET version = version + 1,
+            watermark_date = NULLIF(%s, ''),
+            watermark_invoice = NULLIF(%s, ''),
+            updated_at = now()
+        WHERE table_name = 'liquorsales'
+        RETURNING version
+    """, (wm_date, wm_invoice))
+    return cursor.fetchone()[0]
+
+
+def watermark_filter(watermark):
+    """SoQL filter selecting rows strictly after the (date, invoice_line_no) watermark."""
+    wm_date, wm_invoice = watermark
+    if not wm_date:
+        return None
+    wm_date = wm_date.replace("'", "''")
+    if not wm_invoice:
+        return f"date > '{wm_date}'"
+    wm_invoice = wm_invoice.replace("'", "''")
+    return (
+        f"date > '{wm_date}' OR "
+        f"(date = '{wm_date}' AND invoice_line_no > '{wm_invoice}')"
+    )
+
+
+def page_watermark(rows):
+    """Largest (date, invoice_line_no) in a page; Socrata dates compare as strings."""
+    return max(
+        ((r.get("date") or "", r.get("invoice_line_no") or "") for r in rows),
+        default=("", ""),
+    )
+
+
+# Per store / item / month rollup that embed.py summarizes; one row per group
+MONTHLY_AGG_COLUMNS = (
+    "name, im_desc, month, category_name, city, zipcode, county, first_invoice, "
+    "vendor_names, total_orders, total_bottles, total_sales, total_liters, "
+    "avg_bottle_volume, common_pack"
+)
+MONTHLY_AGG_SELECT = """
+    SELECT
+        name,
+        im_desc,
+        DATE_TRUNC('month', date) AS month,
+        category_name,
+        MIN(city),
+        MIN(zipcode),
+        MIN(county),
+        MIN(invoice_line_no),
+        STRING_AGG(DISTINCT vendor_name, ', '),
+        COUNT(*),
+        SUM(sale_bottles),
+        SUM(sale_dollars),
+        SUM(sale_liters),
+        AVG(bottle_volume_ml),
+        MODE() WITHIN GROUP (ORDER BY pack)
+    FROM LiquorSales s
+    WHERE date IS NOT NULL {filter}
+    GROUP BY name, im_desc, DATE_TRUNC('month', date), category_name
+"""
+
+
+def ensure_agg_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS liquorsales_monthly_agg (
+            id BIGSERIAL PRIMARY KEY,
+            name TEXT,
+            im_desc TEXT,
+            month TIMESTAMP NOT NULL,
+            category_name TEXT,
+            city TEXT,
+            zipcode TEXT,
+            county TEXT,
+            first_invoice TEXT,
+            vendor_names TEXT,
+            total_orders BIGINT,
+            total_bottles BIGINT,
+            total_sales FLOAT,
+            total_liters FLOAT,
+            avg_bottle_volume FLOAT,
+            common_pack INTEGER,
+            dirty BOOLEAN NOT NULL DEFAULT true,
+            updated_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+    """)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS liquorsales_monthly_agg_key "
+        "ON liquorsales_monthly_agg (name, im_desc, month)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS liquorsales_monthly_agg_dirty "
+        "ON liquorsales_monthly_agg (id) WHERE dirty"
+    )
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS liquorsales_monthly_agg_removed (
+            id BIGSERIAL PRIMARY KEY,
+            name TEXT,
+            im_desc TEXT,
+            month TIMESTAMP NOT NULL,
+            category_name TEXT
+        )
+    """)
+
+
+def rebuild_monthly_agg(cursor):
+    """Recompute every group from scratch; used after a full load."""
+    cursor.execute("TRUNCATE liquorsales_monthly_agg")
+    cursor.execute(
+        f"INSERT INTO liquorsales_monthly_agg ({MONTHLY_AGG_COLUMNS}) "
+        + MONTHLY_AGG_SELECT.format(filter="")
+    )
+    cursor.execute("ANALYZE liquorsales_monthly_agg")
+
+
+def previous_group_keys(cursor, results):
+    """Groups the page's invoice lines belong to before they are upserted, in refresh_monthly_agg's key form."""
+    invoices = [r["invoice_line_no"] for r in results if r.get("invoice_line_no")]
+    if not invoices:
+        return set()
+    cursor.execute(
+        "SELECT name, im_desc, to_char(DATE_TRUNC('month', date), 'YYYY-MM-DD'), category_name "
+        "FROM LiquorSales WHERE invoice_line_no = ANY(%s) AND date IS NOT NULL",
+        (invoices,),
+    )
+    return set(cursor.fetchall())
+
+
+def refresh_monthly_agg(cursor, results, previous=()):
+    """
+    Recompute only the (store, item, month, category) groups a page touched
+    and mark them dirty so the embedding job re-summarizes just those.
+    `previous` are the groups updated lines were in before the upsert
+    (previous_group_keys), so a line that moved stops counting in its old
+    group; a group left without rows is deleted and queued in
+    liquorsales_monthly_agg_removed for the embedding job.
+    STRING_AGG and MODE cannot be updated from deltas, so touched groups are
+    rebuilt from their LiquorSales rows, limited to the touched months.
+    """
+    keys = {
+        (r.get("name"), r.get("im_desc"), r["date"][:7] + "-01", r.get("category_name"))
+        for r in results if r.get("date")
+    }
+    keys.update(previous)
+    if not keys:
+        return
+    cursor.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS agg_touched "
+        "(name TEXT, im_desc TEXT, month TIMESTAMP, category_name TEXT) ON COMMIT DELETE ROWS"
+    )
+    buf = io.StringIO()
+    buf.writelines("\t".join(map(_copy_field, key)) + "\n" for key in keys)
+    buf.seek(0)
+    cursor.copy_expert("COPY agg_touched FROM STDIN", buf)
+
+    # COALESCE keeps the joins hashable; NULL and '' keys only widen what is
+    # recomputed, GROUP BY still keeps those groups apart
+    match = """
+        COALESCE({a}.name, '') = COALESCE(t.name, '')
+        AND COALESCE({a}.im_desc, '') = COALESCE(t.im_desc, '')
+        AND COALESCE({a}.category_name, '') = COALESCE(t.category_name, '')
+    """
+    cursor.execute(f"""
+        DELETE FROM liquorsales_monthly_agg a
+        USING (SELECT DISTINCT * FROM agg_touched) t
+        WHERE a.month = t.month AND {match.format(a="a")}
+    """)
+    months = sorted(key[2] for key in keys)
+    cursor.execute(
+        f"INSERT INTO liquorsales_monthly_agg ({MONTHLY_AGG_COLUMNS}) "
+        + MONTHLY_AGG_SELECT.format(filter=f"""
+            AND date >= %(lo)s::timestamp
+            AND date < %(hi)s::timestamp + INTERVAL '1 month'
+            AND EXISTS (
+                SELECT 1 FROM agg_touched t
+                WHERE t.month = DATE_TRUNC('month', s.date) AND {match.format(a="s")}
+            )
+        """),
+        {"lo": months[0], "hi": months[-1]},
+    )
+    cursor.execute(f"""
+        INSERT INTO liquorsales_monthly_agg_removed (name, im_desc, month, category_name)
+        SELECT DISTINCT t.name, t.im_desc, t.month, t.category_name
+        FROM agg_touched t
+        WHERE NOT EXISTS (
+            SELECT 1 FROM liquorsales_monthly_agg a
+            WHERE a.month = t.month AND {match.format(a="a")}
+        )
+    """)
+
+
+def with_agg_refresh(load_page):
+    def load(cursor, results):
+        previous = previous_group_keys(cursor, results)
+        load_page(cursor, results)
+        refresh_monthly_agg(cursor, results, previous)
+    return load
+
+
+# Parquet export: create.sql's columns and types, store_location as its "(lon,lat)" text
+PARQUET_SCHEMA = pa.schema([
+    (col, pa.int32() if col in INT_COLUMNS
+        else pa.float64() if col in FLOAT_COLUMNS
+        else pa.timestamp("us") if col == "date"
+        else pa.string())
+    for col in COLUMNS
+])
+# written last, so readers only trust an export once it is complete
+PARQUET_VERSION_FILE = "_data_version.json"
+EXPORT_COLUMNS = ", ".join("store_location::text" if col == "store_location" else col for col in COLUMNS)
+
+
+def page_to_table(results):
+    """A page of Socrata rows as an Arrow table with PARQUET_SCHEMA."""
+    columns = page_to_columns(results)
+    columns["date"] = pa.array(columns["date"], pa.string()).cast(pa.timestamp("us"))
+    return pa.Table.from_pydict(columns, schema=PARQUET_SCHEMA)
+
+
+def parquet_partition(directory, month):
+    """Directory of one month's partition; rows without a date go to "undated"."""
+    if month is None:
+        return os.path.join(directory, "undated")
+    return os.path.join(directory, f"year={month.year}", f"month={month.month:02d}")
+
+
+def write_parquet_partition(directory, month, tables):
+    """
+    Write one month's rows (an iterable of Arrow tables) to its partition,
+    replacing the previous file only once the new one is complete.
+    Returns the number of rows written.
+    """
+    path = parquet_partition(directory, month)
+    os.makedirs(path, exist_ok=True)
+    tmp = os.path.join(path, "part-0.parquet.tmp")
+    rows = 0
+    with pq.ParquetWriter(tmp, PARQUET_SCHEMA, compression="zstd") as writer:
+        for table in tables:
+            writer.write_table(table, row_group_size=PARQUET_ROW_GROUP)
+            rows += table.num_rows
+    os.replace(tmp, os.path.join(path, "part-0.parquet"))
+    return rows
+
+
+def remove_stale_partitions(directory, written, since=None):
+    """
+    Delete partitions the export didn't rewrite because LiquorSales has no
+    rows for them any more; readers glob every file under `directory`. With
+    `since` (a date), only month partitions from that month on are
+    considered. Returns the removed partition directories.
+    """
+    candidates = []
+    if since is None:
+        candidates.append(parquet_partition(directory, None))
+    first = str(since)[:7] if since else ""
+    for year_dir in sorted(os.listdir(directory)):
+        if not year_dir.startswith("year="):
+            continue
+        for month_dir in sorted(os.listdir(os.path.join(directory, year_dir))):
+            if month_dir.startswith("month=") and f"{year_dir[5:]}-{month_dir[6:]}" >= first:
+                candidates.append(os.path.join(directory, year_dir, month_dir))
+    removed = []
+    for path in candidates:
+        if path in written or not os.path.isdir(path):
+            continue
+        for name in os.listdir(path):
+            if name.startswith("part-"):
+                os.remove(os.path.join(path, name))
+        if not os.listdir(path):
+            os.rmdir(path)
+        year_path = os.path.dirname(path)
+        if year_path != directory and not os.listdir(year_path):
+            os.rmdir(year_path)
+        removed.append(path)
+    return removed
+
+
+def write_parquet_version(directory, version):
+    tmp = os.path.join(directory, PARQUET_VERSION_FILE + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump({"version": version, "exported_at": datetime.now().isoformat(timespec="seconds")}, f)
+    os.replace(tmp, os.path.join(directory, PARQUET_VERSION_FILE))
+
+
+def parquet_version(directory):
+    """data_version of the last complete export in `directory`, or None."""
+    try:
+        with open(os.path.join(directory, PARQUET_VERSION_FILE)) as f:
+            return json.load(f)["version"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _month_tables(cursor, batch_size=PARQUET_ROW_GROUP):
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield pa.Table.from_arrays(
+            [pa.array(list(col), type=field.type) for col, field in zip(zip(*rows), PARQUET_SCHEMA)],
+            schema=PARQUET_SCHEMA,
+        )
+
+
+def export_parquet(db_conn, directory, version, since=None):
+    """
+    Export LiquorSales to `directory`, one Parquet file per month, sorted by
+    date so row-group statistics let readers skip by date. With `since` (a
+    date), only the months from there on are rewritten. Partitions whose
+    rows are gone are removed, and then the export is stamped with
+    `version`, the data_version it matches.
+    """
+    os.makedirs(directory, exist_ok=True)
+    cursor = db_conn.cursor()
+    if since:
+        cursor.execute(
+            "SELECT DISTINCT date_trunc('month', date) FROM LiquorSales WHERE date >= date_trunc('month', %s::timestamp)",
+            (since,),
+        )
+    else:
+        cursor.execute("SELECT DISTINCT date_trunc('month', date) FROM LiquorSales")
+    months = sorted((r[0] for r in cursor.fetchall()), key=lambda m: (m is None, m))
+    cursor.close()
+
+    total = 0
+    written = set()
+    for month in months:
+        start = time.perf_counter()
+        with db_conn.cursor(name="parquet_export") as month_cursor:
+            month_cursor.itersize = PARQUET_ROW_GROUP
+            if month is None:
+                month_cursor.execute(f"SELECT {EXPORT_COLUMNS} FROM LiquorSales WHERE date IS NULL ORDER BY invoice_line_no")
+            else:
+                month_cursor.execute(
+                    f"SELECT {EXPORT_COLUMNS} FROM LiquorSales "
+                    "WHERE date >= %s AND date < %s + interval '1 month' ORDER BY date, invoice_line_no",
+                    (month, month),
+                )
+            rows = write_parquet_partition(directory, month, _month_tables(month_cursor))
+        written.add(parquet_partition(directory, month))
+        db_conn.commit()
+        metrics.BATCH_SECONDS.observe(time.perf_counter() - start, job="load", step="parquet")
+        metrics.BATCH_ROWS.inc(rows, job="load", step="parquet")
+        total += rows
+    metrics.write_textfile()
+    for path in remove_stale_partitions(directory, written, since):
+        print(f"Removed stale Parquet partition {path}")
+    write_parquet_version(directory, version)
+    return total
+
+
+_DONE = object()
+
+
+def _fetch_worker(source, pages, next_page, skip, last_page, stop, query):
+    """
+    Claim page numbers one at a time and push (page, rows) onto the queue
+    until the dataset runs out. Pages already checkpointed are not fetched.
+    """
+    try:
+        while not stop.is_set():
+            page = next_page()
+            if page > last_page[0]:
+                break
+            if page * PAGE_SIZE in skip:
+                continue
+            rows = source.get(DATASET_ID, limit=PAGE_SIZE, offset=page * PAGE_SIZE, **query)
+            if len(rows) == 0:
+                last_page[0] = min(last_page[0], page - 1)
+                break
+            pages.put((page, rows))
+    except Exception as e:
+        pages.put((None, e))
+    finally:
+        pages.put(_DONE)
+
+
+def run_pipeline(source, db_conn, load_page, workers=FETCH_WORKERS, queue_size=QUEUE_SIZE,
+                 where=None, checkpoint=True):
+    """
+    Fetch pages on `workers` threads while the calling thread writes them.
+    Each page is committed together with its checkpoint row, so a rerun
+    after a crash skips the full pages that were already loaded; the
+    checkpoints are cleared once every page is in. With `where`, only matching
+    rows are paged through and checkpoints are not used, since offsets into
+    a filtered result do not stay valid across runs.
+
+    Returns (rows loaded, largest (date, invoice_line_no) seen).
+    """
+    cursor = db_conn.cursor()
+    if where:
+        query = {"where": where, "order": "date, invoice_line_no"}
+    else:
+        # order by :id so the same offset always means the same rows across runs
+        query = {"order": ":id"}
+
+    skip = set()
+    if checkpoint:
+        ensure_checkpoint_table(cursor)
+        db_conn.commit()
+        skip = completed_offsets(cursor)
+        if skip:
+            print(f"Resuming: {len(skip)} pages already loaded")
+
+    pages = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    counter = iter(range(1 << 62))
+    counter_lock = threading.Lock()
+    last_page = [float("inf")]
+
+    def next_page():
+        with counter_lock:
+            return next(counter)
+
+    threads = [
+        threading.Thread(
+            target=_fetch_worker,
+            args=(source, pages, next_page, skip, last_page, stop, query),
+            daemon=True,
+        )
+        for _ in range(workers)
+    ]
+    for t in threads:
+        t.start()
+
+    finished = 0
+    total_rows = 0
+    watermark = ("", "")
+    try:
+        while finished < workers:
+            waiting = time.perf_counter()
+            item = pages.get()
+            metrics.BATCH_SECONDS.observe(time.perf_counter() - waiting, job="load", step="fetch_wait")
+            if item is _DONE:
+                finished += 1
+                continue
+            page, rows = item
+            if page is None:
+                raise rows
+
+            start = time.perf_counter()
+            load_page(cursor, rows)
+            if checkpoint:
+                record_checkpoint(cursor, page * PAGE_SIZE, len(rows))
+            db_conn.commit()
+            elapsed = time.perf_counter() - start
+            metrics.BATCH_SECONDS.observe(elapsed, job="load", step=LOAD_MODE)
+            metrics.BATCH_ROWS.inc(len(rows), job="load", step=LOAD_MODE)
+            metrics.write_textfile()
+            total_rows += len(rows)
+            watermark = max(watermark, page_watermark(rows))
+            print(f"Batch {page + 1}: {len(rows)} rows in {elapsed:.2f}s "
+                  f"({len(rows) / elapsed:,.0f} rows/s, mode={LOAD_MODE}, queued={pages.qsize()})")
+        if checkpoint:
+            clear_checkpoints(cursor)
+            db_conn.commit()
+    except BaseException:
+        db_conn.rollback()
+        stop.set()
+        # unblock fetchers waiting on a full queue so they can see the stop flag
+        while any(t.is_alive() for t in threads):
+            try:
+                pages.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        raise
+    finally:
+        cursor.close()
+
+    return total_rows, watermark
+
+
+def main():
+    # Sleep to allow MySQL time to initialize
+    print("Waiting 30 seconds for MySQL to start...")
+    time.sleep(30)
+
+    # Connect to Socrata
+    client = make_source()
+
+    # Connect to MySQL
+    print("Attempting to connect to PostgreSQL...")
+    db_conn = psycopg2.connect(
+        host="db",
+        user="root",
+        password="cs620ibdc1234",
+        dbname="IowaLiquorSales"
+    )
+
+    cursor = db_conn.cursor()
+    ensure_version_table(cursor)
+    ensure_agg_table(cursor)
     db_conn.commit()
 
-cursor.close()
-db_conn.close()
-print("Data load complete!")
+    start = time.perf_counter()
+    if SYNC_MODE == "incremental":
+        # touched groups are refreshed in the same transaction as their page
+        load_page = with_agg_refresh(upsert_rows)
+    else:
+        load_page = copy_new_rows if LOAD_MODE == "copy" else insert_rows
+    if LIQUOR_SCHEMA == "partitioned":
+        load_page = with_partitions(load_page)
+
+    previous_watermark = get_watermark(cursor)
+    if SYNC_MODE == "incremental":
+        where = watermark_filter(previous_watermark)
+        print(f"Incremental sync: {where or 'no watermark yet, pulling everything'}")
+        total_rows, watermark = run_pipeline(
+            client, db_conn, load_page, where=where, checkpoint=False
+        )
+    else:
+        total_rows, watermark = run_pipeline(client, db_conn, load_page)
+        # a run that loaded nothing leaves the aggregate (and the caches keyed on it) as they are
+        if total_rows:
+            print("Rebuilding liquorsales_monthly_agg ...")
+            with metrics.BATCH_SECONDS.time(job="load", step="rebuild_agg"):
+                rebuild_monthly_agg(cursor)
+                db_conn.commit()
+            metrics.write_textfile()
+    elapsed = time.perf_counter() - start
+
+    if total_rows:
+        version = bump_data_version(cursor, watermark)
+        db_conn.commit()
+        print(f"LiquorSales data version is now {version}")
+
+    if PARQUET_DIR:
+        cursor.execute("SELECT version FROM data_version WHERE table_name = 'liquorsales'")
+        version = cursor.fetchone()[0]
+        exported = parquet_version(PARQUET_DIR)
+        if exported != version:
+            # an incremental sync only touched the months from the old watermark on; if the
+            # export is further behind than this one load, everything is rewritten
+            since = None
+            if SYNC_MODE == "incremental" and total_rows and exported == version - 1 and previous_watermark[0]:
+                since = previous_watermark[0][:10]
+            print(f"Exporting LiquorSales to Parquet in {PARQUET_DIR} ...")
+            rows = export_parquet(db_conn, PARQUET_DIR, version, since=since)
+            print(f"Exported {rows} rows (data version {version})")
+
+    cursor.close()
+    db_conn.close()
+    print(f"Data load complete! {total_rows} rows in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
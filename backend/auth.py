@@ -2,15 +2,24 @@ from datetime import datetime, timedelta, timezone
 from typing import Annotated
 from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from pydantic import BaseModel
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from starlette import status
-from database import SessionLocal
-from models import User, RefreshToken
+from database import SessionLocal, engine
+from models import User, RefreshToken, hash_token, sweep_refresh_tokens
 from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.security.utils import get_authorization_scheme_param
 from jose import JWTError, jwt
+import metrics
+import asyncio
 import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -23,9 +32,259 @@ SECRET_KEY = os.getenv("SECRET_KEY")  # Replace with your secret key
 REFRESH_SECRET_KEY=os.getenv("REFRESH_SECRET_KEY")
 ALGORITHM = "HS256"
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt cost factor; with rehash on login, hashes made at another cost are
+# transparently re-hashed the next time their user logs in
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+REHASH_ON_LOGIN = os.getenv("REHASH_ON_LOGIN", "1") == "1"
+
+# bcrypt runs on a bounded executor, never on the event loop
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "64"))
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")  # or "process"
+
+_bcrypt_settings = {"bcrypt__default_rounds": BCRYPT_ROUNDS}
+if REHASH_ON_LOGIN:
+    _bcrypt_settings.update(bcrypt__min_rounds=BCRYPT_ROUNDS, bcrypt__max_rounds=BCRYPT_ROUNDS)
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", **_bcrypt_settings)
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl="auth/token")
 
+# verified access tokens are remembered this long (seconds), up to this many
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "30"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
+
+class TokenVerificationCache:
+    """
+    Access token -> (username, user id, token expiry, session valid until),
+    so repeated /verify-token calls skip the JWT decode and the
+    refresh_tokens query. Entries live at most `ttl` seconds and never past
+    the session; revoke_user() drops a user's entries at once. The cache is
+    per process, so other workers see a revocation within `ttl`.
+    """
+
+    def __init__(self, ttl: float = TOKEN_CACHE_TTL, max_size: int = TOKEN_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.by_user = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hash_token(token)
+
+    def get(self, token: str):
+        key = self._key(token)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or now >= entry["valid_until"]:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, token: str, username: str, user_id: int, token_exp: float, session_valid_until: float):
+        key = self._key(token)
+        entry = {
+            "username": username,
+            "id": user_id,
+            "token_exp": token_exp,
+            "valid_until": min(time.time() + self.ttl, session_valid_until),
+        }
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = entry
+            self.by_user.setdefault(user_id, set()).add(key)
+            while len(self.entries) > self.max_size:
+                self._remove(next(iter(self.entries)))
+
+    def revoke_user(self, user_id: int):
+        with self.lock:
+            for key in list(self.by_user.get(user_id, ())):
+                self._remove(key)
+
+    def _remove(self, key: bytes):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            keys = self.by_user.get(entry["id"])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.by_user[entry["id"]]
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
+
+
+token_cache = TokenVerificationCache()
+
+# expired and revoked refresh tokens are deleted every TOKEN_SWEEP_INTERVAL
+# seconds, TOKEN_SWEEP_BATCH rows per transaction
+TOKEN_SWEEP_INTERVAL = float(os.getenv("TOKEN_SWEEP_INTERVAL", "600"))
+TOKEN_SWEEP_BATCH = int(os.getenv("TOKEN_SWEEP_BATCH", "1000"))
+
+
+class SessionSweeper:
+    """
+    Background task that keeps refresh_tokens from growing without bound:
+    every login adds a row, and expired or revoked rows are never read
+    again. Deletes run in a worker thread in small batches, so logins keep
+    getting the write lock in between.
+    """
+
+    def __init__(self, interval: float = TOKEN_SWEEP_INTERVAL, batch_size: int = TOKEN_SWEEP_BATCH):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.task = None
+        self.runs = 0
+        self.deleted = 0
+        self.last_deleted = 0
+        self.last_run_ms = 0.0
+        self.errors = 0
+
+    async def sweep(self) -> int:
+        started = time.perf_counter()
+        deleted = await asyncio.to_thread(sweep_refresh_tokens, engine, int(time.time()), self.batch_size)
+        self.runs += 1
+        self.deleted += deleted
+        self.last_deleted = deleted
+        self.last_run_ms = (time.perf_counter() - started) * 1000
+        return deleted
+
+    async def _run_forever(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                # a locked or missing table shouldn't end the sweeper; try again next interval
+                self.errors += 1
+                print(f"Refresh token sweep failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self.task is None and self.interval > 0:
+            self.task = asyncio.get_running_loop().create_task(self._run_forever())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def stats(self) -> dict:
+        return {
+            "interval_seconds": self.interval,
+            "runs": self.runs,
+            "deleted": self.deleted,
+            "last_deleted": self.last_deleted,
+            "last_run_ms": self.last_run_ms,
+            "errors": self.errors,
+        }
+
+
+session_sweeper = SessionSweeper()
+
+
+def _hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_and_update(password: str, hashed: str):
+    return pwd_context.verify_and_update(password, hashed)
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt (100-300 ms of CPU per call) on a bounded executor so the
+    event loop keeps serving other requests during a login burst. At most
+    `workers` hashes run at once and up to `max_queue` more wait for a slot;
+    past that, callers get a 503 right away instead of piling up. The
+    pyca bcrypt backend releases the GIL, so threads scale across cores;
+    "process" is there for backends that don't.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_queue: int = PASSWORD_HASH_QUEUE, kind: str = PASSWORD_HASH_EXECUTOR):
+        executor_class = ProcessPoolExecutor if kind == "process" else ThreadPoolExecutor
+        self.executor = executor_class(max_workers=workers)
+        self.workers = workers
+        self.max_queue = max_queue
+        self.slots = asyncio.Semaphore(workers)
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.busy_seconds = 0.0
+
+    async def _run(self, fn, *args):
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many logins in progress, try again shortly",
+                headers={"Retry-After": "1"},
+            )
+        self.waiting += 1
+        queued_at = time.perf_counter()
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        started = time.perf_counter()
+        waited = started - queued_at
+        self.wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        metrics.STAGE_SECONDS.observe(waited, stage="auth_hash_wait")
+        self.running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.running -= 1
+            self.completed += 1
+            elapsed = time.perf_counter() - started
+            self.busy_seconds += elapsed
+            metrics.STAGE_SECONDS.observe(elapsed, stage="auth_hash")
+            self.slots.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash_password, password)
+
+    async def verify_and_update(self, password: str, hashed: str):
+        """(valid, new_hash); new_hash is set when the stored hash should be replaced."""
+        valid, new_hash = await self._run(_verify_and_update, password, hashed)
+        if new_hash:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "avg_wait_ms": 1000 * self.wait_seconds / self.completed if self.completed else 0.0,
+            "max_wait_ms": 1000 * self.max_wait_seconds,
+            "avg_hash_ms": 1000 * self.busy_seconds / self.completed if self.completed else 0.0,
+        }
+
+
+hasher = PasswordHasher()
+
 class CreateUserRequest(BaseModel):
     username: str
     password: str
@@ -35,6 +294,9 @@ class Token(BaseModel):
     refresh_token: str
     token_type: str
 
+class LogoutRequest(BaseModel):
+    refresh_token: str | None = None
+
 def get_db():
     db = SessionLocal()
     try:
@@ -47,20 +309,40 @@ db_dependency = Annotated[Session, Depends(get_db)]
 @router.post("/register", status_code=status.HTTP_201_CREATED)
 async def create_user(db: db_dependency, 
                       create_user_request: CreateUserRequest):
+    # hash before touching the database, so no connection is held across the await
+    # and the existence check and insert below run back to back
+    hashed_password = await hasher.hash(create_user_request.password)
     if db.query(User).filter(User.username == create_user_request.username).first():
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail="Username already registered")
     create_user_model = User(
         username=create_user_request.username,
-        hashed_password=pwd_context.hash(create_user_request.password),
+        hashed_password=hashed_password,
     )
     db.add(create_user_model)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        # registered by another worker between the check and the insert
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Username already registered")
 
-def authenticate_user(username: str, password: str, db):
+async def authenticate_user(username: str, password: str, db):
     user = db.query(User).filter(User.username == username).first()
-    if not user or not pwd_context.verify(password, user.hashed_password):
+    if not user:
         return False
+    hashed = user.hashed_password
+    # give the pooled connection back while bcrypt runs; a burst of logins
+    # holding connections across the await would exhaust the pool and block
+    # the event loop on checkout
+    db.rollback()
+    valid, new_hash = await hasher.verify_and_update(password, hashed)
+    if not valid:
+        return False
+    if new_hash and REHASH_ON_LOGIN:
+        user.hashed_password = new_hash
+        db.commit()
     return user
 
 def create_access_token(username: str, user_id: int, expires_delta: timedelta | None = None):
@@ -78,13 +360,14 @@ def create_refresh_token(username: str, user_id: int, expires_delta: timedelta |
         expires = datetime.now(timezone.utc) + expires_delta
     else:
         expires = datetime.now(timezone.utc) + timedelta(days=7)
-    encode.update({"exp": expires})
+    # jti keeps two logins in the same second from minting the same (unique) token
+    encode.update({"exp": expires, "jti": secrets.token_hex(8)})
     return jwt.encode(encode, REFRESH_SECRET_KEY, algorithm=ALGORITHM)
 
 @router.post("/token", response_model=Token)
 async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], 
                                  db: db_dependency):
-    user = authenticate_user(form_data.username, form_data.password, db)
+    user = await authenticate_user(form_data.username, form_data.password, db)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -96,12 +379,20 @@ async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm,
     refresh_exp = datetime.now(timezone.utc) + timedelta(minutes=60*24*14)
     db.add(RefreshToken(
         user_id=user.id, 
-        token=refresh_token, 
-        expires_at=refresh_exp,
+        token=hash_token(refresh_token),
+        expires_at=int(refresh_exp.timestamp()),
         revoked=False))
     db.commit()
     return {"access_token": token, "refresh_token" : refresh_token, "token_type": "bearer"}
 
+@router.get("/hash-stats")
+async def password_hash_stats() -> dict:
+    return hasher.stats()
+
+@router.get("/session-stats")
+async def session_stats() -> dict:
+    return session_sweeper.stats()
+
 @router.get("/verify-token")
 async def get_current_user_refresh(request: Request, db: db_dependency) -> dict:
     # 1. Get token from Authorization header
@@ -110,36 +401,66 @@ async def get_current_user_refresh(request: Request, db: db_dependency) -> dict:
 
     if not token or scheme.lower() != "bearer":
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication credentials")
-    
+
+    # 2. Tokens verified recently skip decoding and the session lookup
+    cached = token_cache.get(token)
+    if cached:
+        return verified_user(cached["username"], cached["id"], time.time() >= cached["token_exp"])
+
     try:
-        # 2. Try decoding access token (might be expired)
+        # 3. Try decoding access token (might be expired)
         payloaded = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payloaded.get("sub")
-        user_id: int = payloaded.get("id")
         token_expired = False
     except JWTError as e:   
-        # 3. Try decoding without expiration check (to extract user info)
+        # 4. Try decoding without expiration check (to extract user info)
         try:
             payloaded = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"verify_exp": False})
-            username: str = payloaded.get("sub")
-            user_id: int = payloaded.get("id")
             token_expired = True
         except JWTError:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication credentials")
-        
-    # 4. Check if refresh token exists for this user    
-    refresh_entry = db.query(RefreshToken).filter(
-        RefreshToken.user_id == user_id,
-        RefreshToken.revoked == False,
-        RefreshToken.expires_at > datetime.now(timezone.utc).timestamp()
-        ).first()
-
-    if not refresh_entry:
+    username: str = payloaded.get("sub")
+    user_id: int = payloaded.get("id")
+
+    # 5. Check if an unrevoked refresh token exists for this user
+    # (served by ix_refresh_tokens_user_revoked_expires)
+    with metrics.STAGE_SECONDS.time(stage="auth_session_lookup"):
+        session_valid_until = db.query(func.max(RefreshToken.expires_at)).filter(
+            RefreshToken.user_id == user_id,
+            RefreshToken.revoked == False,
+            RefreshToken.expires_at > int(time.time())
+            ).scalar()
+
+    if not session_valid_until:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Session expired or invalid")
 
-    # 5. If token was expired, issue a new one
+    token_cache.put(token, username, user_id, payloaded.get("exp", 0), session_valid_until)
+
+    # 6. If token was expired, issue a new one
+    return verified_user(username, user_id, token_expired)
+
+def verified_user(username: str, user_id: int, token_expired: bool) -> dict:
     if token_expired:
         new_access_token = create_access_token(username, user_id, timedelta(minutes=15))
         return {"username": username, "id": user_id, "new_access_token": new_access_token}
     
-    return {"username": username, "id": user_id}
\ No newline at end of file
+    return {"username": username, "id": user_id}
+
+@router.post("/logout")
+async def logout(request: Request, db: db_dependency, logout_request: LogoutRequest | None = None):
+    """Revoke the given refresh token, or every session of the caller, and forget cached verifications."""
+    scheme, token = get_authorization_scheme_param(request.headers.get("Authorization"))
+    if not token or scheme.lower() != "bearer":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication credentials")
+    try:
+        payloaded = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"verify_exp": False})
+    except JWTError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication credentials")
+    user_id: int = payloaded.get("id")
+
+    revoke = db.query(RefreshToken).filter(RefreshToken.user_id == user_id, RefreshToken.revoked == False)
+    if logout_request and logout_request.refresh_token:
+        revoke = revoke.filter(RefreshToken.token == hash_token(logout_request.refresh_token))
+    revoked = revoke.update({"revoked": True}, synchronize_session=False)
+    db.commit()
+    token_cache.revoke_user(user_id)
+    return {"revoked": revoked}
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "duckdb" runs generated SELECTs on an embedded DuckDB over the Parquet export
+# DataLoader.py writes to PARQUET_DIR; anything it can't run goes to PostgreSQL
+SQL_ENGINE = os.getenv("SQL_ENGINE", "postgres")
+PARQUET_DIR = os.getenv("PARQUET_DIR", "parquet")
+DUCKDB_THREADS = int(os.getenv("DUCKDB_THREADS", "4"))
+DUCKDB_MEMORY_LIMIT = os.getenv("DUCKDB_MEMORY_LIMIT", "1GB")
+# how often a missing or outdated export is looked for again
+PARQUET_RECHECK_SECONDS = float(os.getenv("PARQUET_RECHECK_SECONDS", "5"))
+
+# same file DataLoader.py writes once an export is complete
+PARQUET_VERSION_FILE = "_data_version.json"
+
+# string literals and quoted identifiers are left alone when rewriting binds
+_QUOTED = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+# SQLAlchemy-style :name binds, but not ::casts
+_BIND = re.compile(r"(?<![:\w]):(\w+)")
+_SELECT = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+_LIQUORSALES = re.compile(r"\bliquorsales\b", re.IGNORECASE)
+
+
+class UnsupportedQuery(Exception):
+    """DuckDB can't run this SQL (or has no current export); run it on PostgreSQL instead."""
+
+
+def to_duckdb_sql(sql: str) -> str:
+    """Rewrite :name binds to DuckDB's $name, outside quotes."""
+    parts = _QUOTED.split(sql.strip().rstrip(";"))
+    for i in range(0, len(parts), 2):
+        parts[i] = _BIND.sub(r"$\1", parts[i])
+    return "".join(parts)
+
+
+def read_only_select(sql: str) -> bool:
+    """A single SELECT (or WITH ... SELECT) statement over liquorsales."""
+    unquoted = "".join(_QUOTED.split(sql.strip().rstrip(";"))[::2])
+    return bool(_SELECT.match(unquoted)) and ";" not in unquoted and bool(_LIQUORSALES.search(unquoted))
+
+
+class ParquetEngine:
+    """
+    Embedded DuckDB over the Parquet export of LiquorSales, exposed as a
+    `liquorsales` view with the PostgreSQL table's columns. Only used while
+    the export matches the current data_version; DuckDB errors surface as
+    UnsupportedQuery so the caller can fall back to PostgreSQL.
+
+    The database is locked down when it is opened: it can only read files
+    under `directory` and its settings can't be changed from SQL.
+    Integer division truncates as in PostgreSQL.
+    """
+
+    def __init__(
+        self,
+        directory: str = PARQUET_DIR,
+        threads: int = DUCKDB_THREADS,
+        memory_limit: str = DUCKDB_MEMORY_LIMIT,
+        recheck_seconds: float = PARQUET_RECHECK_SECONDS
+    ):
+        import duckdb
+
+        self.duckdb = duckdb
+        self.directory = os.path.abspath(directory)
+        self.recheck_seconds = recheck_seconds
+        self.conn = duckdb.connect(config={
+            "threads": threads,
+            "memory_limit": memory_limit,
+            "integer_division": True,
+        })
+        allowed = self.directory.replace("'", "''")
+        self.conn.execute(f"SET allowed_directories = ['{allowed}']")
+        self.conn.execute("SET enable_external_access = false")
+        self.conn.execute("SET lock_configuration = true")
+
+        self.version: Optional[int] = None
+        self.version_checked = float("-inf")
+        self.has_view = False
+        self.queries = 0
+        self.fallbacks = 0
+
+    def _read_version(self) -> Optional[int]:
+        try:
+            with open(os.path.join(self.directory, PARQUET_VERSION_FILE)) as f:
+                return json.load(f)["version"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _create_view(self):
+        # read_parquet needs at least one file to bind, so this waits for the first export
+        pattern = os.path.join(self.directory, "**", "*.parquet").replace("'", "''")
+        self.conn.execute(
+            f"CREATE OR REPLACE VIEW liquorsales AS SELECT * FROM read_parquet('{pattern}', hive_partitioning = false)"
+        )
+        self.has_view = True
+
+    def serves(self, data_version: Optional[int]) -> bool:
+        """Whether the export on disk is of `data_version`; re-reads its marker at most every recheck_seconds."""
+        if data_version is None:
+            return False
+        now = time.monotonic()
+        if self.version != data_version and now - self.version_checked >= self.recheck_seconds:
+            self.version = self._read_version()
+            self.version_checked = now
+            if self.version is not None and not self.has_view:
+                self._create_view()
+        return self.version == data_version
+
+    def execute(
+        self,
+        sql: str,
+        params: Optional[Dict[str, Any]] = None,
+        row_cap: int = 1000
+    ) -> Tuple[List[str], List[tuple], bool]:
+        """(columns, rows, truncated) with at most `row_cap` rows. Blocking; see run()."""
+        if not read_only_select(sql):
+            raise UnsupportedQuery("not a single SELECT over liquorsales")
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(to_duckdb_sql(sql), params or {})
+            keys = [d[0] for d in cursor.description]
+            rows = cursor.fetchmany(row_cap + 1)
+        except self.duckdb.Error as e:
+            raise UnsupportedQuery(str(e)) from e
+        finally:
+            cursor.close()
+        return keys, rows[:row_cap], len(rows) > row_cap
+
+    async def run(
+        self,
+        sql: str,
+        params: Optional[Dict[str, Any]] = None,
+        row_cap: int = 1000
+    ) -> Tuple[List[str], List[tuple], bool]:
+        """execute() on a worker thread, so the event loop keeps serving while DuckDB scans."""
+        self.queries += 1
+        try:
+            return await asyncio.to_thread(self.execute, sql, params, row_cap)
+        except UnsupportedQuery:
+            self.fallbacks += 1
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "directory": self.directory,
+            "version": self.version,
+            "queries": self.queries,
+            "fallbacks": self.fallbacks,
+        }
+
+    def close(self):
+        self.conn.close()
+
+
+def get_sql_engine(engine: str = None) -> Optional[ParquetEngine]:
+    """The DuckDB engine when SQL_ENGINE=duckdb, else None (everything runs on PostgreSQL)."""
+    engine = engine or SQL_ENGINE
+    if engine == "duckdb":
+        return ParquetEngine()
+    return None
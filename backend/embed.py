@@ -1,22 +1,30 @@
 import os
+import json
 import uvicorn
-from typing import Optional
+from typing import List, Optional
 from fastapi import FastAPI
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 
-from langchain.embeddings import OpenAIEmbeddings
+from langchain.embeddings.base import Embeddings
 from langchain.vectorstores import PGVector
 from langchain.chat_models import ChatOpenAI
 from langchain.chains import RetrievalQA
 from langchain.docstore.document import Document
 
+import numpy as np
 import sqlalchemy
 import psycopg2
 
 import time
 
+import metrics
+from embeddings import get_embeddings
+from embedding_pool import EmbeddingPool
+from record_index import RecordIndex, record_key, content_hash, to_hex
+from vector_writer import BulkVectorWriter
+
 
 load_dotenv()
 openai_api_key = os.getenv("OPENAI_API_KEY")
@@ -31,40 +39,9 @@ def get_db_connection():
 
 
 
-def build_pgvector_store(
-    connection_string: str,
-    collection_name: str = "vector_embeds",
-    table_name: str = "liquorsales",
-    embeddings_batch_size: int = 2000,
-    sql_batch_size = 16000,
-    max_rows: int = 2622712
-):
-    
-    # creating embeddings instance and PGVector store object
-    embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key)
-    vectorstore = PGVector(
-        connection_string=connection_string,
-        collection_name=collection_name,        
-        embedding_function=embeddings,
-    )
-
-    existing_ids = set()
-    with psycopg2.connect(connection_string) as pgconn:
-        with pgconn.cursor() as cur:
-            metadata_query = f"SELECT metadata->>'record_id' FROM {collection_name};"
-            cur.execute(metadata_query)
-            rows = cur.fetchall()
-            existing_ids = {r[0] for r in rows if r[0] is not None}
-
-
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    sql_offset = 0
-    total_processed = 0
-
-    while total_processed < max_rows:
-        query_batch = f"""
+# Full aggregation straight from the sales table: the from_aggregate=False path,
+# which build_pgvector_store also takes when liquorsales_monthly_agg doesn't exist
+GROUPED_QUERY = """
 WITH grouped_data AS (
     SELECT
         name,
@@ -86,6 +63,7 @@ WITH grouped_data AS (
     GROUP BY name, im_desc, DATE_TRUNC('month', date), category_name
 )
 SELECT
+    NULL::bigint AS agg_id,
     name AS store_name,
     city,
     zipcode,
@@ -102,73 +80,360 @@ SELECT
     common_pack
 FROM grouped_data
 ORDER BY name, im_desc, month, first_invoice
-LIMIT {sql_batch_size} OFFSET {sql_offset};
 """
-        cursor.execute(query_batch)
-        batch_results = cursor.fetchall()
 
-        if not batch_results:
+# Groups DataLoader.py added or changed since they were last embedded
+DIRTY_AGG_QUERY = """
+SELECT
+    id AS agg_id,
+    name AS store_name,
+    city,
+    zipcode,
+    county,
+    month,
+    category_name,
+    im_desc AS item_description,
+    vendor_names,
+    total_orders,
+    total_bottles,
+    total_sales,
+    total_liters,
+    avg_bottle_volume,
+    common_pack
+FROM liquorsales_monthly_agg
+WHERE dirty
+ORDER BY name, im_desc, month, first_invoice
+"""
+
+
+def purge_removed_groups(connection, writer: BulkVectorWriter) -> int:
+    """
+    Delete the embeddings of groups DataLoader.py emptied during incremental
+    syncs (liquorsales_monthly_agg_removed), then those queue rows. Returns
+    how many groups were purged.
+    """
+    with connection.cursor() as cur:
+        cur.execute("SELECT to_regclass('liquorsales_monthly_agg_removed')")
+        if cur.fetchone()[0] is None:
+            return 0
+        cur.execute("SELECT id, name, im_desc, month, category_name FROM liquorsales_monthly_agg_removed")
+        rows = cur.fetchall()
+    if not rows:
+        return 0
+    writer.delete([
+        to_hex(record_key(store_name, item_description, month, category_name))
+        for _, store_name, item_description, month, category_name in rows
+    ])
+    with connection.cursor() as cur:
+        cur.execute("DELETE FROM liquorsales_monthly_agg_removed WHERE id = ANY(%s)", ([r[0] for r in rows],))
+    connection.commit()
+    return len(rows)
+
+
+def iter_grouped_rows(
+    conn,
+    table_name: str = "liquorsales",
+    batch_size: int = 16000,
+    from_aggregate: bool = True
+):
+    """
+    Stream per-store/item/month groups in batches through a server-side
+    (named) cursor. By default only the dirty rows of liquorsales_monthly_agg
+    are read; otherwise the aggregation runs once over `table_name`.
+    """
+    if from_aggregate:
+        query = DIRTY_AGG_QUERY
+    else:
+        query = GROUPED_QUERY.format(table_name=table_name)
+    with conn.cursor(name="embed_grouped_rows") as cursor:
+        cursor.itersize = batch_size
+        cursor.execute(query)
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            yield batch
+
+
+# metadata stored with every summary, in this key order
+METADATA_KEYS = (
+    "record_id", "record_key", "content_hash", "store_name", "item_description",
+    "category_name", "month", "city", "county", "zipcode",
+)
+
+
+def _encode_unique(values, encode) -> list:
+    """encode() applied once per distinct value; store, city and month values repeat a lot."""
+    cache = {}
+    out = []
+    for value in values:
+        try:
+            out.append(cache[value])
+        except KeyError:
+            out.append(cache.setdefault(value, encode(value)))
+    return out
+
+
+class SummaryBatch:
+    """
+    Summaries of one batch of groups as parallel columns: record ids, summary
+    texts, uint64 record keys / content hashes, and one list per metadata
+    field. Chunks of it go to the embedding pool and the vector writer as
+    is; Documents are only built by documents() for LangChain callers.
+    """
+
+    def __init__(self, texts: list, keys: np.ndarray, contents: np.ndarray, columns: dict):
+        self.texts = texts
+        self.keys = keys
+        self.contents = contents
+        self.columns = columns
+        self.ids = [to_hex(key) for key in keys.tolist()]
+
+    def __len__(self):
+        return len(self.texts)
+
+    def slice(self, start: int, stop: int) -> "SummaryBatch":
+        chunk = SummaryBatch.__new__(SummaryBatch)
+        chunk.texts = self.texts[start:stop]
+        chunk.keys = self.keys[start:stop]
+        chunk.contents = self.contents[start:stop]
+        chunk.columns = {name: col[start:stop] for name, col in self.columns.items()}
+        chunk.ids = self.ids[start:stop]
+        return chunk
+
+    def _metadata_columns(self) -> list:
+        content_ids = [to_hex(content) for content in self.contents.tolist()]
+        return [self.ids, self.ids, content_ids] + [self.columns[name] for name in METADATA_KEYS[3:]]
+
+    def metadata_json(self) -> List[str]:
+        """Metadata of every row as a JSON string, the same text json.dumps gives for metadatas()."""
+        encode = lambda value: json.dumps(value, default=str)
+        ids = [f'"{record_id}"' for record_id in self.ids]
+        content_ids = [f'"{content:016x}"' for content in self.contents.tolist()]
+        encoded = [ids, ids, content_ids] + [
+            _encode_unique(self.columns[name], encode) for name in METADATA_KEYS[3:]
+        ]
+        names = [json.dumps(name) + ": " for name in METADATA_KEYS]
+        return [
+            "{" + ", ".join([name + value for name, value in zip(names, values)]) + "}"
+            for values in zip(*encoded)
+        ]
+
+    def metadatas(self) -> List[dict]:
+        return [dict(zip(METADATA_KEYS, values)) for values in zip(*self._metadata_columns())]
+
+    def documents(self) -> List[Document]:
+        return [
+            Document(page_content=text, metadata=metadata)
+            for text, metadata in zip(self.texts, self.metadatas())
+        ]
+
+
+def summarize_columns(batch_results, embedded: RecordIndex):
+    """
+    (SummaryBatch, changed record ids) for one batch of grouped rows: the
+    summary of every group that is new or whose summary changed since it
+    was embedded. Groups already embedded unchanged are skipped.
+
+    Works column by column: values that repeat across groups (months,
+    stores, cities) are formatted once, and the record index is checked
+    for the whole batch in one vectorized lookup.
+    """
+    if not batch_results:
+        empty = np.empty(0, dtype=np.uint64)
+        return SummaryBatch([], empty, empty, {name: [] for name in METADATA_KEYS[3:]}), []
+
+    (agg_ids, store_names, cities, zipcodes, counties, months, category_names,
+        item_descriptions, vendor_names, total_orders, total_bottles, total_sales,
+        total_liters, avg_vols, common_packs) = zip(*batch_results)
+
+    month_names = _encode_unique(months, lambda month: month.strftime("%B %Y"))
+    texts = [
+        f"In {month_name}, {store_name} in {city}, {county} (ZIP: {zipcode}) sold "
+        f"{int(bottles)} bottles of \"{item_description}\" ({category_name}) for a total of ${sales:,.2f}. "
+        f"This was across {orders} orders. Average bottle size was {int(avg_vol)}ml, usually in {pack}-packs. "
+        f"Vendors included: {vendors}. Total volume: {int(liters)} liters."
+        for (month_name, store_name, city, county, zipcode, bottles, item_description, category_name,
+             sales, orders, avg_vol, pack, vendors, liters)
+        in zip(month_names, store_names, cities, counties, zipcodes, total_bottles, item_descriptions,
+               category_names, total_sales, total_orders, avg_vols, common_packs, vendor_names, total_liters)
+    ]
+    key_list = [
+        record_key(store_name, item_description, month, category_name)
+        for store_name, item_description, month, category_name
+        in zip(store_names, item_descriptions, months, category_names)
+    ]
+    keys = np.array(key_list, dtype=np.uint64)
+    contents = np.array([content_hash(key, text) for key, text in zip(key_list, texts)], dtype=np.uint64)
+
+    found, stored = embedded.lookup_many(keys)
+    unchanged = found & (stored == contents)
+    changed_ids = [to_hex(key) for key in keys[found & ~unchanged].tolist()]
+
+    columns = {
+        "store_name": store_names,
+        "item_description": item_descriptions,
+        "category_name": category_names,
+        "month": _encode_unique(months, lambda month: month.strftime("%Y-%m")),
+        "city": cities,
+        "county": counties,
+        "zipcode": zipcodes,
+    }
+    if unchanged.any():
+        keep = np.flatnonzero(~unchanged).tolist()
+        texts = [texts[i] for i in keep]
+        keys = keys[keep]
+        contents = contents[keep]
+        columns = {name: [col[i] for i in keep] for name, col in columns.items()}
+    else:
+        columns = {name: list(col) for name, col in columns.items()}
+    return SummaryBatch(texts, keys, contents, columns), changed_ids
+
+
+def summarize_groups(batch_results, embedded: RecordIndex):
+    """
+    (documents, changed record ids) for one batch of grouped rows, as
+    LangChain Documents; see summarize_columns.
+    """
+    batch, changed_ids = summarize_columns(batch_results, embedded)
+    return batch.documents(), changed_ids
+
+
+def build_pgvector_store(
+    connection_string: str,
+    collection_name: str = "vector_embeds",
+    table_name: str = "liquorsales",
+    embeddings_batch_size: int = 2000,
+    sql_batch_size = 16000,
+    max_rows: int = 2622712,
+    from_aggregate: bool = True,
+    embeddings: Optional[Embeddings] = None,
+    rebuild_index: bool = True
+):
+    
+    # creating embeddings instance and PGVector store object
+    embeddings = embeddings or get_embeddings()
+    pool = EmbeddingPool(embeddings)
+    vectorstore = PGVector(
+        connection_string=connection_string,
+        collection_name=collection_name,        
+        embedding_function=embeddings,
+    )
+    # vectors are COPYed straight into the collection tables; the ANN index
+    # keeps serving searches during the load and is rebuilt once at the end
+    writer = BulkVectorWriter(connection_string, collection_name)
+
+    if from_aggregate:
+        with psycopg2.connect(connection_string) as pgconn, pgconn.cursor() as cur:
+            cur.execute("SELECT to_regclass('liquorsales_monthly_agg')")
+            from_aggregate = cur.fetchone()[0] is not None
+        if not from_aggregate:
+            print(f"liquorsales_monthly_agg does not exist; aggregating {table_name} directly")
+
+    # one-time cleanup: rows embedded before summaries carried a record_key are re-embedded keyed
+    unkeyed = writer.delete_unkeyed()
+    if unkeyed:
+        print(f"Removed {unkeyed} embeddings without a record_key; their groups are embedded again")
+        if from_aggregate:
+            # which groups they were isn't known; summaries that are still keyed are skipped below
+            with psycopg2.connect(connection_string) as pgconn, pgconn.cursor() as cur:
+                cur.execute("UPDATE liquorsales_monthly_agg SET dirty = true WHERE NOT dirty")
+
+    # groups emptied by incremental syncs; a group that came back is dirty and embedded again below
+    if from_aggregate:
+        with psycopg2.connect(connection_string) as pgconn:
+            purged = purge_removed_groups(pgconn, writer)
+        if purged:
+            print(f"Removed the embeddings of {purged} groups that no longer have rows")
+
+    # (group key hash, summary hash) of everything already in the collection
+    with psycopg2.connect(connection_string) as pgconn:
+        embedded = RecordIndex.load(pgconn, collection_name)
+    print(f"{len(embedded)} records already embedded ({embedded.nbytes / 1e6:.1f} MB index)")
+
+
+    conn = get_db_connection()
+    # separate connection so marking groups clean doesn't end the named cursor's transaction
+    mark_conn = psycopg2.connect(connection_string)
+
+    total_processed = 0
+
+    # batch timings go to METRICS_TEXTFILE (when set) after every SQL batch
+    mark = time.perf_counter()
+    for batch_results in iter_grouped_rows(conn, table_name, sql_batch_size, from_aggregate):
+        metrics.BATCH_SECONDS.observe(time.perf_counter() - mark, job="embed", step="fetch")
+        metrics.BATCH_ROWS.inc(len(batch_results), job="embed", step="fetch")
+        if total_processed >= max_rows:
             break
 
-        documents = []
-        for row in batch_results:
-            (store_name, city, zipcode, county, month, category_name,
-                        item_description, vendor_names, total_orders,
-                        total_bottles, total_sales, total_liters,
-                        avg_vol, common_pack
-                    ) = row
-            
-            record_id = str(row[0])
-
-            if record_id in existing_ids:
-                continue
-
-            summary = (
-                        f"In {month.strftime('%B %Y')}, {store_name} in {city}, {county} (ZIP: {zipcode}) sold "
-                        f"{int(total_bottles)} bottles of \"{item_description}\" ({category_name}) for a total of ${total_sales:,.2f}. "
-                        f"This was across {total_orders} orders. Average bottle size was {int(avg_vol)}ml, usually in {common_pack}-packs. "
-                        f"Vendors included: {vendor_names}. Total volume: {int(total_liters)} liters."
-                    )
-            doc = Document(
-                        page_content=summary,
-                        metadata={
-                            "record_id": record_id,
-                            "store_name": store_name,
-                            "item_description": item_description,
-                            "category_name": category_name,
-                            "month": month.strftime("%Y-%m"),
-                            "city": city,
-                            "county": county,
-                            "zipcode": zipcode
-                        }
-                    )
-            documents.append(doc)
-
-        for i in range(0, len(documents), embeddings_batch_size):
-            chunk = documents[i:i + embeddings_batch_size]
-            if chunk:
-                vectorstore.add_documents(chunk)
-                for doc in chunk:
-                    existing_ids.add(doc.metadata["record_id"])
-                time.sleep(3)
-                print(f"Embedded {len(chunk)} documents; total embedded so far = {total_processed + len(chunk)}")
-
-        sql_offset += sql_batch_size
-        total_processed += len(documents)
-        
-
-    cursor.close()
+        batch, changed_ids = summarize_columns(batch_results, embedded)
+
+        # summaries that changed replace their old embedding
+        if changed_ids:
+            writer.delete(changed_ids)
+
+        # chunks are embedded concurrently by the pool (rate limited there);
+        # vectors are written here as each chunk comes back
+        chunks = (
+            (chunk, chunk.texts)
+            for chunk in (
+                batch.slice(i, i + embeddings_batch_size)
+                for i in range(0, len(batch), embeddings_batch_size)
+            )
+        )
+        written = 0
+        waiting = time.perf_counter()
+        for chunk, vectors in pool.map(chunks):
+            metrics.BATCH_SECONDS.observe(time.perf_counter() - waiting, job="embed", step="embed")
+            metrics.BATCH_ROWS.inc(len(chunk), job="embed", step="embed")
+            with metrics.BATCH_SECONDS.time(job="embed", step="write"):
+                writer.write(
+                    ids=chunk.ids,
+                    embeddings=vectors,
+                    documents=chunk.texts,
+                    metadatas=chunk.metadata_json(),
+                )
+            embedded.add_many(chunk.keys, chunk.contents)
+            written += len(chunk)
+            print(f"Embedded {len(chunk)} documents; total embedded so far = {total_processed + written} "
+                  f"(writing at {writer.docs_per_second:,.0f} docs/s)")
+            waiting = time.perf_counter()
+
+        total_processed += len(batch)
+
+        if from_aggregate:
+            with mark_conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE liquorsales_monthly_agg SET dirty = false WHERE id = ANY(%s)",
+                    ([row[0] for row in batch_results],)
+                )
+            mark_conn.commit()
+
+        metrics.write_textfile()
+        mark = time.perf_counter()
+
+    if rebuild_index:
+        print("Building ANN index ...")
+        with metrics.BATCH_SECONDS.time(job="embed", step="build_index"):
+            built = writer.build_index()
+        if built:
+            print("ANN index swapped in")
+        metrics.write_textfile()
+    writer.close()
+
+    mark_conn.close()
     conn.close()
 
     return vectorstore
 
 
-vectorstore = build_pgvector_store(
-        connection_string=db_connection_string,
-        collection_name="vector_embeds",  
-        table_name="liquorsales",         
-        embeddings_batch_size=2000,
-        sql_batch_size = 16000,
-        max_rows=2622712
-    )
-print("Vector store ready.")
\ No newline at end of file
+if __name__ == "__main__":
+    vectorstore = build_pgvector_store(
+            connection_string=db_connection_string,
+            collection_name="vector_embeds",
+            table_name="liquorsales",
+            embeddings_batch_size=2000,
+            sql_batch_size = 16000,
+            max_rows=2622712
+        )
+    print("Vector store ready.")
\ No newline at end of file
@@ -0,0 +1,230 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+import numpy as np
+
+from langchain.embeddings.base import Embeddings
+
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", ".embedding_cache")
+EMBEDDING_CACHE_MB = int(os.getenv("EMBEDDING_CACHE_MB", "1024"))
+
+# One entry per vector row: 128-bit content key, whether the slot holds a vector, last use
+INDEX_DTYPE = np.dtype([("hi", "<u8"), ("lo", "<u8"), ("used", "?"), ("last_used", "<f8")])
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps any LangChain Embeddings with a persistent cache keyed by
+    hash(model, text). Vectors live in a memory-mapped float32 matrix
+    (vectors.f32) whose rows are described by a memory-mapped index
+    (index.bin); both are sized once from `max_mb`. When the cache is full
+    the least recently used rows are overwritten.
+
+    Several processes can share a directory: writers hold an exclusive flock
+    on the lock file, readers a shared one, and a generation counter in
+    state.bin tells each process when to rebuild its in-memory key map.
+    """
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        directory: str = EMBEDDING_CACHE_DIR,
+        max_mb: int = EMBEDDING_CACHE_MB,
+        model_name: str = None
+    ):
+        self.underlying = underlying
+        self.directory = directory
+        self.max_bytes = max_mb * 1024 * 1024
+        self.model_name = model_name or getattr(underlying, "model", None) or type(underlying).__name__
+        os.makedirs(directory, exist_ok=True)
+
+        self.lock = threading.RLock()
+        self.lock_file = open(os.path.join(directory, "lock"), "a+")
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.vectors = None
+        self.index = None
+        self.state = None
+        self.slots: Dict[int, int] = {}
+        self.generation = -1
+        self.hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _open(self) -> bool:
+        if self.vectors is not None:
+            return True
+        if not os.path.exists(self.meta_path):
+            return False
+        with open(self.meta_path) as f:
+            meta = json.load(f)
+        self.dim = meta["dim"]
+        self.capacity = meta["capacity"]
+        self.vectors = np.memmap(self._path("vectors.f32"), dtype=np.float32, mode="r+", shape=(self.capacity, self.dim))
+        self.index = np.memmap(self._path("index.bin"), dtype=INDEX_DTYPE, mode="r+", shape=(self.capacity,))
+        self.state = np.memmap(self._path("state.bin"), dtype=np.int64, mode="r+", shape=(1,))
+        return True
+
+    def _create(self, dim: int):
+        # caller holds the exclusive lock; another process may have created the files first
+        if self._open():
+            return
+        capacity = max(1, self.max_bytes // (dim * 4))
+        np.memmap(self._path("vectors.f32"), dtype=np.float32, mode="w+", shape=(capacity, dim)).flush()
+        np.memmap(self._path("index.bin"), dtype=INDEX_DTYPE, mode="w+", shape=(capacity,)).flush()
+        np.memmap(self._path("state.bin"), dtype=np.int64, mode="w+", shape=(1,)).flush()
+        # meta.json last: its presence means the files are complete
+        with open(self.meta_path, "w") as f:
+            json.dump({"dim": dim, "capacity": capacity}, f)
+        self._open()
+
+    def _reload(self):
+        """Rebuild the key -> row map if another writer changed the index."""
+        generation = int(self.state[0])
+        if generation == self.generation:
+            return
+        used = np.flatnonzero(self.index["used"])
+        hi = self.index["hi"][used].tolist()
+        lo = self.index["lo"][used].tolist()
+        self.slots = {(h << 64) | l: slot for h, l, slot in zip(hi, lo, used.tolist())}
+        self.generation = generation
+
+    def _key(self, kind: str, text: str) -> int:
+        h = hashlib.blake2b(digest_size=16)
+        h.update(self.model_name.encode("utf-8"))
+        h.update(b"\x00")
+        h.update(kind.encode("utf-8"))
+        h.update(b"\x00")
+        h.update(text.encode("utf-8"))
+        return int.from_bytes(h.digest(), "big")
+
+    def _lookup(self, keys: List[int]) -> Dict[int, List[float]]:
+        found = {}
+        with self.lock:
+            if not self._open():
+                return found
+            hit = {}
+            with self._file_lock(exclusive=False):
+                self._reload()
+                for i, key in enumerate(keys):
+                    slot = self.slots.get(key)
+                    if slot is not None:
+                        found[i] = self.vectors[slot].tolist()
+                        hit[slot] = key
+            if hit:
+                # recency is written under the exclusive lock, like every other index write;
+                # a slot another process reused in between is left alone
+                with self._file_lock(exclusive=True):
+                    now = time.time()
+                    for slot, key in hit.items():
+                        rec = self.index[slot]
+                        if rec["used"] and (int(rec["hi"]) << 64) | int(rec["lo"]) == key:
+                            self.index["last_used"][slot] = now
+        return found
+
+    def _store(self, keys: List[int], vectors: List[List[float]]):
+        if not vectors:
+            return
+        with self.lock:
+            with self._file_lock(exclusive=True):
+                if not self._open():
+                    self._create(len(vectors[0]))
+                self._reload()
+
+                new = {}
+                for key, vec in zip(keys, vectors):
+                    if key not in self.slots and len(vec) == self.dim:
+                        new[key] = vec
+                if not new:
+                    return
+
+                used = self.index["used"]
+                free = np.flatnonzero(~used)
+                need = min(len(new), self.capacity) - len(free)
+                if need > 0:
+                    # evict the least recently used rows
+                    taken = np.flatnonzero(used)
+                    last_used = self.index["last_used"][taken]
+                    oldest = taken[np.argpartition(last_used, need - 1)[:need]]
+                    for slot in oldest.tolist():
+                        rec = self.index[slot]
+                        self.slots.pop((int(rec["hi"]) << 64) | int(rec["lo"]), None)
+                    self.index["used"][oldest] = False
+                    free = np.concatenate([free, oldest])
+
+                now = time.time()
+                for (key, vec), slot in zip(new.items(), free.tolist()):
+                    self.vectors[slot] = vec
+                    self.index[slot] = (key >> 64, key & 0xFFFFFFFFFFFFFFFF, True, now)
+                    self.slots[key] = slot
+                self.vectors.flush()
+                self.index.flush()
+                self.state[0] += 1
+                self.state.flush()
+                self.generation = int(self.state[0])
+
+    def _embed(self, kind: str, texts: List[str], compute) -> List[List[float]]:
+        keys = [self._key(kind, t) for t in texts]
+        found = self._lookup(keys)
+        missing = [i for i in range(len(texts)) if i not in found]
+        self.hits += len(found)
+        self.misses += len(missing)
+        if missing:
+            computed = compute([texts[i] for i in missing])
+            self._store([keys[i] for i in missing], computed)
+            for i, vec in zip(missing, computed):
+                found[i] = vec
+        return [found[i] for i in range(len(texts))]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed("document", texts, self.underlying.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed("query", [text], lambda t: [self.underlying.embed_query(t[0])])[0]
+
+    async def _aembed(self, kind: str, texts: List[str], compute) -> List[List[float]]:
+        # lookups and stores take a file lock and may flush the memmaps, so they run on a
+        # worker thread like the provider call's wait, never on the event loop
+        keys = [self._key(kind, t) for t in texts]
+        found = await asyncio.to_thread(self._lookup, keys)
+        missing = [i for i in range(len(texts)) if i not in found]
+        self.hits += len(found)
+        self.misses += len(missing)
+        if missing:
+            computed = await compute([texts[i] for i in missing])
+            await asyncio.to_thread(self._store, [keys[i] for i in missing], computed)
+            for i, vec in zip(missing, computed):
+                found[i] = vec
+        return [found[i] for i in range(len(texts))]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self._aembed("document", texts, self.underlying.aembed_documents)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        async def compute(t):
+            return [await self.underlying.aembed_query(t[0])]
+        return (await self._aembed("query", [text], compute))[0]
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.slots),
+            "capacity": getattr(self, "capacity", 0),
+        }
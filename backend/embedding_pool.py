@@ -0,0 +1,180 @@
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterable, Iterator, List, Tuple
+
+import tiktoken
+
+from langchain.embeddings.base import Embeddings
+
+# Provider limits the limiter ramps up to; defaults match OpenAI tier-1 embedding limits
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "4"))
+EMBED_RPM = float(os.getenv("EMBED_RPM", "3000"))
+EMBED_TPM = float(os.getenv("EMBED_TPM", "1000000"))
+
+_encoding = None
+
+
+def count_tokens(texts: List[str]) -> int:
+    """Token count for rate limiting; ~4 characters per token if tiktoken can't load its BPE file."""
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    if _encoding is False:
+        return sum(len(t) for t in texts) // 4 + len(texts)
+    return sum(len(t) for t in _encoding.encode_batch(texts, disallowed_special=()))
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` units per second, bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount: float = 1.0):
+        # a request bigger than the bucket waits for a full bucket and then overdraws it
+        amount_needed = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= amount_needed:
+                    self.tokens -= amount
+                    return
+                wait_for = (amount_needed - self.tokens) / self.rate
+            time.sleep(min(wait_for, 1.0))
+
+    def set_rate(self, rate: float):
+        with self.lock:
+            self._refill()
+            self.rate = rate
+
+
+class AdaptiveRateLimiter:
+    """
+    Request and token buckets whose rates follow AIMD: every success raises
+    them by `increase` of the configured maximum, every 429 halves them and
+    pauses all callers for the provider's Retry-After (or a short backoff).
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = EMBED_RPM,
+        tokens_per_minute: float = EMBED_TPM,
+        start_fraction: float = 0.5,
+        min_fraction: float = 0.05,
+        increase: float = 0.05
+    ):
+        self.max_rps = requests_per_minute / 60.0
+        self.max_tps = tokens_per_minute / 60.0
+        self.min_fraction = min_fraction
+        self.increase = increase
+        self.fraction = start_fraction
+        self.requests = TokenBucket(self.max_rps * start_fraction, max(1.0, self.max_rps))
+        self.tokens = TokenBucket(self.max_tps * start_fraction, self.max_tps)
+        self.paused_until = 0.0
+        self.rate_limited = 0
+        self.lock = threading.Lock()
+
+    def _apply(self):
+        self.requests.set_rate(self.max_rps * self.fraction)
+        self.tokens.set_rate(self.max_tps * self.fraction)
+
+    def acquire(self, tokens: int):
+        delay = self.paused_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.requests.acquire(1)
+        self.tokens.acquire(tokens)
+
+    def on_success(self):
+        with self.lock:
+            if self.fraction < 1.0:
+                self.fraction = min(1.0, self.fraction + self.increase)
+                self._apply()
+
+    def on_rate_limited(self, retry_after: float = None):
+        with self.lock:
+            self.rate_limited += 1
+            self.fraction = max(self.min_fraction, self.fraction / 2)
+            self._apply()
+            backoff = retry_after if retry_after else min(60.0, 2.0 ** min(self.rate_limited, 6))
+            self.paused_until = max(self.paused_until, time.monotonic() + backoff)
+
+
+def _is_rate_limited(exc: Exception) -> bool:
+    status = getattr(exc, "status_code", None) or getattr(exc, "http_status", None)
+    return status == 429 or "RateLimit" in type(exc).__name__
+
+
+def _retry_after(exc: Exception):
+    headers = getattr(getattr(exc, "response", None), "headers", None) or getattr(exc, "headers", None)
+    try:
+        return float(headers.get("retry-after")) if headers else None
+    except (TypeError, ValueError):
+        return None
+
+
+class EmbeddingPool:
+    """
+    Embed batches of texts on a bounded pool of worker threads, each call
+    gated by an AdaptiveRateLimiter. Only the embedding calls run here; the
+    caller writes the vectors wherever they go.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        workers: int = EMBED_WORKERS,
+        limiter: AdaptiveRateLimiter = None,
+        max_retries: int = 8
+    ):
+        self.embeddings = embeddings
+        self.workers = workers
+        self.limiter = limiter or AdaptiveRateLimiter()
+        self.max_retries = max_retries
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        tokens = count_tokens(texts)
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(tokens)
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+            except Exception as e:
+                if attempt == self.max_retries or not _is_rate_limited(e):
+                    raise
+                self.limiter.on_rate_limited(_retry_after(e))
+                continue
+            self.limiter.on_success()
+            return vectors
+
+    def map(self, batches: Iterable[Tuple[object, List[str]]]) -> Iterator[Tuple[object, List[List[float]]]]:
+        """
+        Embed (payload, texts) pairs concurrently and yield (payload, vectors)
+        in completion order. At most twice the worker count is in flight, so
+        a large input is not read ahead into memory.
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            in_flight = {}
+            for payload, texts in batches:
+                in_flight[executor.submit(self.embed, texts)] = payload
+                if len(in_flight) >= self.workers * 2:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield in_flight.pop(future), future.result()
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield in_flight.pop(future), future.result()
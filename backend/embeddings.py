@@ -0,0 +1,68 @@
+import hashlib
+import os
+import time
+from typing import List
+
+import numpy as np
+from dotenv import load_dotenv
+
+from langchain.embeddings.base import Embeddings
+from langchain.embeddings import OpenAIEmbeddings
+
+from embedding_cache import CachedEmbeddings, EMBEDDING_CACHE_DIR
+
+load_dotenv()
+openai_api_key = os.getenv("OPENAI_API_KEY")
+
+# "openai" or "fake"
+EMBEDDINGS_BACKEND = os.getenv("EMBEDDINGS_BACKEND", "openai")
+
+
+class HashEmbeddings(Embeddings):
+    """
+    Deterministic local stand-in for OpenAIEmbeddings. Each word is hashed
+    into one of `size` buckets and the counts are L2-normalized, so texts
+    sharing words get similar vectors. `latency` seconds are slept per call
+    to imitate a remote provider.
+    """
+
+    def __init__(self, size: int = 1536, latency: float = 0.0):
+        self.size = size
+        self.latency = latency
+        self.model = f"hash-{size}"
+
+    def _embed(self, text: str) -> List[float]:
+        vec = np.zeros(self.size, dtype=np.float32)
+        for word in text.lower().split():
+            h = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "big")
+            vec[h % self.size] += 1.0 if (h >> 63) else -1.0
+        norm = np.linalg.norm(vec)
+        if norm:
+            vec /= norm
+        return vec.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def get_embeddings(backend: str = None, cache: bool = True) -> Embeddings:
+    """
+    Embeddings for EMBEDDINGS_BACKEND, wrapped in the on-disk cache unless
+    `cache` is False or EMBEDDING_CACHE_DIR is set to an empty string.
+    """
+    backend = backend or EMBEDDINGS_BACKEND
+    if backend == "fake":
+        embeddings = HashEmbeddings(
+            size=int(os.getenv("FAKE_EMBEDDING_SIZE", "1536")),
+            latency=float(os.getenv("FAKE_EMBEDDING_LATENCY", "0")),
+        )
+    else:
+        embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key)
+    if cache and EMBEDDING_CACHE_DIR:
+        embeddings = CachedEmbeddings(embeddings, directory=os.path.join(EMBEDDING_CACHE_DIR, backend))
+    return embeddings
@@ -0,0 +1,309 @@
+import json
+import mmap
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+import psycopg2
+from dotenv import load_dotenv
+from pgvector.psycopg2 import register_vector
+
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores.base import VectorStore
+
+from retrievers import mmr_order
+
+load_dotenv()
+db_connection_string = os.getenv("POSTGRESQL_URI")
+
+FAISS_INDEX_DIR = os.getenv("FAISS_INDEX_DIR", "faiss_index")
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "128"))
+
+# metadata keys that can be used in query.filters; stored as integer codes per row
+FILTER_FIELDS = (
+    "store_name", "item_description", "category_name", "month", "city", "county", "zipcode",
+)
+
+
+def write_faiss_index(
+    batches: Iterable[List[Tuple[Any, str, dict]]],
+    total: int,
+    directory: str = FAISS_INDEX_DIR,
+    method: str = "ivf",
+    train_size: int = 100000
+) -> int:
+    """
+    Write batches of (embedding, document, metadata) rows to a FAISS index
+    on disk. Vectors are L2-normalized so inner product equals PGVector's
+    cosine similarity. "ivf" builds IVF-SQ8 (about 4*sqrt(n) lists, 1 byte
+    per dimension), "hnsw" builds HNSW32.
+
+    Writes index.faiss, docs.jsonl + offsets.npy (documents and metadata,
+    read back by offset), fields.npz and vocab.json (filter columns).
+    Returns the number of vectors written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    index = None
+    pending = []
+    offsets = [0]
+    codes = {field: [] for field in FILTER_FIELDS}
+    vocab = {field: {} for field in FILTER_FIELDS}
+
+    def add(vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        faiss.normalize_L2(vectors)
+        if not index.is_trained:
+            index.train(vectors)
+        index.add(vectors)
+
+    with open(os.path.join(directory, "docs.jsonl"), "wb") as docs_file:
+        for rows in batches:
+            vectors = np.vstack([np.asarray(r[0], dtype=np.float32) for r in rows])
+            if index is None:
+                dim = vectors.shape[1]
+                if method == "hnsw":
+                    factory = "HNSW32"
+                else:
+                    # faiss wants ~39 training points per list
+                    nlist = max(1, min(65536, int(4 * total ** 0.5), total // 39))
+                    factory = f"IVF{nlist},SQ8"
+                index = faiss.index_factory(dim, factory, faiss.METRIC_INNER_PRODUCT)
+
+            for _, document, metadata in rows:
+                metadata = metadata or {}
+                line = json.dumps({"page_content": document, "metadata": metadata}).encode("utf-8") + b"\n"
+                docs_file.write(line)
+                offsets.append(offsets[-1] + len(line))
+                for field in FILTER_FIELDS:
+                    value = metadata.get(field)
+                    codes[field].append(vocab[field].setdefault(str(value), len(vocab[field])))
+
+            if index.is_trained:
+                add(vectors)
+                continue
+            # IVF needs training: hold vectors back until there is a big enough sample
+            pending.append(vectors)
+            if sum(len(p) for p in pending) >= min(train_size, total):
+                add(np.vstack(pending))
+                pending = []
+
+    if index is None:
+        raise ValueError("no vectors to index")
+    if pending:
+        add(np.vstack(pending))
+
+    faiss.write_index(index, os.path.join(directory, "index.faiss"))
+    np.save(os.path.join(directory, "offsets.npy"), np.asarray(offsets, dtype=np.uint64))
+    np.savez(os.path.join(directory, "fields.npz"), **{f: np.asarray(c, dtype=np.int32) for f, c in codes.items()})
+    with open(os.path.join(directory, "vocab.json"), "w") as f:
+        json.dump(vocab, f)
+    return index.ntotal
+
+
+def build_faiss_index(
+    connection_string: str,
+    collection_name: str = "vector_embeds",
+    directory: str = FAISS_INDEX_DIR,
+    method: str = "ivf",
+    batch_size: int = 20000
+) -> int:
+    """Export a PGVector collection to disk with write_faiss_index, streaming it through a server-side cursor."""
+    conn = psycopg2.connect(connection_string)
+    register_vector(conn)
+    query = """
+        SELECT e.embedding, e.document, e.cmetadata
+        FROM langchain_pg_embedding e
+        JOIN langchain_pg_collection c ON e.collection_id = c.uuid
+        WHERE c.name = %s
+    """
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT count(*) FROM ({query}) q", (collection_name,))
+        total = cur.fetchone()[0]
+
+    def batches():
+        with conn.cursor(name="faiss_export") as cur:
+            cur.itersize = batch_size
+            cur.execute(query, (collection_name,))
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+
+    try:
+        return write_faiss_index(batches(), total, directory, method)
+    finally:
+        conn.close()
+
+
+class FaissStore(VectorStore):
+    """
+    Read-only vector store over an index written by build_faiss_index.
+    The index and the document file are memory-mapped, so startup is fast
+    and pages are only read when a search touches them. Supports PGVector
+    style metadata filters on FILTER_FIELDS: {"county": "POLK"},
+    {"county": {"$eq": "POLK"}} or {"county": {"$in": [...]}}.
+    """
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        directory: str = FAISS_INDEX_DIR,
+        nprobe: int = FAISS_NPROBE,
+        ef_search: int = FAISS_EF_SEARCH
+    ):
+        self.embedding = embedding
+        self.directory = directory
+        path = os.path.join(directory, "index.faiss")
+        try:
+            self.index = faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            # index types without mmap support are read into memory
+            self.index = faiss.read_index(path)
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.is_ivf = faiss.try_extract_index_ivf(self.index) is not None
+        self.is_hnsw = isinstance(faiss.downcast_index(self.index), faiss.IndexHNSW)
+        if self.is_ivf:
+            # reconstruct() on an IVF index needs the id -> list map; build it here, once,
+            # since searches run on executor threads and building it lazily would race
+            faiss.extract_index_ivf(self.index).make_direct_map()
+
+        self.offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r")
+        self._docs_file = open(os.path.join(directory, "docs.jsonl"), "rb")
+        self.docs = mmap.mmap(self._docs_file.fileno(), 0, access=mmap.ACCESS_READ)
+        with np.load(os.path.join(directory, "fields.npz")) as fields:
+            self.fields = {f: fields[f] for f in fields.files}
+        with open(os.path.join(directory, "vocab.json")) as f:
+            self.vocab = json.load(f)
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def _document(self, i: int) -> Document:
+        raw = json.loads(self.docs[int(self.offsets[i]):int(self.offsets[i + 1])])
+        return Document(page_content=raw["page_content"], metadata=raw["metadata"])
+
+    def _filter_mask(self, filter: Dict[str, Any]) -> np.ndarray:
+        mask = np.ones(self.index.ntotal, dtype=bool)
+        for field, cond in filter.items():
+            if field not in self.fields:
+                raise ValueError(f"cannot filter on {field!r}; filterable fields are {FILTER_FIELDS}")
+            if isinstance(cond, dict):
+                if "$eq" in cond:
+                    values = [cond["$eq"]]
+                elif "$in" in cond:
+                    values = cond["$in"]
+                else:
+                    raise ValueError(f"unsupported filter operator in {cond!r}")
+            else:
+                values = [cond]
+            wanted = [self.vocab[field][str(v)] for v in values if str(v) in self.vocab[field]]
+            mask &= np.isin(self.fields[field], wanted)
+        return mask
+
+    def _search_params(self, filter: Optional[Dict[str, Any]], k: int):
+        kwargs = {}
+        if filter:
+            ids = np.flatnonzero(self._filter_mask(filter)).astype(np.int64)
+            if len(ids) == 0:
+                return None
+            selector = faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+            # keep the id array alive for as long as the selector
+            selector.ids_ref = ids
+            kwargs["sel"] = selector
+        if self.is_ivf:
+            return faiss.SearchParametersIVF(nprobe=self.nprobe, **kwargs)
+        if self.is_hnsw:
+            return faiss.SearchParametersHNSW(efSearch=max(self.ef_search, k), **kwargs)
+        return faiss.SearchParameters(**kwargs)
+
+    def search_ids(self, embedding: List[float], k: int, filter: Optional[Dict[str, Any]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Row ids and cosine scores of the k nearest rows, best first."""
+        params = self._search_params(filter, k)
+        if params is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = np.asarray([embedding], dtype=np.float32)
+        faiss.normalize_L2(query)
+        scores, ids = self.index.search(query, k, params=params)
+        keep = ids[0] >= 0
+        return ids[0][keep], scores[0][keep]
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: List[float], k: int = 4, filter: Optional[Dict[str, Any]] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        ids, scores = self.search_ids(embedding, k, filter)
+        return [(self._document(i), float(s)) for i, s in zip(ids, scores)]
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, filter: Optional[Dict[str, Any]] = None, **kwargs: Any
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, filter)]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, filter)
+
+    def similarity_search(
+        self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None, **kwargs: Any
+    ) -> List[Document]:
+        return self.similarity_search_by_vector(self.embedding.embed_query(query), k, filter)
+
+    def _reconstruct(self, ids: np.ndarray) -> np.ndarray:
+        """Stored (normalized, possibly quantized) vectors of the given rows."""
+        return np.vstack([self.index.reconstruct(int(i)) for i in ids])
+
+    def max_marginal_relevance_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs: Any
+    ) -> List[Document]:
+        ids, _ = self.search_ids(embedding, fetch_k, filter)
+        if len(ids) == 0:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        selected = mmr_order(query, self._reconstruct(ids), k, lambda_mult)
+        return [self._document(ids[i]) for i in selected]
+
+    def max_marginal_relevance_search(
+        self,
+        query: str,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs: Any
+    ) -> List[Document]:
+        return self.max_marginal_relevance_search_by_vector(
+            self.embedding.embed_query(query), k, fetch_k, lambda_mult, filter
+        )
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[str]:
+        raise NotImplementedError("FaissStore is read-only; rebuild it with build_faiss_index")
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None, **kwargs: Any):
+        raise NotImplementedError("FaissStore is built from a PGVector collection with build_faiss_index")
+
+
+if __name__ == "__main__":
+    n = build_faiss_index(
+        connection_string=db_connection_string,
+        collection_name="vector_embeds",
+        directory=FAISS_INDEX_DIR,
+        method=os.getenv("FAISS_METHOD", "ivf"),
+    )
+    print(f"FAISS index with {n} vectors written to {FAISS_INDEX_DIR}")
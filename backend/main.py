@@ -1,30 +1,52 @@
 import os
+import json
 import uvicorn
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, AsyncIterator, Iterator, List, Tuple
 import numbers
+import time
 from fastapi import FastAPI
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.vectorstores import PGVector
+from langchain.vectorstores.base import VectorStore
 from langchain.chat_models import ChatOpenAI
+from langchain.chat_models.base import BaseChatModel
+from langchain.callbacks.base import BaseCallbackHandler
 from langchain.chains import RetrievalQA
 from langchain.docstore.document import Document
+from langchain.schema import format_document
 
-import sqlalchemy
 from sqlalchemy import text
-import psycopg2
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 
 import auth
-from models import Base
+import metrics
+from models import Base, upgrade_auth_schema
 from database import engine
+from embeddings import get_embeddings
+from duckdb_engine import ParquetEngine, UnsupportedQuery, get_sql_engine
+from query_router import QueryRouter, compile_template
+from result_cache import ResultCache
+from sql_cache import SemanticSQLCache
+from retrievers import RAG_FETCH_K, RAG_TOKEN_BUDGET, TokenBudgetRetriever, get_vectorstore, token_counter
 
 load_dotenv()
 openai_api_key = os.getenv("OPENAI_API_KEY")
 db_connection_string = os.getenv("POSTGRESQL_URI")
 
+# one pooled engine for the app's lifetime
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+SQL_STATEMENT_TIMEOUT_MS = int(os.getenv("SQL_STATEMENT_TIMEOUT_MS", "30000"))
+
+# generated SQL is read through a server-side cursor, SQL_FETCH_SIZE rows at a time,
+# and never returns more than SQL_ROW_CAP rows
+SQL_ROW_CAP = int(os.getenv("SQL_ROW_CAP", "1000"))
+SQL_FETCH_SIZE = int(os.getenv("SQL_FETCH_SIZE", "500"))
+
 app = FastAPI()
 
 origins = [
@@ -40,9 +62,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# per-route latency for /metrics
+app.add_middleware(metrics.MetricsMiddleware)
+
 app.include_router(auth.router)
 
 Base.metadata.create_all(bind=engine)
+upgrade_auth_schema(engine)
 
 # pydantic model for query
 class Query(BaseModel):
@@ -50,28 +76,78 @@ class Query(BaseModel):
     filters: Optional[Dict[str, Any]] = None
 
 rag_chain: Optional[RetrievalQA] = None
-llm: Optional[ChatOpenAI] = None
+llm: Optional[BaseChatModel] = None
+pg_engine: Optional[AsyncEngine] = None
+sql_cache: Optional[SemanticSQLCache] = None
+result_cache: Optional[ResultCache] = None
+sql_engine: Optional[ParquetEngine] = None
+query_router = QueryRouter()
+
 
+def async_database_url(url: str) -> str:
+    """POSTGRESQL_URI with its driver swapped for asyncpg."""
+    return make_url(url).set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
 
-def get_db_connection():
-    engine = sqlalchemy.create_engine(db_connection_string)
-    return engine
+
+class LLMTokenCounter(BaseCallbackHandler):
+    """
+    Counts prompt and completion tokens of every LLM call into
+    metrics.LLM_TOKENS. Uses the provider's reported usage when there is
+    one; streamed calls don't report it, so those are counted with
+    tiktoken.
+    """
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.count = token_counter(model_name)
+        self.prompt_tokens: Dict[Any, int] = {}
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self.prompt_tokens[run_id] = sum(self.count(p) for p in prompts)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.prompt_tokens[run_id] = sum(self.count(m.content) for batch in messages for m in batch)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        estimated_prompt = self.prompt_tokens.pop(run_id, 0)
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt = usage.get("prompt_tokens", estimated_prompt)
+        completion = usage.get("completion_tokens")
+        if completion is None:
+            completion = sum(self.count(g.text) for batch in response.generations for g in batch)
+        metrics.LLM_TOKENS.inc(prompt, model=self.model_name, kind="prompt")
+        metrics.LLM_TOKENS.inc(completion, model=self.model_name, kind="completion")
+        metrics.LLM_CALLS.inc(model=self.model_name, outcome="ok")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self.prompt_tokens.pop(run_id, None)
+        metrics.LLM_CALLS.inc(model=self.model_name, outcome="error")
 
 
 def create_rag_chain(
-    vectorstore: PGVector,
+    vectorstore: VectorStore,
     model_name: str = "gpt-4",
     temperature: float = 0.0,
-    k_retrieval: int = 50000
+    fetch_k: int = RAG_FETCH_K,
+    token_budget: int = RAG_TOKEN_BUDGET,
+    chat_model: Optional[BaseChatModel] = None
 ) -> RetrievalQA:
+    """Build the RAG chain once; `chat_model` replaces ChatOpenAI (benchmarks pass a stub)."""
     global llm
-    llm = ChatOpenAI(
+    llm = chat_model or ChatOpenAI(
         model_name=model_name,
         openai_api_key=openai_api_key,
         temperature=temperature
     )
+    llm.callbacks = list(llm.callbacks or []) + [LLMTokenCounter(model_name)]
 
-    retriever = vectorstore.as_retriever(search_kwargs={"k": k_retrieval})
+    # fetch_k candidates, MMR-reranked, packed into token_budget prompt tokens
+    retriever = TokenBudgetRetriever(
+        vectorstore=vectorstore,
+        fetch_k=fetch_k,
+        token_budget=token_budget,
+        model_name=model_name
+    )
 
     qa_chain = RetrievalQA.from_chain_type(
         llm=llm,
@@ -82,26 +158,69 @@ def create_rag_chain(
     return qa_chain
 
 
+def create_pg_engine() -> AsyncEngine:
+    return create_async_engine(
+        async_database_url(db_connection_string),
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_pre_ping=True,
+        connect_args={"server_settings": {"statement_timeout": str(SQL_STATEMENT_TIMEOUT_MS)}},
+    )
+
+
 @app.on_event("startup")
 def startup_event():
-    global rag_chain
+    global rag_chain, pg_engine, sql_cache, result_cache, sql_engine
 
-    embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key)
+    # every question is embedded through the on-disk cache
+    embeddings = get_embeddings()
 
-    vectorstore = PGVector(
-        connection_string=db_connection_string,
-        collection_name="vector_embeds",
-        embedding_function=embeddings,
-    )
+    # PGVector or the local FAISS index, depending on RETRIEVER_BACKEND
+    vectorstore = get_vectorstore(embeddings, collection_name="vector_embeds")
 
     rag_chain = create_rag_chain(
         vectorstore=vectorstore,
         model_name="gpt-4",
-        temperature=0.0,
-        k_retrieval=50000
+        temperature=0.0
     )
     print("RAG chain created.")
 
+    # questions seen before (or worded almost the same) skip SQL generation
+    sql_cache = SemanticSQLCache(embeddings)
+    sql_cache.load()
+
+    # generated SQL runs on asyncpg so a slow query doesn't hold a threadpool slot
+    pg_engine = create_pg_engine()
+
+    # results of generated SQL, valid until DataLoader.py bumps data_version
+    result_cache = ResultCache()
+
+    # SQL_ENGINE=duckdb answers generated SQL from the Parquet export when it is current
+    sql_engine = get_sql_engine()
+
+    # hit ratios on /metrics
+    metrics.register_cache("sql", lambda: (sql_cache.exact_hits + sql_cache.semantic_hits, sql_cache.misses))
+    metrics.register_cache("results", lambda: (result_cache.hits, result_cache.misses))
+    metrics.register_cache("auth_tokens", lambda: (auth.token_cache.hits, auth.token_cache.misses))
+    if hasattr(embeddings, "stats"):
+        metrics.register_cache("embeddings", lambda: (embeddings.hits, embeddings.misses))
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    # expired and revoked refresh tokens are deleted in the background
+    auth.session_sweeper.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await auth.session_sweeper.stop()
+    if pg_engine is not None:
+        await pg_engine.dispose()
+    if sql_engine is not None:
+        sql_engine.close()
+
+
 def format_value(v: Any) -> str:
     """Comma-format numbers, leave everything else as str."""
     if isinstance(v, numbers.Number):
@@ -109,16 +228,8 @@ def format_value(v: Any) -> str:
     return str(v)
 
 
-@app.post("/query")
-def process_query(query: Query):
-    global rag_chain, llm
-    user_question = query.question.strip()
-
-    if not rag_chain:
-        return {"error": "RAG chain not initialized."}
-
-    # SQL implementation
-    prompt = f"""
+def sql_prompt(user_question: str) -> str:
+    return f"""
     You are working with a PostgreSQL database. The table is called 'liquorsales' and contains fields like:
     - date (DATE): the date of the sale
     - sale_dollars (NUMERIC): the total dollar value of the sale
@@ -135,55 +246,395 @@ def process_query(query: Query):
     Output only the SQL. No explanations.
     """
 
-    sql_candidate = llm.predict(prompt).strip()
 
-    if sql_candidate.lower().startswith("select"):
-        # safeguard to correct hallucinated table names
-        if "from sales" in sql_candidate.lower():
-            sql_candidate = sql_candidate.replace("FROM sales", "FROM liquorsales")
+async def generate_sql(user_question: str) -> Optional[str]:
+    """The LLM's SQL for the question, or None if it didn't answer with a SELECT."""
+    with metrics.STAGE_SECONDS.time(stage="sql_generation"):
+        sql_candidate = (await llm.apredict(sql_prompt(user_question))).strip()
+    if not sql_candidate.lower().startswith("select"):
+        return None
+    # safeguard to correct hallucinated table names
+    if "from sales" in sql_candidate.lower():
+        sql_candidate = sql_candidate.replace("FROM sales", "FROM liquorsales")
+    return sql_candidate
+
 
+async def plan_sql(user_question: str) -> Tuple[Optional[str], Dict[str, Any], Any, str]:
+    """
+    (sql, params, question embedding, source), cheapest first:
+    - "template": a common analytic question compiled locally to parameterized SQL
+    - "router": None, the local router sent the question straight to RAG
+    - "cache": validated SQL from the question cache
+    - "llm": None, SQL still has to be generated
+    """
+    with metrics.STAGE_SECONDS.time(stage="routing"):
+        template = compile_template(user_question)
+        route = None if template else query_router.route(user_question)[0]
+    if template:
+        query_router.decisions["template"] += 1
+        metrics.QUERY_SOURCE.inc(source="template")
+        return template[0], template[1], None, "template"
+
+    if route == "rag":
+        metrics.QUERY_SOURCE.inc(source="router")
+        return None, {}, None, "router"
+
+    question_vector = None
+    if sql_cache is not None:
+        with metrics.STAGE_SECONDS.time(stage="sql_cache_lookup"):
+            sql, question_vector = await sql_cache.lookup(user_question)
+        if sql:
+            metrics.QUERY_SOURCE.inc(source="cache")
+            return sql, {}, question_vector, "cache"
+    metrics.QUERY_SOURCE.inc(source="llm")
+    return None, {}, question_vector, "llm"
+
+
+async def resolve_sql(user_question: str) -> Tuple[Optional[str], Dict[str, Any], Any, str]:
+    """plan_sql, with "llm" questions answered by generate_sql (None if the LLM didn't write SQL)."""
+    sql, params, question_vector, source = await plan_sql(user_question)
+    if source == "llm":
+        sql = await generate_sql(user_question)
+    return sql, params, question_vector, source
+
+
+async def remember_sql(user_question: str, sql: str, question_vector, source: str):
+    """Cache generated SQL once it has executed successfully."""
+    if sql_cache is not None and source == "llm":
+        await sql_cache.put(user_question, sql, question_vector)
+
+
+async def forget_sql(sql: str, source: str):
+    if sql_cache is not None and source == "cache":
+        await sql_cache.invalidate(sql)
+
+
+def iter_batches(keys: List[str], rows: List[tuple], truncated: bool) -> Iterator[Tuple[List[str], List[tuple], bool]]:
+    """A complete result in SQL_FETCH_SIZE batches, shaped like iter_sql_rows."""
+    for start in range(0, max(len(rows), 1), SQL_FETCH_SIZE):
+        last = start + SQL_FETCH_SIZE >= len(rows)
+        yield keys, rows[start:start + SQL_FETCH_SIZE], truncated and last
+
+
+async def iter_sql_rows(
+    sql: str,
+    params: Optional[Dict[str, Any]] = None,
+    row_cap: int = SQL_ROW_CAP
+) -> AsyncIterator[Tuple[List[str], List[tuple], bool]]:
+    """
+    Run generated SQL and yield (columns, rows, truncated) batches. At most
+    `row_cap` rows are read; the last batch has truncated=True when the
+    query had more.
+
+    With SQL_ENGINE=duckdb and a Parquet export of the current data version,
+    the query runs on DuckDB; otherwise, or when DuckDB can't run it, on
+    PostgreSQL through a server-side cursor.
+    """
+    fallback = False
+    if sql_engine is not None and result_cache is not None and sql_engine.serves(result_cache.version):
+        start = time.perf_counter()
+        try:
+            keys, rows, truncated = await sql_engine.run(sql, params, row_cap)
+        except UnsupportedQuery:
+            fallback = True
+        else:
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - start, stage="sql_execution")
+            metrics.SQL_ENGINE_QUERIES.inc(engine="duckdb", fallback="false")
+            for batch in iter_batches(keys, rows, truncated):
+                yield batch
+            return
+    metrics.SQL_ENGINE_QUERIES.inc(engine="postgres", fallback="true" if fallback else "false")
+
+    # only time spent waiting on PostgreSQL counts, not the caller's work between batches
+    waited = 0.0
+    mark = time.perf_counter()
+    async with pg_engine.connect() as conn:
+        result = await conn.stream(text(sql), params or {})
+        keys = list(result.keys())
+        remaining = row_cap
+        yielded = False
         try:
-            db = get_db_connection()
-            with db.connect() as conn:
-                result = conn.execute(text(sql_candidate))
-                rows = result.fetchall()
-                keys = result.keys()
-                data = [dict(zip(keys, row)) for row in rows]
-                
-            if len(data) == 1:
-                row = data[0]
-                if len(row) == 1:
-                    val = next(iter(row.values()))
-                    answer = f"{user_question} → {format_value(val)}"
-                else:
-                    parts = [f"{k}: {format_value(v)}" for k, v in row.items()]
-                    answer = f"{user_question} → " + "; ".join(parts)
-            else:
-                lines = []
-                for r in data:
-                    parts = [f"{k}: {format_value(v)}" for k, v in r.items()]
-                    lines.append(", ".join(parts))
-                answer = f"{user_question} →\n" + "\n".join(lines)
-
-            return {"response": answer}
+            async for batch in result.partitions(SQL_FETCH_SIZE):
+                waited += time.perf_counter() - mark
+                if len(batch) > remaining:
+                    yield keys, [tuple(r) for r in batch[:remaining]], True
+                    return
+                remaining -= len(batch)
+                yielded = True
+                yield keys, [tuple(r) for r in batch], False
+                mark = time.perf_counter()
+            waited += time.perf_counter() - mark
+            if not yielded:
+                yield keys, [], False
+        finally:
+            metrics.STAGE_SECONDS.observe(waited, stage="sql_execution")
+            await result.close()
+
+
+async def iter_sql_result(
+    sql: str,
+    params: Optional[Dict[str, Any]] = None,
+    row_cap: int = SQL_ROW_CAP
+) -> AsyncIterator[Tuple[List[str], List[tuple], bool]]:
+    """
+    iter_sql_rows, answered from the result cache when the same SQL already
+    ran against the current data version.
+    """
+    version = None
+    if result_cache is not None:
+        # only check out a connection when the cached data_version has gone stale
+        if result_cache.needs_refresh():
+            try:
+                async with pg_engine.connect() as conn:
+                    await result_cache.refresh_version(conn)
+            except Exception:
+                result_cache.refresh_failed()  # no data_version table yet: run uncached
+        version = result_cache.version
+        cached = result_cache.get(sql, row_cap, params)
+        if cached:
+            for batch in iter_batches(*cached):
+                yield batch
+            return
+
+    keys, rows, truncated = [], [], False
+    async for keys, batch, truncated in iter_sql_rows(sql, params, row_cap):
+        rows.extend(batch)
+        yield keys, batch, truncated
+    if result_cache is not None:
+        result_cache.put(sql, row_cap, keys, rows, truncated, version, params)
+
+
+def format_row(keys: List[str], row: tuple) -> str:
+    return ", ".join(f"{k}: {format_value(v)}" for k, v in zip(keys, row))
+
+
+def format_answer(user_question: str, keys: List[str], rows: List[tuple], truncated: bool) -> str:
+    if len(rows) == 1:
+        row = rows[0]
+        if len(row) == 1:
+            answer = f"{user_question} → {format_value(row[0])}"
+        else:
+            answer = f"{user_question} → " + "; ".join(f"{k}: {format_value(v)}" for k, v in zip(keys, row))
+    else:
+        answer = f"{user_question} →\n" + "\n".join(format_row(keys, r) for r in rows)
+    if truncated:
+        answer += f"\n(first {len(rows):,} rows shown)"
+    return answer
+
+
+async def retrieve(user_question: str, filters: Optional[Dict[str, Any]]) -> List[Document]:
+    # the chain is built once at startup, filters only swap the retriever
+    retriever = rag_chain.retriever.with_filter(filters or None)
+    with metrics.STAGE_SECONDS.time(stage="retrieval"):
+        return await retriever.ainvoke(user_question)
+
+
+async def answer_with_rag(user_question: str, filters: Optional[Dict[str, Any]]) -> str:
+    docs = await retrieve(user_question, filters)
+    with metrics.STAGE_SECONDS.time(stage="answer_generation"):
+        return await rag_chain.combine_documents_chain.arun(
+            input_documents=docs,
+            question=user_question
+        )
+
+
+async def stream_rag_answer(user_question: str, docs: List[Document]) -> AsyncIterator[str]:
+    """The RAG chain's "stuff" prompt sent straight to the LLM, yielding tokens as they arrive."""
+    stuff = rag_chain.combine_documents_chain
+    context = stuff.document_separator.join(format_document(doc, stuff.document_prompt) for doc in docs)
+    messages = stuff.llm_chain.prompt.format_prompt(
+        **{stuff.document_variable_name: context, "question": user_question}
+    ).to_messages()
+    started = time.perf_counter()
+    first = True
+    async for chunk in llm.astream(messages):
+        if chunk.content:
+            if first:
+                metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage="answer_first_token")
+                first = False
+            yield chunk.content
+    metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage="answer_generation")
+
+
+@app.post("/query")
+async def process_query(query: Query):
+    user_question = query.question.strip()
 
+    if not rag_chain:
+        return {"error": "RAG chain not initialized."}
+
+    # SQL implementation
+    sql_candidate, params, question_vector, source = await resolve_sql(user_question)
+
+    if sql_candidate:
+        try:
+            keys, rows, truncated = [], [], False
+            async for keys, batch, truncated in iter_sql_result(sql_candidate, params):
+                rows.extend(batch)
         except Exception as e:
-            return {"error": f"SQL execution failed: {e}"}                
+            await forget_sql(sql_candidate, source)
+            return {"error": f"SQL execution failed: {e}"}
 
-    # RAG implementation
-    retriever = rag_chain.retriever.vectorstore.as_retriever(
-        search_kwargs={"k": 50000, "filter": query.filters} if query.filters else {"k": 50000}
-    )
+        await remember_sql(user_question, sql_candidate, question_vector, source)
+        return {"response": format_answer(user_question, keys, rows, truncated)}
 
-    response = RetrievalQA.from_chain_type(
-        llm=llm,
-        retriever=retriever,
-        chain_type="stuff"
-    ).run(user_question)
+    # RAG implementation
+    response = await answer_with_rag(user_question, query.filters)
 
     return {"question": user_question, "response": response}
 
 
+def ndjson(obj: Any) -> str:
+    return json.dumps(obj, default=str) + "\n"
+
+
+@app.post("/query/rows")
+async def stream_query_rows(query: Query):
+    """
+    Same pipeline as /query, but SQL results stream as NDJSON while the
+    server-side cursor is read: {"sql"}, {"columns"}, one JSON array per
+    row, then {"done", "rows", "truncated"}. Questions that don't produce
+    SQL get a single {"question", "response"} line from the RAG branch.
+    """
+    user_question = query.question.strip()
+
+    if not rag_chain:
+        return {"error": "RAG chain not initialized."}
+
+    sql_candidate, params, question_vector, source = await resolve_sql(user_question)
+
+    async def body():
+        if not sql_candidate:
+            response = await answer_with_rag(user_question, query.filters)
+            yield ndjson({"question": user_question, "response": response})
+            return
+
+        yield ndjson({"sql": sql_candidate, "source": source})
+        sent, truncated, columns_sent = 0, False, False
+        try:
+            async for keys, batch, truncated in iter_sql_result(sql_candidate, params):
+                if not columns_sent:
+                    yield ndjson({"columns": keys})
+                    columns_sent = True
+                yield "".join(ndjson(list(row)) for row in batch)
+                sent += len(batch)
+        except Exception as e:
+            await forget_sql(sql_candidate, source)
+            yield ndjson({"error": f"SQL execution failed: {e}"})
+            return
+        await remember_sql(user_question, sql_candidate, question_vector, source)
+        yield ndjson({"done": True, "rows": sent, "truncated": truncated})
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+def sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@app.post("/query/stream")
+async def stream_query(query: Query):
+    """
+    Server-sent events for one question: "stage" as the pipeline moves
+    (routing, generating_sql, running_sql, retrieving, generating), "sql"
+    with the statement that runs, "token" chunks of the answer as soon as
+    they exist, then "done" or "error".
+    """
+    user_question = query.question.strip()
+
+    async def pipeline():
+        if not rag_chain:
+            yield sse("error", {"error": "RAG chain not initialized."})
+            return
+
+        yield sse("stage", {"stage": "routing"})
+        sql_candidate, params, question_vector, source = await plan_sql(user_question)
+        if source == "llm":
+            yield sse("stage", {"stage": "generating_sql"})
+            sql_candidate = await generate_sql(user_question)
+
+        if sql_candidate:
+            yield sse("stage", {"stage": "running_sql"})
+            yield sse("sql", {"sql": sql_candidate, "source": source})
+            # the first batch is held back: a result that fits in it is sent
+            # as one formatted answer, exactly like /query would return it
+            first, rows_sent, truncated = None, 0, False
+            try:
+                async for keys, batch, truncated in iter_sql_result(sql_candidate, params):
+                    if first is None and rows_sent == 0:
+                        first = (keys, batch)
+                        continue
+                    if first is not None:
+                        lines = [format_row(first[0], r) for r in first[1]]
+                        yield sse("token", {"text": f"{user_question} →\n" + "\n".join(lines)})
+                        rows_sent, first = len(lines), None
+                    yield sse("token", {"text": "".join("\n" + format_row(keys, r) for r in batch)})
+                    rows_sent += len(batch)
+            except Exception as e:
+                await forget_sql(sql_candidate, source)
+                yield sse("error", {"error": f"SQL execution failed: {e}"})
+                return
+            await remember_sql(user_question, sql_candidate, question_vector, source)
+            if first is not None:
+                yield sse("token", {"text": format_answer(user_question, first[0], first[1], truncated)})
+            elif truncated:
+                yield sse("token", {"text": f"\n(first {rows_sent:,} rows shown)"})
+            yield sse("done", {"source": source})
+            return
+
+        yield sse("stage", {"stage": "retrieving"})
+        docs = await retrieve(user_question, query.filters)
+        yield sse("stage", {"stage": "generating"})
+        try:
+            async for token in stream_rag_answer(user_question, docs):
+                yield sse("token", {"text": token})
+        except Exception as e:
+            yield sse("error", {"error": f"Answer generation failed: {e}"})
+            return
+        yield sse("done", {"source": "rag"})
+
+    async def events():
+        # headers are already sent once the first event is out, so anything that fails
+        # later (routing, SQL generation, retrieval) has to be reported as an event
+        try:
+            async for event in pipeline():
+                yield event
+        except Exception as e:
+            print(f"/query/stream failed for {user_question!r}: {e}")
+            yield sse("error", {"error": f"Query failed: {e}"})
+
+    # no-cache/no-buffering so proxies pass events through as they are written
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {
+        "sql": sql_cache.stats() if sql_cache is not None else None,
+        "results": result_cache.stats() if result_cache is not None else None,
+        "auth": auth.token_cache.stats(),
+    }
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus text format: per-route and per-stage latency, LLM tokens, cache hit ratios."""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/router/stats")
+def router_stats():
+    return query_router.stats()
+
+
+@app.get("/sql-engine/stats")
+def sql_engine_stats():
+    if sql_engine is None:
+        return {"engine": "postgres"}
+    return {"engine": "duckdb", **sql_engine.stats()}
+
+
 @app.get("/")
 def read_root():
     return {"message": "RAG + Hybrid SQL pipeline is live!"}
@@ -8,6 +8,7 @@ from dotenv import load_dotenv
 
 from langchain.embeddings import OpenAIEmbeddings
 from langchain.vectorstores import PGVector
+from langchain.vectorstores.base import VectorStore
 from langchain.chat_models import ChatOpenAI
 from langchain.chains import RetrievalQA
 from langchain.docstore.document import Document
@@ -15,6 +16,9 @@ from langchain.docstore.document import Document
 import sqlalchemy
 import psycopg2
 
+from embeddings import get_embeddings
+from retrievers import get_vectorstore
+
 load_dotenv()
 openai_api_key = os.getenv("OPENAI_API_KEY")
 db_connection_string = os.getenv("POSTGRESQL_URI")
@@ -53,7 +57,7 @@ def get_db_connection():
 
 
 def create_rag_chain(
-    vectorstore: PGVector,
+    vectorstore: VectorStore,
     model_name: str = "gpt-4",
     temperature: float = 0.0,
     k_retrieval: int = 10
@@ -81,13 +85,10 @@ def startup_event():
    
     global rag_chain
 
-    embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key)
+    embeddings = get_embeddings()
 
-    vectorstore = PGVector(
-        connection_string=db_connection_string,
-        collection_name="vector_embeds",
-        embedding_function=embeddings,
-    )
+    # PGVector or the local FAISS index, depending on RETRIEVER_BACKEND
+    vectorstore = get_vectorstore(embeddings, collection_name="vector_embeds")
 
     # creating chain
     rag_chain = create_rag_chain(
@@ -0,0 +1,365 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+Counters, gauges and histograms live in one registry; main.py serves it
+at GET /metrics and the batch jobs (embed.py, DataLoader.py) write it to
+METRICS_TEXTFILE for node_exporter's textfile collector. Besides the
+usual cumulative buckets, every histogram series keeps its last
+METRICS_WINDOW observations and exports their p50/p95/p99 as
+`<name>_quantile`, so latency percentiles are readable without a
+Prometheus server.
+
+Standard library only, so DataLoader.py can use it without the backend's
+dependencies. Recording an observation is a bisect plus an add under a
+lock, about a microsecond.
+"""
+import bisect
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+# observations kept per histogram series for the quantiles
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "2048"))
+# batch jobs rewrite this file after every batch when set
+METRICS_TEXTFILE = os.getenv("METRICS_TEXTFILE")
+
+# seconds; 5 ms to two minutes covers cache hits through LLM calls and embedding batches
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+
+    def register_collector(self, collect: Callable[[], Iterable[str]]):
+        """`collect` returns finished exposition lines; called on every render."""
+        with self.lock:
+            self.collectors.append(collect)
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics)
+            collectors = list(self.collectors)
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collect in collectors:
+            lines.extend(collect())
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: Optional[str] = METRICS_TEXTFILE):
+        """Atomically replace `path` with the current exposition; no-op without a path."""
+        if not path:
+            return
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.series: Dict[Tuple[str, ...], object] = {}
+        self.lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _header(self, name: str = None, kind: str = None):
+        name = name or self.name
+        return [f"# HELP {name} {self.documentation}", f"# TYPE {name} {kind or self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self.series.get(self._key(labels), 0)
+
+    def render(self):
+        lines = self._header()
+        with self.lock:
+            items = list(self.series.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.series[key] = value
+
+    def render(self):
+        lines = self._header()
+        with self.lock:
+            items = list(self.series.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class _HistogramSeries:
+    __slots__ = ("counts", "total", "count", "recent")
+
+    def __init__(self, buckets: int, window: int):
+        self.counts = [0] * (buckets + 1)
+        self.total = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: "Histogram", labels: Dict[str, object]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+        window: int = METRICS_WINDOW,
+        registry: Registry = REGISTRY
+    ):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+        self.window = window
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = _HistogramSeries(len(self.buckets), self.window)
+            series.counts[bisect.bisect_left(self.buckets, value)] += 1
+            series.total += value
+            series.count += 1
+            series.recent.append(value)
+
+    def time(self, **labels) -> _Timer:
+        """Context manager observing the seconds spent inside it."""
+        return _Timer(self, labels)
+
+    def quantiles(self, **labels) -> Dict[float, float]:
+        """p50/p95/p99 of the recent window of one series; empty if it has no observations."""
+        with self.lock:
+            series = self.series.get(self._key(labels))
+            recent = sorted(series.recent) if series else []
+        return {q: recent[min(len(recent) - 1, int(len(recent) * q))] for q in QUANTILES} if recent else {}
+
+    def render(self):
+        with self.lock:
+            items = [
+                (key, list(s.counts), s.total, s.count, sorted(s.recent))
+                for key, s in self.series.items()
+            ]
+        lines = self._header()
+        for key, counts, total, count, _ in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        quantile_name = f"{self.name}_quantile"
+        lines.extend(self._header(quantile_name, "gauge"))
+        for key, _, _, _, recent in items:
+            if not recent:
+                continue
+            for q in QUANTILES:
+                value = recent[min(len(recent) - 1, int(len(recent) * q))]
+                labels = _format_labels(self.labelnames, key, f'quantile="{q}"')
+                lines.append(f"{quantile_name}{labels} {_format_value(value)}")
+        return lines
+
+
+# metrics shared by the API and the batch jobs
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time from request to the last byte of the response, by route template.",
+    ("method", "route", "status"),
+)
+STAGE_SECONDS = Histogram(
+    "pipeline_stage_duration_seconds",
+    "Time spent in one stage of answering a question or authenticating.",
+    ("stage",),
+)
+QUERY_SOURCE = Counter(
+    "query_source_total",
+    "Questions by where their answer came from (template, router, cache, llm, rag).",
+    ("source",),
+)
+SQL_ENGINE_QUERIES = Counter(
+    "sql_engine_queries_total",
+    "Generated SQL by the engine that ran it (duckdb or postgres); fallback=\"true\" when DuckDB couldn't.",
+    ("engine", "fallback"),
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total",
+    "LLM tokens by model and kind (prompt or completion); estimated with tiktoken when the provider doesn't report usage.",
+    ("model", "kind"),
+)
+LLM_CALLS = Counter(
+    "llm_calls_total",
+    "LLM calls by model and outcome.",
+    ("model", "outcome"),
+)
+BATCH_SECONDS = Histogram(
+    "batch_duration_seconds",
+    "Time per batch of a batch job step.",
+    ("job", "step"),
+)
+BATCH_ROWS = Counter(
+    "batch_rows_total",
+    "Rows or documents processed by a batch job step.",
+    ("job", "step"),
+)
+
+_caches: Dict[str, Callable[[], Tuple[int, int]]] = {}
+
+
+def register_cache(name: str, hits_and_misses: Callable[[], Tuple[int, int]]):
+    """Export hits, misses and the hit ratio of a cache that keeps its own counters."""
+    _caches[name] = hits_and_misses
+
+
+def _collect_caches():
+    lines = []
+    values = []
+    for name, read in list(_caches.items()):
+        try:
+            values.append((name,) + tuple(read()))
+        except Exception:
+            continue  # cache not initialized
+    for metric, kind, doc, pick in (
+        ("cache_hits_total", "counter", "Cache hits.", lambda h, m: h),
+        ("cache_misses_total", "counter", "Cache misses.", lambda h, m: m),
+        ("cache_hit_ratio", "gauge", "Cache hits over lookups since start.", lambda h, m: h / (h + m) if h + m else 0.0),
+    ):
+        lines.append(f"# HELP {metric} {doc}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for name, hits, misses in values:
+            lines.append(f'{metric}{{cache="{_escape(name)}"}} {_format_value(pick(hits, misses))}')
+    return lines
+
+
+REGISTRY.register_collector(_collect_caches)
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+def write_textfile(path: Optional[str] = METRICS_TEXTFILE):
+    REGISTRY.write_textfile(path)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request into HTTP_REQUEST_SECONDS.
+    The clock stops at the last body chunk, so streamed responses count in
+    full. Requests are labelled with the matched route's path template
+    (never the raw path, which would make a series per URL); unmatched
+    requests are labelled "unmatched".
+    """
+
+    def __init__(self, app, exclude: Tuple[str, ...] = ("/metrics",)):
+        self.app = app
+        self.exclude = exclude
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path") in self.exclude:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = [500]
+        recorded = [False]
+
+        def record():
+            if recorded[0]:
+                return
+            recorded[0] = True
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                method=scope.get("method", ""),
+                route=getattr(route, "path", "unmatched"),
+                status=status_code[0],
+            )
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_code[0] = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                record()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            record()
@@ -1,6 +1,14 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey
+import hashlib
+
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Index, LargeBinary, Text, text
 from database import Base
 
+
+def hash_token(token: str) -> bytes:
+    """Fixed-size digest stored and looked up in place of a refresh token."""
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -13,6 +21,66 @@ class RefreshToken(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
-    token = Column(String, unique=True, index=True)
-    expires_at = Column(Integer, index=True)
-    revoked = Column(Boolean, default=False)
\ No newline at end of file
+    token = Column(LargeBinary(32), unique=True, index=True)  # hash_token(refresh JWT)
+    expires_at = Column(Integer, index=True)  # unix seconds
+    revoked = Column(Boolean, default=False)
+
+    # the session check in /auth/verify-token filters on exactly these columns
+    __table_args__ = (
+        Index("ix_refresh_tokens_user_revoked_expires", "user_id", "revoked", "expires_at"),
+    )
+
+class SQLCacheEntry(Base):
+    __tablename__ = "sql_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    normalized_question = Column(String, unique=True, index=True)
+    question = Column(String)
+    sql = Column(Text)
+    embedding = Column(LargeBinary)  # float32 question embedding
+    created_at = Column(Integer)
+    last_used = Column(Integer, index=True)
+    hits = Column(Integer, default=0)
+
+
+def upgrade_auth_schema(bind):
+    """
+    Bring an existing login.db up to date: create_all() skips tables that
+    already exist, so add the composite session index here, and convert
+    expires_at values older logins stored as datetime text to unix seconds
+    (SQLite sorts any text above every integer, so they never expired).
+    Refresh tokens stored as the full JWT are replaced by their hash_token()
+    digest.
+    """
+    for index in RefreshToken.__table__.indexes:
+        index.create(bind=bind, checkfirst=True)
+    with bind.begin() as conn:
+        conn.execute(text(
+            "UPDATE refresh_tokens SET expires_at = CAST(strftime('%s', expires_at) AS INTEGER) "
+            "WHERE typeof(expires_at) = 'text'"
+        ))
+        rows = conn.execute(text("SELECT id, token FROM refresh_tokens WHERE typeof(token) = 'text'")).all()
+        if rows:
+            conn.execute(
+                text("UPDATE refresh_tokens SET token = :token WHERE id = :id"),
+                [{"id": row.id, "token": hash_token(row.token)} for row in rows],
+            )
+
+
+def sweep_refresh_tokens(bind, now: int, batch_size: int) -> int:
+    """
+    Delete expired and revoked refresh tokens, `batch_size` rows per
+    transaction so the SQLite write lock is never held for long. Returns the
+    number of rows deleted.
+    """
+    delete = text(
+        "DELETE FROM refresh_tokens WHERE id IN ("
+        "SELECT id FROM refresh_tokens WHERE expires_at <= :now OR revoked = 1 LIMIT :batch)"
+    )
+    deleted = 0
+    while True:
+        with bind.begin() as conn:
+            count = conn.execute(delete, {"now": now, "batch": batch_size}).rowcount
+        deleted += count
+        if count < batch_size:
+            return deleted
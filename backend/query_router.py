@@ -0,0 +1,309 @@
+import math
+import re
+from collections import Counter
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+from sql_cache import normalize_question
+
+# Routing happens locally: rules first, then a small naive Bayes model
+# trained on the seed questions below. Only questions neither is sure
+# about still go to the LLM to decide.
+ROUTE_CONFIDENCE = 0.8
+
+SQL_RULES = [
+    r"\b(total|sum|average|avg|mean|median|count)\b",
+    r"\bhow (many|much)\b",
+    r"\b(top|bottom|highest|lowest|most|least|best selling|worst selling)\b",
+    r"\b(per|by) (month|year|quarter|week|day|store|county|city|vendor|category|item)\b",
+    r"\b(19|20)\d\d\b",
+]
+RAG_RULES = [
+    r"^(why|describe|explain|summari[sz]e|tell me about|what kind|recommend)\b",
+    r"\b(similar to|like the|compare the style|known for|popular with)\b",
+]
+
+SEED_QUESTIONS = {
+    "sql": [
+        "total sales in 2023",
+        "how many bottles were sold last year",
+        "top 10 stores by sales",
+        "which vendor sold the most liters",
+        "average sale dollars per invoice",
+        "sales by month for polk county",
+        "how much revenue did hy-vee make in 2022",
+        "count of stores in des moines",
+        "which county had the highest sales",
+        "number of items sold per category",
+        "list the top 5 items by bottles sold",
+        "what was the total volume sold in january",
+        "sum of sale dollars by vendor",
+        "monthly sales trend for vodka",
+        "what percent of sales were whiskey",
+        "lowest selling store in 2021",
+        "how many stores sold tito's",
+        "revenue per store in linn county",
+        "which city sells the most rum",
+        "year over year growth in sales",
+    ],
+    "rag": [
+        "what kind of products does the store on main street sell",
+        "describe the sales pattern of craft spirits",
+        "tell me about stores that focus on wine",
+        "which stores are similar to the one in ames",
+        "explain why tequila sales change during the year",
+        "what items are popular with convenience stores",
+        "summarize what central city liquor is known for",
+        "recommend a store for imported brandy",
+        "what do small town stores usually carry",
+        "how would you characterize the vendors of flavored vodka",
+        "what is the story behind seasonal liquor sales",
+        "give me an overview of the spirits in the catalog",
+        "what does the item description say about fireball",
+        "which products look like premium bourbon",
+        "describe the customers of college town stores",
+        "what are typical items in a grocery store liquor aisle",
+        "tell me something interesting about the data",
+        "what are common themes across store inventories",
+        "what types of stores sell schnapps",
+        "explain the difference between the category names",
+    ],
+}
+
+
+class NaiveBayesRouter:
+    """Multinomial naive Bayes over unigrams and bigrams, with add-one smoothing."""
+
+    def __init__(self, examples: Dict[str, List[str]]):
+        self.labels = list(examples)
+        self.counts = {label: Counter() for label in self.labels}
+        self.totals = {}
+        self.priors = {}
+        total_docs = sum(len(v) for v in examples.values())
+        for label, questions in examples.items():
+            for q in questions:
+                self.counts[label].update(self.features(q))
+            self.totals[label] = sum(self.counts[label].values())
+            self.priors[label] = math.log(len(questions) / total_docs)
+        self.vocab = len(set().union(*self.counts.values()))
+
+    @staticmethod
+    def features(question: str) -> List[str]:
+        words = normalize_question(question).split()
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def predict(self, question: str) -> Dict[str, float]:
+        scores = {}
+        for label in self.labels:
+            score = self.priors[label]
+            for f in self.features(question):
+                score += math.log((self.counts[label][f] + 1) / (self.totals[label] + self.vocab))
+            scores[label] = score
+        top = max(scores.values())
+        exp = {label: math.exp(s - top) for label, s in scores.items()}
+        norm = sum(exp.values())
+        return {label: v / norm for label, v in exp.items()}
+
+
+class QueryRouter:
+    """
+    Picks "sql" or "rag" for a question without an LLM call, or "llm" when
+    unsure (the text-to-SQL prompt then decides, as before). Rule hits count
+    as strong evidence; otherwise the classifier has to be at least
+    `confidence` sure.
+    """
+
+    def __init__(self, examples: Dict[str, List[str]] = SEED_QUESTIONS, confidence: float = ROUTE_CONFIDENCE):
+        self.model = NaiveBayesRouter(examples)
+        self.confidence = confidence
+        self.sql_rules = [re.compile(r) for r in SQL_RULES]
+        self.rag_rules = [re.compile(r) for r in RAG_RULES]
+        self.decisions = Counter()
+
+    def route(self, question: str) -> Tuple[str, float]:
+        q = normalize_question(question)
+        sql_hits = sum(bool(r.search(q)) for r in self.sql_rules)
+        rag_hits = sum(bool(r.search(q)) for r in self.rag_rules)
+        if sql_hits and not rag_hits:
+            decision = ("sql", 1.0)
+        elif rag_hits and not sql_hits:
+            decision = ("rag", 1.0)
+        else:
+            probs = self.model.predict(q)
+            label = max(probs, key=probs.get)
+            decision = (label, probs[label]) if probs[label] >= self.confidence else ("llm", probs[label])
+        self.decisions[decision[0]] += 1
+        return decision
+
+    def stats(self) -> dict:
+        return dict(self.decisions)
+
+
+# ---- template fast path: common analytic questions compiled straight to SQL ----
+
+DIMENSIONS = {
+    "store": ("name", "store"),
+    "stores": ("name", "store"),
+    "item": ("im_desc", "item"),
+    "items": ("im_desc", "item"),
+    "product": ("im_desc", "item"),
+    "products": ("im_desc", "item"),
+    "vendor": ("vendor_name", "vendor"),
+    "vendors": ("vendor_name", "vendor"),
+    "category": ("category_name", "category"),
+    "categories": ("category_name", "category"),
+    "county": ("county", "county"),
+    "counties": ("county", "county"),
+    "city": ("city", "city"),
+    "cities": ("city", "city"),
+}
+METRICS = {
+    "sales": ("sale_dollars", "total_sales"),
+    "revenue": ("sale_dollars", "total_sales"),
+    "dollars": ("sale_dollars", "total_sales"),
+    "bottles": ("sale_bottles", "total_bottles"),
+    "liters": ("sale_liters", "total_liters"),
+    "volume": ("sale_liters", "total_liters"),
+}
+MONTHS = {
+    name: i + 1
+    for i, names in enumerate([
+        ("january", "jan"), ("february", "feb"), ("march", "mar"), ("april", "apr"),
+        ("may",), ("june", "jun"), ("july", "jul"), ("august", "aug"),
+        ("september", "sep", "sept"), ("october", "oct"), ("november", "nov"), ("december", "dec"),
+    ])
+    for name in names
+}
+MAX_TOP_N = 100
+
+# words that may remain once the template's parts are taken out
+FILLER = set("""
+    what which who are is were was the a an of in for during by show me list give get tell
+    top best biggest largest highest most bottom worst lowest least smallest selling sold
+    total overall sum how much many did do does all our with
+""".split())
+
+_DIMENSION_WORDS = "|".join(sorted(DIMENSIONS, key=len, reverse=True))
+_METRIC_WORDS = "|".join(METRICS)
+_MONTH_WORDS = "|".join(sorted(MONTHS, key=len, reverse=True))
+
+_TOP = re.compile(rf"\b(top|best|biggest|largest|highest|bottom|worst|lowest|smallest)(?: (\d+))? ({_DIMENSION_WORDS})\b")
+_WHICH = re.compile(rf"\b(which|what) ({_DIMENSION_WORDS}) (?:had|has|have|sold|made) the (most|highest|least|lowest)\b")
+_METRIC = re.compile(rf"\b(?:by|in|of|for)? ?({_METRIC_WORDS})\b")
+_BETWEEN = re.compile(r"\b(?:between|from) ((?:19|20)\d\d) (?:and|to|through) ((?:19|20)\d\d)\b")
+_QUARTER = re.compile(r"\b(?:in |during |for )?q([1-4]) ((?:19|20)\d\d)\b")
+_MONTH = re.compile(rf"\b(?:in |during |for )?({_MONTH_WORDS}) ((?:19|20)\d\d)\b")
+_YEAR = re.compile(r"\b(?:in |during |for )?((?:19|20)\d\d)\b")
+_RELATIVE = re.compile(r"\b(?:in |during |for )?(?:the )?(last|this|past|previous) (year|month)\b")
+_COUNTY = re.compile(r"\b(?:in|for) ([a-z]+(?: [a-z]+)?) county\b|\b([a-z]+) county\b")
+
+
+def _month_start(year: int, month: int) -> datetime:
+    return datetime(year + (month - 1) // 12, (month - 1) % 12 + 1, 1)
+
+
+def _parse_period(text: str, today: date) -> Tuple[Optional[Tuple[datetime, datetime]], str]:
+    """(start, end) of the period mentioned in `text`, and `text` with it removed."""
+    m = _BETWEEN.search(text)
+    if m:
+        start, end = sorted((int(m.group(1)), int(m.group(2))))
+        return (datetime(start, 1, 1), datetime(end + 1, 1, 1)), _BETWEEN.sub(" ", text, 1)
+    m = _QUARTER.search(text)
+    if m:
+        q, year = int(m.group(1)), int(m.group(2))
+        return (_month_start(year, 3 * q - 2), _month_start(year, 3 * q + 1)), _QUARTER.sub(" ", text, 1)
+    m = _MONTH.search(text)
+    if m:
+        month, year = MONTHS[m.group(1)], int(m.group(2))
+        return (_month_start(year, month), _month_start(year, month + 1)), _MONTH.sub(" ", text, 1)
+    m = _RELATIVE.search(text)
+    if m:
+        which, unit = m.groups()
+        if unit == "year":
+            year = today.year if which == "this" else today.year - 1
+            period = (datetime(year, 1, 1), datetime(year + 1, 1, 1))
+        else:
+            month = today.month if which == "this" else today.month - 1
+            period = (_month_start(today.year, month), _month_start(today.year, month + 1))
+        return period, _RELATIVE.sub(" ", text, 1)
+    m = _YEAR.search(text)
+    if m:
+        year = int(m.group(1))
+        return (datetime(year, 1, 1), datetime(year + 1, 1, 1)), _YEAR.sub(" ", text, 1)
+    return None, text
+
+
+def _filters(period, county) -> Tuple[List[str], Dict[str, object]]:
+    clauses, params = [], {}
+    if period:
+        clauses.append("date >= :start AND date < :end")
+        params["start"], params["end"] = period
+    if county:
+        clauses.append("upper(county) = :county")
+        params["county"] = county.upper()
+    return clauses, params
+
+
+def compile_template(question: str, today: Optional[date] = None) -> Optional[Tuple[str, Dict[str, object]]]:
+    """
+    Parameterized SQL for "top N <stores|items|vendors|...> by <sales|bottles|liters>
+    [in <period>] [in <county> county]" and "total <sales|bottles|liters>
+    [in <period>] [in <county> county]", or None if the question says anything
+    the templates don't understand.
+    """
+    today = today or date.today()
+    text = f" {normalize_question(question)} "
+
+    period, text = _parse_period(text, today)
+    metric = ("sale_dollars", "total_sales")
+    metric_match = _METRIC.search(text)
+    if metric_match:
+        metric = METRICS[metric_match.group(1)]
+        text = _METRIC.sub(" ", text, 1)
+
+    top = _TOP.search(text)
+    which = _WHICH.search(text) if not top else None
+    if top:
+        descending = top.group(1) not in ("bottom", "worst", "lowest", "smallest")
+        # "top stores" means a list, "top store" just the one
+        limit = min(int(top.group(2) or (10 if top.group(3).endswith("s") else 1)), MAX_TOP_N)
+        dimension = DIMENSIONS[top.group(3)]
+        text = _TOP.sub(" ", text, 1)
+    elif which:
+        descending = which.group(3) in ("most", "highest")
+        limit = 1
+        dimension = DIMENSIONS[which.group(2)]
+        text = _WHICH.sub(" ", text, 1)
+    else:
+        dimension = None
+
+    county = None
+    m = _COUNTY.search(text)
+    if m:
+        county = m.group(1) or m.group(2)
+        if any(word in FILLER or word in DIMENSIONS for word in county.split()):
+            return None
+        text = _COUNTY.sub(" ", text, 1)
+
+    # anything left over that isn't filler means the question asks for more than we parsed
+    if any(word not in FILLER for word in text.split()):
+        return None
+    if dimension is None and not metric_match:
+        return None
+
+    clauses, params = _filters(period, county)
+    column, metric_label = metric
+    if dimension:
+        dim_column, dim_label = dimension
+        clauses.insert(0, f"{dim_column} IS NOT NULL")
+        params["limit"] = limit
+        sql = (
+            f"SELECT {dim_column} AS {dim_label}, SUM({column}) AS {metric_label} "
+            f"FROM liquorsales WHERE {' AND '.join(clauses)} "
+            f"GROUP BY {dim_column} ORDER BY {metric_label} {'DESC' if descending else 'ASC'} "
+            f"LIMIT :limit"
+        )
+    else:
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = f"SELECT SUM({column}) AS {metric_label} FROM liquorsales{where}"
+    return sql, params
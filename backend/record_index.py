@@ -0,0 +1,114 @@
+import hashlib
+from typing import Tuple
+
+import numpy as np
+
+
+def _hash64(*parts) -> int:
+    h = hashlib.blake2b(digest_size=8)
+    for part in parts:
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\x1f")
+    return int.from_bytes(h.digest(), "big")
+
+
+def record_key(store_name, item_description, month, category_name) -> int:
+    """Stable 64-bit id of a store / item / month / category group."""
+    return _hash64(store_name, item_description, month, category_name)
+
+
+def content_hash(key: int, summary: str) -> int:
+    """64-bit hash of a group's summary text, tied to its key."""
+    return _hash64(key, summary)
+
+
+def to_hex(value: int) -> str:
+    return f"{value:016x}"
+
+
+class RecordIndex:
+    """
+    What is already embedded, as two parallel uint64 arrays sorted by record
+    key: the key and the content hash of the summary that was embedded for it.
+    16 bytes per record instead of a Python string set.
+
+    New entries go into a small dict and are merged into the arrays in bulk.
+    """
+
+    MERGE_THRESHOLD = 1 << 16
+
+    def __init__(self, keys: np.ndarray = None, contents: np.ndarray = None):
+        self.keys = np.empty(0, dtype=np.uint64) if keys is None else keys
+        self.contents = np.empty(0, dtype=np.uint64) if contents is None else contents
+        self.pending = {}
+
+    @classmethod
+    def load(cls, connection, collection_name: str, batch_size: int = 100000) -> "RecordIndex":
+        """Read (record_key, content_hash) from the metadata of an existing PGVector collection."""
+        keys, contents = [], []
+        with connection.cursor(name="record_index_load") as cur:
+            cur.itersize = batch_size
+            cur.execute(
+                """
+                SELECT e.cmetadata->>'record_key', e.cmetadata->>'content_hash'
+                FROM langchain_pg_embedding e
+                JOIN langchain_pg_collection c ON e.collection_id = c.uuid
+                WHERE c.name = %s AND e.cmetadata->>'record_key' IS NOT NULL
+                """,
+                (collection_name,),
+            )
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                keys.append(np.fromiter((int(r[0], 16) for r in rows), dtype=np.uint64, count=len(rows)))
+                contents.append(np.fromiter((int(r[1] or "0", 16) for r in rows), dtype=np.uint64, count=len(rows)))
+        if not keys:
+            return cls()
+        keys = np.concatenate(keys)
+        contents = np.concatenate(contents)
+        order = np.argsort(keys, kind="stable")
+        return cls(keys[order], contents[order])
+
+    def _merge(self):
+        if not self.pending:
+            return
+        new_keys = np.fromiter(self.pending.keys(), dtype=np.uint64, count=len(self.pending))
+        new_contents = np.fromiter(self.pending.values(), dtype=np.uint64, count=len(self.pending))
+        self.pending = {}
+
+        # drop entries being replaced, then merge the sorted runs
+        pos = np.searchsorted(self.keys, new_keys)
+        pos_ok = pos < len(self.keys)
+        replaced = pos[pos_ok][self.keys[pos[pos_ok]] == new_keys[pos_ok]]
+        keep = np.ones(len(self.keys), dtype=bool)
+        keep[replaced] = False
+
+        keys = np.concatenate([self.keys[keep], new_keys])
+        contents = np.concatenate([self.contents[keep], new_contents])
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.contents = contents[order]
+
+    def lookup_many(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(found mask, stored content hashes) for a uint64 array of keys; 0 where not found."""
+        self._merge()
+        if not len(self.keys):
+            return np.zeros(len(keys), dtype=bool), np.zeros(len(keys), dtype=np.uint64)
+        pos = np.searchsorted(self.keys, keys)
+        pos[pos == len(self.keys)] = 0
+        found = self.keys[pos] == keys
+        return found, np.where(found, self.contents[pos], np.uint64(0))
+
+    def add_many(self, keys: np.ndarray, contents: np.ndarray):
+        self.pending.update(zip(keys.tolist(), contents.tolist()))
+        if len(self.pending) >= self.MERGE_THRESHOLD:
+            self._merge()
+
+    def __len__(self):
+        self._merge()
+        return len(self.keys)
+
+    @property
+    def nbytes(self) -> int:
+        return self.keys.nbytes + self.contents.nbytes
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import pyarrow as pa
+from sqlalchemy import text
+
+RESULT_CACHE_MB = int(os.getenv("RESULT_CACHE_MB", "256"))
+# how long a data_version read is trusted before asking PostgreSQL again
+DATA_VERSION_TTL = float(os.getenv("DATA_VERSION_TTL", "5"))
+
+DATA_VERSION_QUERY = text("SELECT version FROM data_version WHERE table_name = 'liquorsales'")
+
+# string literals and quoted identifiers are kept verbatim
+_QUOTED = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+_SPACE = re.compile(r"\s+")
+_IPC_OPTIONS = pa.ipc.IpcWriteOptions(compression="zstd")
+
+
+def normalize_sql(sql: str) -> str:
+    """Lowercase and collapse whitespace outside quotes; drop a trailing semicolon."""
+    parts = _QUOTED.split(sql.strip().rstrip(";"))
+    for i in range(0, len(parts), 2):
+        parts[i] = _SPACE.sub(" ", parts[i].lower())
+    return "".join(parts).strip()
+
+
+def _to_arrow(keys: List[str], rows: List[tuple]) -> bytes:
+    columns = list(zip(*rows)) if rows else [()] * len(keys)
+    table = pa.Table.from_arrays([pa.array(list(col)) for col in columns], names=list(keys))
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema, options=_IPC_OPTIONS) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _from_arrow(payload: bytes) -> Tuple[List[str], List[tuple]]:
+    table = pa.ipc.open_stream(payload).read_all()
+    columns = [col.to_pylist() for col in table.columns]
+    return table.column_names, list(zip(*columns))
+
+
+class ResultCache:
+    """
+    Results of generated SQL keyed on the normalized SQL text, its bind
+    parameters and the row cap, stamped with the LiquorSales data_version
+    that DataLoader.py bumps after every load. Results are stored as
+    zstd-compressed Arrow IPC streams, evicted least recently used once they
+    exceed `max_mb`, and all dropped as soon as a new data version is seen.
+    """
+
+    def __init__(self, max_mb: int = RESULT_CACHE_MB, version_ttl: float = DATA_VERSION_TTL):
+        self.max_bytes = max_mb * 1024 * 1024
+        self.version_ttl = version_ttl
+        # key -> (arrow payload, truncated)
+        self.entries: "OrderedDict[str, Tuple[bytes, bool]]" = OrderedDict()
+        self.bytes = 0
+        self.version: Optional[int] = None
+        self.version_checked = float("-inf")
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _key(self, sql: str, row_cap: int, params: Optional[Dict[str, Any]] = None) -> str:
+        bound = json.dumps(params or {}, sort_keys=True, default=str)
+        raw = f"{row_cap}\x00{normalize_sql(sql)}\x00{bound}"
+        return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+    def needs_refresh(self) -> bool:
+        """Whether the last data_version read (or failed read) is older than `version_ttl`."""
+        return time.monotonic() - self.version_checked >= self.version_ttl
+
+    def refresh_failed(self):
+        """Remember a failed read (e.g. no data_version table yet) so it isn't retried before the TTL."""
+        self.version_checked = time.monotonic()
+
+    async def refresh_version(self, conn) -> Optional[int]:
+        """Re-read data_version at most every `version_ttl` seconds; clears the cache when it moved."""
+        now = time.monotonic()
+        if not self.needs_refresh():
+            return self.version
+        result = await conn.execute(DATA_VERSION_QUERY)
+        row = result.first()
+        version = row[0] if row else None
+        if version != self.version:
+            if self.entries:
+                self.invalidations += 1
+            self.clear()
+            self.version = version
+        self.version_checked = now
+        return version
+
+    def get(
+        self,
+        sql: str,
+        row_cap: int,
+        params: Optional[Dict[str, Any]] = None
+    ) -> Optional[Tuple[List[str], List[tuple], bool]]:
+        if self.version is None:
+            return None
+        key = self._key(sql, row_cap, params)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        keys, rows = _from_arrow(entry[0])
+        return keys, rows, entry[1]
+
+    def put(
+        self,
+        sql: str,
+        row_cap: int,
+        keys: List[str],
+        rows: List[tuple],
+        truncated: bool,
+        version: Optional[int],
+        params: Optional[Dict[str, Any]] = None
+    ):
+        """Store a result computed against `version`; ignored if the data moved on meanwhile."""
+        if version is None or version != self.version:
+            return
+        try:
+            payload = _to_arrow(keys, rows)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            # mixed or unsupported column types; not worth caching
+            return
+        if len(payload) > self.max_bytes:
+            return
+        key = self._key(sql, row_cap, params)
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.bytes -= len(old[0])
+        self.entries[key] = (payload, truncated)
+        self.bytes += len(payload)
+        while self.bytes > self.max_bytes:
+            _, (evicted, _) = self.entries.popitem(last=False)
+            self.bytes -= len(evicted)
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "data_version": self.version,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,193 @@
+import os
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import tiktoken
+from dotenv import load_dotenv
+
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.schema import BaseRetriever
+from langchain.vectorstores import PGVector
+from langchain.vectorstores.base import VectorStore
+
+load_dotenv()
+db_connection_string = os.getenv("POSTGRESQL_URI")
+
+# "pgvector" searches in PostgreSQL; "faiss" searches the local index built by faiss_store.py
+RETRIEVER_BACKEND = os.getenv("RETRIEVER_BACKEND", "pgvector")
+
+# Candidates fetched by the vector search, and the context size they are packed into
+RAG_FETCH_K = int(os.getenv("RAG_FETCH_K", "200"))
+RAG_TOKEN_BUDGET = int(os.getenv("RAG_TOKEN_BUDGET", "6000"))
+
+
+def mmr_order(query_embedding, embeddings, k: int, lambda_mult: float = 0.5) -> List[int]:
+    """
+    Indices of `embeddings` in maximal-marginal-relevance order, up to k.
+    Same selection rule as langchain's maximal_marginal_relevance, but each
+    step is one matrix-vector product against the last pick instead of a
+    Python loop over every candidate, so ordering a few hundred candidates
+    takes milliseconds.
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    if k <= 0 or len(vectors) == 0:
+        return []
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+    relevance = vectors @ query
+    redundancy = None  # highest similarity of each candidate to anything selected so far
+    selected: List[int] = []
+    taken = np.zeros(len(vectors), dtype=bool)
+    for _ in range(min(k, len(vectors))):
+        if redundancy is None:
+            scores = relevance.copy()
+        else:
+            scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[taken] = -np.inf
+        pick = int(np.argmax(scores))
+        selected.append(pick)
+        taken[pick] = True
+        similarity = vectors @ vectors[pick]
+        redundancy = similarity if redundancy is None else np.maximum(redundancy, similarity)
+    return selected
+
+
+class MMRPGVector(PGVector):
+    """
+    PGVector whose MMR search returns documents in MMR order, using mmr_order.
+
+    PGVector has no public query that returns the stored embeddings MMR
+    needs, so this calls its private, name-mangled __query_collection, as
+    its own MMR search does. That ties it to the langchain-community version
+    pinned in requirements.txt; if a release drops the method, searches go
+    through PGVector's own (unordered, slower) MMR instead of failing.
+    """
+
+    def max_marginal_relevance_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs: Any
+    ):
+        query_collection = getattr(self, "_PGVector__query_collection", None)
+        if query_collection is None:
+            return super().max_marginal_relevance_search_with_score_by_vector(
+                embedding, k=k, fetch_k=fetch_k, lambda_mult=lambda_mult, filter=filter, **kwargs
+            )
+        results = query_collection(embedding=embedding, k=fetch_k, filter=filter)
+        if not results:
+            return []
+        candidates = self._results_to_docs_and_scores(results)
+        selected = mmr_order(embedding, [r.EmbeddingStore.embedding for r in results], k, lambda_mult)
+        return [candidates[i] for i in selected]
+
+
+def get_vectorstore(
+    embeddings: Embeddings,
+    collection_name: str = "vector_embeds",
+    backend: str = None
+) -> VectorStore:
+    backend = backend or RETRIEVER_BACKEND
+    if backend == "faiss":
+        from faiss_store import FaissStore, FAISS_INDEX_DIR
+        return FaissStore(embedding=embeddings, directory=FAISS_INDEX_DIR)
+    return MMRPGVector(
+        connection_string=db_connection_string,
+        collection_name=collection_name,
+        embedding_function=embeddings,
+    )
+
+
+@lru_cache(maxsize=None)
+def token_counter(model_name: str = "gpt-4") -> Callable[[str], int]:
+    """Exact tiktoken count for `model_name`; ~4 characters per token if tiktoken can't load its BPE file."""
+    try:
+        encoding = tiktoken.encoding_for_model(model_name)
+    except Exception:
+        return lambda text: len(text) // 4 + 1
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+def pack_documents(
+    documents: List[Document],
+    token_budget: int = RAG_TOKEN_BUDGET,
+    model_name: str = "gpt-4",
+    separator: str = "\n\n"
+) -> List[Document]:
+    """
+    Greedily keep documents, in ranked order, while their text (plus the
+    separator the "stuff" chain puts between them) fits in `token_budget`.
+    A document that doesn't fit is skipped so smaller ones further down can
+    still use the remaining room.
+    """
+    count = token_counter(model_name)
+    separator_tokens = count(separator)
+    packed, used = [], 0
+    for doc in documents:
+        cost = count(doc.page_content) + (separator_tokens if packed else 0)
+        if used + cost > token_budget:
+            continue
+        packed.append(doc)
+        used += cost
+    return packed
+
+
+class TokenBudgetRetriever(BaseRetriever):
+    """
+    Two-stage retrieval: a wide vector search for `fetch_k` candidates,
+    reranked with maximal marginal relevance so near-duplicate summaries
+    don't crowd the context, then packed into exactly `token_budget`
+    tokens. The prompt size, and so latency and cost per question, stays
+    bounded no matter how many documents match.
+    """
+
+    vectorstore: VectorStore
+    fetch_k: int = RAG_FETCH_K
+    lambda_mult: float = 0.5
+    token_budget: int = RAG_TOKEN_BUDGET
+    model_name: str = "gpt-4"
+    filter: Optional[Dict[str, Any]] = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def with_filter(self, filter: Optional[Dict[str, Any]]) -> "TokenBudgetRetriever":
+        return self.copy(update={"filter": filter})
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        embedding = self.vectorstore.embeddings.embed_query(query)
+        # k = fetch_k: MMR returns every candidate, in reranked order
+        ranked = self.vectorstore.max_marginal_relevance_search_by_vector(
+            embedding,
+            k=self.fetch_k,
+            fetch_k=self.fetch_k,
+            lambda_mult=self.lambda_mult,
+            filter=self.filter,
+        )
+        return pack_documents(ranked, self.token_budget, self.model_name)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        embedding = await self.vectorstore.embeddings.aembed_query(query)
+        ranked = await self.vectorstore.amax_marginal_relevance_search_by_vector(
+            embedding,
+            k=self.fetch_k,
+            fetch_k=self.fetch_k,
+            lambda_mult=self.lambda_mult,
+            filter=self.filter,
+        )
+        return pack_documents(ranked, self.token_budget, self.model_name)
@@ -0,0 +1,213 @@
+import asyncio
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from langchain.embeddings.base import Embeddings
+
+from database import SessionLocal
+from models import SQLCacheEntry
+
+# cosine similarity above which a differently worded question reuses cached SQL
+SQL_CACHE_THRESHOLD = float(os.getenv("SQL_CACHE_THRESHOLD", "0.95"))
+SQL_CACHE_TTL = int(os.getenv("SQL_CACHE_TTL", str(7 * 24 * 3600)))
+SQL_CACHE_MAX_ENTRIES = int(os.getenv("SQL_CACHE_MAX_ENTRIES", "5000"))
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace."""
+    return " ".join(_PUNCTUATION.sub(" ", question.lower()).split())
+
+
+class SemanticSQLCache:
+    """
+    Question -> validated SQL, in front of LLM SQL generation.
+
+    Lookup is two-level: the normalized question first, then cosine
+    similarity of the question embedding against every cached question,
+    accepted above `threshold`. A semantic match also needs the same numbers
+    as the cached question, since "top 5 stores in 2023" and "top 10 stores
+    in 2022" embed almost identically but need different SQL.
+
+    Entries live in memory in LRU order, expire after `ttl` seconds and are
+    capped at `max_entries`; they are persisted to the sql_cache table so a
+    restart starts warm. Only SQL that executed successfully should be put.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        threshold: float = SQL_CACHE_THRESHOLD,
+        ttl: int = SQL_CACHE_TTL,
+        max_entries: int = SQL_CACHE_MAX_ENTRIES,
+        session_factory=SessionLocal
+    ):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.session_factory = session_factory
+
+        # normalized question -> (sql, unit-length embedding, created_at)
+        self.entries: "OrderedDict[str, Tuple[str, np.ndarray, float]]" = OrderedDict()
+        self._keys: List[str] = []
+        self._matrix: Optional[np.ndarray] = None
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        # best similarity seen on each semantic lookup, in 0.01 buckets, to tune the threshold
+        self.similarity_histogram: Dict[str, int] = {}
+
+    def load(self):
+        """Fill the in-memory cache from the sql_cache table, most recently used last."""
+        cutoff = time.time() - self.ttl
+        db = self.session_factory()
+        try:
+            db.query(SQLCacheEntry).filter(SQLCacheEntry.created_at < cutoff).delete()
+            db.commit()
+            rows = (
+                db.query(SQLCacheEntry)
+                .order_by(SQLCacheEntry.last_used.desc())
+                .limit(self.max_entries)
+                .all()
+            )
+            for row in reversed(rows):
+                vector = np.frombuffer(row.embedding, dtype=np.float32)
+                self.entries[row.normalized_question] = (row.sql, vector, row.created_at)
+        finally:
+            db.close()
+        self._matrix = None
+
+    def _unit(self, vector: List[float]) -> np.ndarray:
+        vec = np.asarray(vector, dtype=np.float32)
+        return vec / max(float(np.linalg.norm(vec)), 1e-12)
+
+    def _expired(self, created_at: float) -> bool:
+        return time.time() - created_at > self.ttl
+
+    def _record_similarity(self, score: float):
+        bucket = f"{max(0.0, np.floor(score * 100) / 100):.2f}"
+        self.similarity_histogram[bucket] = self.similarity_histogram.get(bucket, 0) + 1
+
+    def _nearest(self, vector: np.ndarray) -> Tuple[Optional[str], float]:
+        if not self.entries:
+            return None, 0.0
+        if self._matrix is None:
+            self._keys = list(self.entries)
+            self._matrix = np.vstack([self.entries[k][1] for k in self._keys])
+        scores = self._matrix @ vector
+        best = int(np.argmax(scores))
+        return self._keys[best], float(scores[best])
+
+    async def lookup(self, question: str) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """
+        (sql, None) on an exact hit, (sql, embedding) on a semantic hit and
+        (None, embedding) on a miss; pass the embedding on to put().
+        """
+        key = normalize_question(question)
+        entry = self.entries.get(key)
+        if entry and not self._expired(entry[2]):
+            self.entries.move_to_end(key)
+            self.exact_hits += 1
+            await asyncio.to_thread(self._touch, key)
+            return entry[0], None
+        if entry:
+            await self._drop([key])
+
+        vector = self._unit(await self.embeddings.aembed_query(question))
+        match, score = self._nearest(vector)
+        if match is not None:
+            self._record_similarity(score)
+            sql, _, created_at = self.entries[match]
+            if (
+                score >= self.threshold
+                and not self._expired(created_at)
+                and _NUMBER.findall(match) == _NUMBER.findall(key)
+            ):
+                self.entries.move_to_end(match)
+                self.semantic_hits += 1
+                await asyncio.to_thread(self._touch, match)
+                return sql, vector
+        self.misses += 1
+        return None, vector
+
+    async def put(self, question: str, sql: str, vector: Optional[np.ndarray] = None):
+        key = normalize_question(question)
+        if vector is None:
+            vector = self._unit(await self.embeddings.aembed_query(question))
+        now = time.time()
+        self.entries[key] = (sql, vector, now)
+        self.entries.move_to_end(key)
+        evicted = []
+        while len(self.entries) > self.max_entries:
+            evicted.append(self.entries.popitem(last=False)[0])
+        self._matrix = None
+        await asyncio.to_thread(self._persist, key, question, sql, vector, int(now), evicted)
+
+    async def invalidate(self, sql: str):
+        """Forget every question mapped to `sql`, e.g. after it failed to execute."""
+        await self._drop([key for key, entry in self.entries.items() if entry[0] == sql])
+
+    async def _drop(self, keys: List[str]):
+        if not keys:
+            return
+        for key in keys:
+            self.entries.pop(key, None)
+        self._matrix = None
+        await asyncio.to_thread(self._delete, keys)
+
+    def _persist(self, key, question, sql, vector, now, evicted):
+        db = self.session_factory()
+        try:
+            row = db.query(SQLCacheEntry).filter(SQLCacheEntry.normalized_question == key).first()
+            if row is None:
+                row = SQLCacheEntry(normalized_question=key, hits=0)
+                db.add(row)
+            row.question = question
+            row.sql = sql
+            row.embedding = vector.astype(np.float32).tobytes()
+            row.created_at = now
+            row.last_used = now
+            if evicted:
+                db.query(SQLCacheEntry).filter(SQLCacheEntry.normalized_question.in_(evicted)).delete()
+            db.commit()
+        finally:
+            db.close()
+
+    def _touch(self, key: str):
+        db = self.session_factory()
+        try:
+            db.query(SQLCacheEntry).filter(SQLCacheEntry.normalized_question == key).update(
+                {"last_used": int(time.time()), "hits": SQLCacheEntry.hits + 1}
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _delete(self, keys: List[str]):
+        db = self.session_factory()
+        try:
+            db.query(SQLCacheEntry).filter(SQLCacheEntry.normalized_question.in_(keys)).delete()
+            db.commit()
+        finally:
+            db.close()
+
+    def stats(self) -> dict:
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+            "threshold": self.threshold,
+            "similarity_histogram": dict(sorted(self.similarity_histogram.items())),
+        }
@@ -0,0 +1,276 @@
+import io
+import json
+import os
+import struct
+import sys
+import time
+import uuid
+from typing import List, Optional, Union
+
+import numpy as np
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EMBEDDING_TABLE = "langchain_pg_embedding"
+COLLECTION_TABLE = "langchain_pg_collection"
+INDEX_NAME = "langchain_pg_embedding_ann"
+
+_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+_COPY_TRAILER = struct.pack("!h", -1)
+
+
+def _text_field(val) -> str:
+    if val is None:
+        return "\\N"
+    return (
+        str(val)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _metadata_text(meta) -> str:
+    # metadata may come already serialized (embed.SummaryBatch.metadata_json)
+    return meta if isinstance(meta, str) else json.dumps(meta, default=str)
+
+
+class BulkVectorWriter:
+    """
+    Writes (id, embedding, document, metadata) batches straight into the
+    PGVector tables of one collection with COPY, bypassing
+    PGVector.add_documents. Uses binary COPY (pgvector's binary vector format)
+    unless `binary` is False, in which case vectors are sent as '[x,y,...]' text.
+
+    Call build_index() after a large load to rebuild the ANN index for the
+    new rows; the existing index stays in place (and in use) until then.
+    """
+
+    def __init__(self, connection_string: str, collection_name: str = "vector_embeds", binary: bool = True):
+        self.conn = psycopg2.connect(connection_string)
+        self.binary = binary
+        self.written = 0
+        self.seconds = 0.0
+        with self.conn.cursor() as cur:
+            cur.execute(f"SELECT uuid FROM {COLLECTION_TABLE} WHERE name = %s", (collection_name,))
+            row = cur.fetchone()
+            if not row:
+                raise ValueError(
+                    f"collection {collection_name!r} does not exist; create it with PGVector first"
+                )
+            self.collection_id = uuid.UUID(str(row[0]))
+
+            cur.execute(
+                "SELECT column_name, data_type FROM information_schema.columns WHERE table_name = %s",
+                (EMBEDDING_TABLE,),
+            )
+            types = dict(cur.fetchall())
+        # langchain_community keys rows by a uuid column, langchain_postgres by a varchar id
+        self.pk_column = "uuid" if "uuid" in types else "id"
+        self.pk_is_uuid = types.get(self.pk_column) == "uuid"
+        self.jsonb = types.get("cmetadata") == "jsonb"
+        self.columns = ["collection_id", "embedding", "document", "cmetadata", "custom_id", self.pk_column]
+
+    def _binary_buffer(self, ids, vectors: np.ndarray, documents, metadatas) -> io.BytesIO:
+        buf = io.BytesIO()
+        buf.write(_COPY_HEADER)
+        dim = vectors.shape[1]
+        # pgvector binary input: int16 dim, int16 unused, then big-endian float4s
+        vector_prefix = struct.pack("!ihh", 4 + 4 * dim, dim, 0)
+        vector_bytes = vectors.astype(">f4", copy=False)
+        collection = self.collection_id.bytes
+        ncols = struct.pack("!h", len(self.columns))
+        for i, (record_id, doc, meta) in enumerate(zip(ids, documents, metadatas)):
+            doc_b = doc.encode("utf-8")
+            meta_b = _metadata_text(meta).encode("utf-8")
+            if self.jsonb:
+                meta_b = b"\x01" + meta_b
+            pk_b = uuid.uuid4().bytes if self.pk_is_uuid else str(uuid.uuid4()).encode()
+            buf.write(ncols)
+            buf.write(struct.pack("!i", 16))
+            buf.write(collection)
+            buf.write(vector_prefix)
+            buf.write(vector_bytes[i].tobytes())
+            buf.write(struct.pack("!i", len(doc_b)))
+            buf.write(doc_b)
+            buf.write(struct.pack("!i", len(meta_b)))
+            buf.write(meta_b)
+            if record_id is None:
+                buf.write(struct.pack("!i", -1))
+            else:
+                id_b = str(record_id).encode("utf-8")
+                buf.write(struct.pack("!i", len(id_b)))
+                buf.write(id_b)
+            buf.write(struct.pack("!i", len(pk_b)))
+            buf.write(pk_b)
+        buf.write(_COPY_TRAILER)
+        buf.seek(0)
+        return buf
+
+    def _text_buffer(self, ids, vectors: np.ndarray, documents, metadatas) -> io.StringIO:
+        buf = io.StringIO()
+        collection = str(self.collection_id)
+        for record_id, vec, doc, meta in zip(ids, vectors, documents, metadatas):
+            fields = (
+                collection,
+                "[" + ",".join(map(repr, vec.tolist())) + "]",
+                doc,
+                _metadata_text(meta),
+                record_id,
+                str(uuid.uuid4()),
+            )
+            buf.write("\t".join(map(_text_field, fields)) + "\n")
+        buf.seek(0)
+        return buf
+
+    def write(
+        self,
+        ids: List[Optional[str]],
+        embeddings: List[List[float]],
+        documents: List[str],
+        metadatas: List[Union[dict, str]]
+    ) -> int:
+        """
+        COPY one batch in its own transaction; returns the number of rows
+        written. Metadata is given as dicts or as JSON text.
+        """
+        if not documents:
+            return 0
+        start = time.perf_counter()
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        cols = ", ".join(self.columns)
+        with self.conn.cursor() as cur:
+            if self.binary:
+                buf = self._binary_buffer(ids, vectors, documents, metadatas)
+                cur.copy_expert(f"COPY {EMBEDDING_TABLE} ({cols}) FROM STDIN WITH (FORMAT binary)", buf)
+            else:
+                buf = self._text_buffer(ids, vectors, documents, metadatas)
+                cur.copy_expert(f"COPY {EMBEDDING_TABLE} ({cols}) FROM STDIN", buf)
+        self.conn.commit()
+        self.seconds += time.perf_counter() - start
+        self.written += len(documents)
+        return len(documents)
+
+    def delete(self, ids: List[str]):
+        """Remove this collection's rows with the given custom ids."""
+        if not ids:
+            return
+        with self.conn.cursor() as cur:
+            cur.execute(
+                f"DELETE FROM {EMBEDDING_TABLE} WHERE collection_id = %s AND custom_id = ANY(%s)",
+                (str(self.collection_id), list(ids)),
+            )
+        self.conn.commit()
+
+    def delete_unkeyed(self) -> int:
+        """
+        Remove this collection's rows without a record_key, i.e. ones written
+        before summaries were keyed; they can never be matched, replaced or
+        skipped, so they would only show up as duplicates. Returns the count.
+        """
+        with self.conn.cursor() as cur:
+            cur.execute(
+                f"DELETE FROM {EMBEDDING_TABLE} WHERE collection_id = %s AND cmetadata->>'record_key' IS NULL",
+                (str(self.collection_id),),
+            )
+            deleted = cur.rowcount
+        self.conn.commit()
+        return deleted
+
+    def _typmod(self, cur) -> int:
+        cur.execute(
+            "SELECT atttypmod FROM pg_attribute "
+            "WHERE attrelid = %s::regclass AND attname = 'embedding'",
+            (EMBEDDING_TABLE,),
+        )
+        return cur.fetchone()[0]
+
+    def set_dimension(self, dim: Optional[int] = None) -> Optional[int]:
+        """
+        One-off migration giving the shared embedding column a fixed type,
+        vector(dim), which both ANN index types need. It rewrites the whole
+        table under an exclusive lock and fails if any collection holds
+        vectors of another size, so it is run on purpose
+        (`python vector_writer.py set-dimension [DIM]`), never by a load.
+        `dim` defaults to the size of a vector stored in this collection;
+        returns the dimension, or None when there is nothing to go by.
+        """
+        with self.conn.cursor() as cur:
+            typmod = self._typmod(cur)
+            if dim is None:
+                if typmod > 0:
+                    return typmod
+                cur.execute(
+                    f"SELECT vector_dims(embedding) FROM {EMBEDDING_TABLE} WHERE collection_id = %s LIMIT 1",
+                    (str(self.collection_id),),
+                )
+                row = cur.fetchone()
+                if not row:
+                    return None
+                dim = row[0]
+            if typmod != dim:
+                cur.execute(f"ALTER TABLE {EMBEDDING_TABLE} ALTER COLUMN embedding TYPE vector({int(dim)})")
+        self.conn.commit()
+        return dim
+
+    def build_index(self, method: str = "ivfflat") -> bool:
+        """
+        (Re)build the ANN index after a load while the old one keeps serving
+        searches: the new index is built CONCURRENTLY under a temporary name
+        and then swapped in. ivfflat gets rows/1000 lists (sqrt(rows) past a
+        million rows) for this collection's rows, as pgvector recommends.
+        Returns False, building nothing, while the embedding column has no
+        fixed dimension; see set_dimension().
+        """
+        building = f"{INDEX_NAME}_new"
+        with self.conn.cursor() as cur:
+            if self._typmod(cur) <= 0:
+                print(f"{EMBEDDING_TABLE}.embedding has no fixed dimension, so no ANN index was built; "
+                      "run `python vector_writer.py set-dimension` once to migrate it")
+                self.conn.rollback()
+                return False
+            if method == "hnsw":
+                using = "hnsw (embedding vector_cosine_ops)"
+            else:
+                cur.execute(
+                    f"SELECT count(*) FROM {EMBEDDING_TABLE} WHERE collection_id = %s",
+                    (str(self.collection_id),),
+                )
+                rows = cur.fetchone()[0]
+                lists = max(1, rows // 1000 if rows <= 1_000_000 else int(rows ** 0.5))
+                using = f"ivfflat (embedding vector_cosine_ops) WITH (lists = {lists})"
+        self.conn.commit()
+
+        # CREATE/DROP INDEX CONCURRENTLY can't run inside a transaction block
+        self.conn.autocommit = True
+        try:
+            with self.conn.cursor() as cur:
+                # an interrupted build leaves an invalid index behind under the temporary name
+                cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {building}")
+                cur.execute(f"CREATE INDEX CONCURRENTLY {building} ON {EMBEDDING_TABLE} USING {using}")
+                cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX_NAME}")
+                cur.execute(f"ALTER INDEX {building} RENAME TO {INDEX_NAME}")
+                cur.execute(f"ANALYZE {EMBEDDING_TABLE}")
+        finally:
+            self.conn.autocommit = False
+        return True
+
+    @property
+    def docs_per_second(self) -> float:
+        return self.written / self.seconds if self.seconds else 0.0
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    # python vector_writer.py set-dimension [DIM]
+    if len(sys.argv) < 2 or sys.argv[1] != "set-dimension":
+        raise SystemExit("usage: python vector_writer.py set-dimension [DIM]")
+    writer = BulkVectorWriter(os.getenv("POSTGRESQL_URI"), "vector_embeds")
+    dim = writer.set_dimension(int(sys.argv[2]) if len(sys.argv) > 2 else None)
+    writer.close()
+    print(f"{EMBEDDING_TABLE}.embedding is vector({dim})" if dim else "no vectors stored yet; pass DIM")
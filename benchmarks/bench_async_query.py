@@ -0,0 +1,123 @@
+"""
+Throughput of the async /query handler under concurrent load.
+
+The chat model is a stub that waits `--latency` seconds per call (GPT-4
+round trips dominate real requests) and never answers with SQL, so every
+request takes the RAG branch: one routing call, retrieval from a small
+local FAISS index of fake embeddings, and one answer call. With a
+non-blocking handler, throughput should grow roughly linearly with the
+number of concurrent requests:
+
+    python benchmarks/bench_async_query.py --latency 0.5 --concurrency 1 4 16 64
+
+Pass --sql to take the SQL branch instead (the stub answers "SELECT 1"),
+which needs POSTGRESQL_URI to point at a reachable database.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import List
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+os.environ["EMBEDDINGS_BACKEND"] = "fake"
+os.environ["EMBEDDING_CACHE_DIR"] = ""
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from embeddings import HashEmbeddings  # noqa: E402
+from fakes import SlowChatModel, build_faiss_store  # noqa: E402
+
+
+def build_store(directory: str, docs: int, size: int):
+    counties = ["POLK", "LINN", "SCOTT", "JOHNSON"]
+    texts = [
+        f"Store {i % 300} sold {i % 50} bottles of item {i % 700} in {counties[i % 4]} county"
+        for i in range(docs)
+    ]
+    metadatas = [{"county": counties[i % 4], "record_id": str(i)} for i in range(docs)]
+    return build_faiss_store(directory, texts, metadatas, HashEmbeddings(size=size))
+
+
+async def run_level(client: httpx.AsyncClient, concurrency: int, requests: int) -> dict:
+    latencies = []
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(i)
+
+    async def worker():
+        while True:
+            try:
+                i = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            resp = await client.post("/query", json={"question": f"What sold best in store {i % 300}?"})
+            resp.raise_for_status()
+            if "error" in resp.json():
+                raise RuntimeError(resp.json()["error"])
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(requests / elapsed, 2),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+    }
+
+
+async def run(args) -> List[dict]:
+    with tempfile.TemporaryDirectory() as directory:
+        store = build_store(directory, args.docs, args.dim)
+        stub = SlowChatModel(latency=args.latency, response="SELECT 1" if args.sql else "Not answerable with SQL.")
+        main.rag_chain = main.create_rag_chain(vectorstore=store, chat_model=stub)
+        if args.sql:
+            main.pg_engine = main.create_async_engine(main.async_database_url(main.db_connection_string))
+
+        transport = httpx.ASGITransport(app=main.app)
+        results = []
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for concurrency in args.concurrency:
+                result = await run_level(client, concurrency, max(args.requests, concurrency * 2))
+                # each request is two stub calls (RAG) or one (SQL)
+                calls = 1 if args.sql else 2
+                result["ideal_requests_per_second"] = round(concurrency / (calls * args.latency), 2)
+                results.append(result)
+                print(result)
+        if main.pg_engine is not None:
+            await main.pg_engine.dispose()
+        return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per stub LLM call")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=64, help="requests per concurrency level (at least 2x concurrency)")
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--sql", action="store_true", help="exercise the SQL branch against POSTGRESQL_URI")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
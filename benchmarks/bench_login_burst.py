@@ -0,0 +1,114 @@
+"""
+Does a burst of logins stall the rest of the API?
+
+Registers a user, then fires `--logins` concurrent POST /auth/token calls
+while a probe hits GET / every `--probe-interval` seconds. It reports login
+throughput and the probe's latency during the burst. With bcrypt on the
+hashing executor the probe should stay in the low milliseconds; pass
+--inline to hash on the event loop (the old behaviour) for comparison.
+
+    python benchmarks/bench_login_burst.py --logins 50
+    python benchmarks/bench_login_burst.py --logins 50 --inline
+
+Runs against a throwaway login.db in a temporary directory.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+os.environ.setdefault("SECRET_KEY", "bench-secret")
+os.environ.setdefault("REFRESH_SECRET_KEY", "bench-refresh-secret")
+os.environ["EMBEDDING_CACHE_DIR"] = ""
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+# main.py creates login.db in the working directory
+os.chdir(tempfile.mkdtemp())
+
+import httpx  # noqa: E402
+
+import auth  # noqa: E402
+import main  # noqa: E402
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(args) -> dict:
+    if args.inline:
+        async def inline(fn, *fn_args):
+            return fn(*fn_args)
+        auth.hasher._run = inline
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        resp = await client.post("/auth/register", json={"username": "bench", "password": "bench-password"})
+        resp.raise_for_status()
+
+        done = asyncio.Event()
+        probes = []
+
+        async def probe():
+            while not done.is_set():
+                start = time.perf_counter()
+                await client.get("/")
+                probes.append(time.perf_counter() - start)
+                await asyncio.sleep(args.probe_interval)
+
+        async def login():
+            resp = await client.post("/auth/token", data={"username": "bench", "password": "bench-password"})
+            return resp.status_code
+
+        prober = asyncio.create_task(probe())
+        await asyncio.sleep(args.probe_interval * 5)
+        baseline = list(probes)
+        start = time.perf_counter()
+        try:
+            codes = await asyncio.gather(*(login() for _ in range(args.logins)))
+        finally:
+            elapsed = time.perf_counter() - start
+            done.set()
+            await prober
+        during = probes[len(baseline):]
+
+    result = {
+        "mode": "inline" if args.inline else f"executor({auth.PASSWORD_HASH_WORKERS})",
+        "logins": args.logins,
+        "ok": codes.count(200),
+        "rejected": codes.count(503),
+        "seconds": round(elapsed, 3),
+        "logins_per_second": round(args.logins / elapsed, 2),
+        "probe_baseline_p50_ms": round(statistics.median(baseline) * 1000, 2) if baseline else None,
+        "probe_count_during_burst": len(during),
+        "probe_p50_ms": round(statistics.median(during) * 1000, 2) if during else None,
+        "probe_p95_ms": round(percentile(during, 0.95) * 1000, 2) if during else None,
+        "probe_max_ms": round(max(during) * 1000, 2) if during else None,
+        "hasher": auth.hasher.stats(),
+    }
+    return result
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument("--probe-interval", type=float, default=0.01)
+    parser.add_argument("--inline", action="store_true", help="hash on the event loop, as before")
+    parser.add_argument("--json", help="write the result to this file")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,119 @@
+"""
+Compare latency of typical LiquorSales queries on the month-partitioned,
+indexed schema (create_partitioned.sql) and on a flat heap copy of the same
+rows (the create.sql layout).
+
+    python benchmarks/bench_partitioning.py --build-flat --repeat 5 --json out.json
+
+Uses POSTGRESQL_URI for the connection.
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Shapes the /query SQL branch and embed.py produce most often
+QUERIES = {
+    "sales_in_quarter": """
+        SELECT SUM(sale_dollars) FROM {table}
+        WHERE date >= make_date(%(year)s::int, 1, 1) AND date < make_date(%(year)s::int, 4, 1)
+    """,
+    "top_stores_in_year": """
+        SELECT name, SUM(sale_dollars) AS total FROM {table}
+        WHERE date >= make_date(%(year)s::int, 1, 1) AND date < make_date(%(year)s::int + 1, 1, 1)
+        GROUP BY name ORDER BY total DESC LIMIT 10
+    """,
+    "county_bottles_in_month": """
+        SELECT SUM(sale_bottles) FROM {table}
+        WHERE county = %(county)s
+          AND date >= make_date(%(year)s::int, 6, 1) AND date < make_date(%(year)s::int, 7, 1)
+    """,
+    "item_recent_sales": """
+        SELECT date, name, sale_dollars FROM {table}
+        WHERE im_desc = %(item)s ORDER BY date DESC LIMIT 20
+    """,
+    "vendor_total": """
+        SELECT SUM(sale_dollars) FROM {table} WHERE vendor_name = %(vendor)s
+    """,
+    "category_by_month": """
+        SELECT DATE_TRUNC('month', date) AS month, SUM(sale_dollars) FROM {table}
+        WHERE category_name = %(category)s GROUP BY 1 ORDER BY 1
+    """,
+}
+
+
+def build_flat_copy(conn, source, flat):
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {flat}")
+        cur.execute(f"CREATE TABLE {flat} AS SELECT * FROM {source}")
+        cur.execute(f"ANALYZE {flat}")
+    conn.commit()
+
+
+def time_query(conn, sql, params, repeat):
+    timings = []
+    with conn.cursor() as cur:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            cur.execute(sql, params)
+            cur.fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "median_ms": statistics.median(timings),
+        "min_ms": min(timings),
+        "max_ms": max(timings),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--partitioned", default="liquorsales")
+    parser.add_argument("--flat", default="liquorsales_flat")
+    parser.add_argument("--build-flat", action="store_true",
+                        help="(re)create the flat table as a plain copy of the partitioned one")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--year", default="2023")
+    parser.add_argument("--county", default="POLK")
+    parser.add_argument("--item", default="TITOS HANDMADE VODKA")
+    parser.add_argument("--vendor", default="DIAGEO AMERICAS")
+    parser.add_argument("--category", default="AMERICAN VODKAS")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.getenv("POSTGRESQL_URI"))
+    if args.build_flat:
+        print(f"Copying {args.partitioned} into {args.flat} ...")
+        build_flat_copy(conn, args.partitioned, args.flat)
+
+    params = {
+        "year": args.year, "county": args.county, "item": args.item,
+        "vendor": args.vendor, "category": args.category,
+    }
+    results = {}
+    print(f"{'query':<26}{'flat ms':>12}{'partitioned ms':>16}{'speedup':>10}")
+    for name, sql in QUERIES.items():
+        # one untimed run each so both sides are measured with a warm cache
+        flat_sql = sql.format(table=args.flat)
+        part_sql = sql.format(table=args.partitioned)
+        time_query(conn, flat_sql, params, 1)
+        time_query(conn, part_sql, params, 1)
+        flat = time_query(conn, flat_sql, params, args.repeat)
+        part = time_query(conn, part_sql, params, args.repeat)
+        results[name] = {"flat": flat, "partitioned": part}
+        speedup = flat["median_ms"] / part["median_ms"] if part["median_ms"] else float("inf")
+        print(f"{name:<26}{flat['median_ms']:>12.1f}{part['median_ms']:>16.1f}{speedup:>9.1f}x")
+
+    conn.close()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
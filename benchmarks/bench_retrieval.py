@@ -0,0 +1,123 @@
+"""
+Recall@k and latency of the local FAISS index against PGVector.
+
+Query vectors are stored embeddings with a little noise added. Ground
+truth is an exact (index-free) cosine search in PostgreSQL; the PGVector
+ANN index and the FAISS index are both scored against it.
+
+    python benchmarks/bench_retrieval.py --queries 200 --k 10 --json out.json
+
+Uses POSTGRESQL_URI and FAISS_INDEX_DIR (build it with backend/faiss_store.py).
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+import psycopg2
+from dotenv import load_dotenv
+from pgvector.psycopg2 import register_vector
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from embeddings import HashEmbeddings  # noqa: E402
+from faiss_store import FaissStore, FAISS_INDEX_DIR  # noqa: E402
+
+load_dotenv()
+
+KNN_QUERY = """
+    SELECT e.custom_id
+    FROM langchain_pg_embedding e
+    JOIN langchain_pg_collection c ON e.collection_id = c.uuid
+    WHERE c.name = %s
+    ORDER BY e.embedding <=> %s
+    LIMIT %s
+"""
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize(latencies, recalls):
+    return {
+        "recall": statistics.mean(recalls),
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+    }
+
+
+def pg_search(cur, collection, vector, k):
+    start = time.perf_counter()
+    cur.execute(KNN_QUERY, (collection, vector, k))
+    ids = [r[0] for r in cur.fetchall()]
+    return ids, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--collection", default="vector_embeds")
+    parser.add_argument("--index-dir", default=FAISS_INDEX_DIR)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--noise", type=float, default=0.01)
+    parser.add_argument("--probes", type=int, default=10, help="ivfflat.probes for the PGVector ANN search")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.getenv("POSTGRESQL_URI"))
+    conn.autocommit = True
+    register_vector(conn)
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT e.embedding FROM langchain_pg_embedding e
+        JOIN langchain_pg_collection c ON e.collection_id = c.uuid
+        WHERE c.name = %s ORDER BY random() LIMIT %s
+        """,
+        (args.collection, args.queries),
+    )
+    rng = np.random.default_rng(0)
+    queries = []
+    for (vec,) in cur.fetchall():
+        vec = np.asarray(vec, dtype=np.float32)
+        queries.append(vec + rng.normal(0, args.noise, vec.shape).astype(np.float32))
+
+    # embeddings are never called: every search below is by vector
+    store = FaissStore(HashEmbeddings(size=len(queries[0])), args.index_dir)
+
+    results = {"pgvector": ([], []), "faiss": ([], [])}
+    for vec in queries:
+        cur.execute("SET enable_indexscan = off")
+        truth, _ = pg_search(cur, args.collection, vec, args.k)
+        cur.execute("SET enable_indexscan = on")
+        cur.execute(f"SET ivfflat.probes = {int(args.probes)}")
+        truth = set(truth)
+
+        ids, ms = pg_search(cur, args.collection, vec, args.k)
+        results["pgvector"][0].append(ms)
+        results["pgvector"][1].append(len(truth & set(ids)) / len(truth))
+
+        start = time.perf_counter()
+        docs = store.similarity_search_by_vector(vec.tolist(), k=args.k)
+        ms = (time.perf_counter() - start) * 1000
+        ids = {d.metadata.get("record_id") for d in docs}
+        results["faiss"][0].append(ms)
+        results["faiss"][1].append(len(truth & ids) / len(truth))
+
+    conn.close()
+    summary = {name: summarize(*vals) for name, vals in results.items()}
+    print(f"{'backend':<10}{'recall@' + str(args.k):>12}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, s in summary.items():
+        print(f"{name:<10}{s['recall']:>12.3f}{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
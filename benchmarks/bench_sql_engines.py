@@ -0,0 +1,233 @@
+"""
+Latency of typical aggregate queries from the /query SQL branch on
+PostgreSQL and on the embedded DuckDB engine over the Parquet export.
+
+Both sides go through main.iter_sql_rows, the path /query uses, so DuckDB
+timings include the worker-thread hop and bind rewriting. Every query's
+rows are compared between the two engines before anything is timed.
+
+Offline, synthetic rows (synthetic.py) are loaded into SQLite as the row
+store and exported to Parquet the way DataLoader.py does:
+
+    python benchmarks/bench_sql_engines.py --rows 500000 --repeat 5
+
+With --pg, POSTGRESQL_URI's LiquorSales is used and exported with
+DataLoader.export_parquet (skip that with --reuse-export):
+
+    python benchmarks/bench_sql_engines.py --pg --parquet-dir parquet --json out.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+os.environ["EMBEDDINGS_BACKEND"] = "fake"
+os.environ["EMBEDDING_CACHE_DIR"] = ""
+os.environ["TOKEN_SWEEP_INTERVAL"] = "0"
+
+REPO = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(REPO, "backend"))
+sys.path.insert(0, REPO)
+# main.py creates login.db in the working directory; file arguments stay relative to where we started
+CWD = os.getcwd()
+os.chdir(tempfile.mkdtemp())
+
+import psycopg2  # noqa: E402
+from sqlalchemy.ext.asyncio import create_async_engine  # noqa: E402
+
+import DataLoader  # noqa: E402
+import main  # noqa: E402
+from duckdb_engine import ParquetEngine  # noqa: E402
+from query_router import compile_template  # noqa: E402
+from result_cache import ResultCache  # noqa: E402
+
+from fakes import export_parquet, load_sqlite  # noqa: E402
+from synthetic import SyntheticLiquorSales  # noqa: E402
+
+# questions the local templates compile (sums by store, item, vendor, category, county)
+TEMPLATE_QUESTIONS = [
+    "total sales in 2023",
+    "total bottles in polk county in 2023",
+    "top 10 stores by sales in 2023",
+    "top 5 items by bottles in q2 2024",
+    "top 10 vendors by sales between 2022 and 2023",
+    "top 10 categories by liters in march 2023",
+    "top 5 counties by sales",
+]
+# SQL shaped like what the LLM writes for questions the templates don't cover
+LLM_QUERIES = {
+    "vendor_share_by_category": """
+        SELECT category_name, vendor_name, SUM(sale_dollars) AS total_sales, COUNT(*) AS orders
+        FROM liquorsales GROUP BY category_name, vendor_name
+        ORDER BY total_sales DESC LIMIT 20
+    """,
+    "store_avg_order": """
+        SELECT name, AVG(sale_dollars) AS avg_sale, SUM(sale_bottles) AS bottles
+        FROM liquorsales WHERE county = 'POLK' GROUP BY name ORDER BY avg_sale DESC LIMIT 10
+    """,
+    "distinct_items_per_vendor": """
+        SELECT vendor_name, COUNT(DISTINCT im_desc) AS items FROM liquorsales
+        GROUP BY vendor_name ORDER BY items DESC, vendor_name
+    """,
+}
+# PostgreSQL-only date functions, not available on the SQLite stand-in
+PG_QUERIES = {
+    "sales_by_month": """
+        SELECT DATE_TRUNC('month', date) AS month, SUM(sale_dollars) AS total_sales
+        FROM liquorsales GROUP BY 1 ORDER BY 1
+    """,
+    "category_by_year": """
+        SELECT EXTRACT(YEAR FROM date) AS year, category_name, SUM(sale_liters) AS liters
+        FROM liquorsales GROUP BY 1, 2 ORDER BY 1, 3 DESC
+    """,
+}
+
+
+def queries(pg: bool):
+    today = date(2025, 1, 15)
+    result = {}
+    for question in TEMPLATE_QUESTIONS:
+        sql, params = compile_template(question, today=today)
+        result[question.replace(" ", "_")] = (sql, params)
+    for name, sql in LLM_QUERIES.items():
+        result[name] = (sql, {})
+    if pg:
+        for name, sql in PG_QUERIES.items():
+            result[name] = (sql, {})
+    return result
+
+
+async def run_query(sql, params):
+    rows = []
+    async for _, batch, _ in main.iter_sql_rows(sql, params):
+        rows.extend(batch)
+    return rows
+
+
+def _value(v):
+    if isinstance(v, (int, float, Decimal)):
+        return float(v)
+    if isinstance(v, (date, datetime)):
+        # DATE_TRUNC gives a timestamp on PostgreSQL and may give a date on DuckDB
+        return str(v)[:10]
+    return str(v)
+
+
+def same_rows(a, b) -> bool:
+    """Same rows regardless of order; ties at a LIMIT can still pick different rows."""
+    a = sorted((tuple(map(_value, row)) for row in a), key=repr)
+    b = sorted((tuple(map(_value, row)) for row in b), key=repr)
+    if len(a) != len(b):
+        return False
+    for row_a, row_b in zip(a, b):
+        for x, y in zip(row_a, row_b):
+            if isinstance(x, float) and isinstance(y, float):
+                if not math.isclose(x, y, rel_tol=1e-6, abs_tol=1e-6):
+                    return False
+            elif x != y:
+                return False
+    return True
+
+
+async def time_query(sql, params, repeat):
+    # one untimed run so both engines are measured warm
+    await run_query(sql, params)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await run_query(sql, params)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "median_ms": statistics.median(timings),
+        "min_ms": min(timings),
+        "max_ms": max(timings),
+    }
+
+
+async def run(args):
+    parquet_dir = os.path.join(CWD, args.parquet_dir) if args.parquet_dir else os.path.join(os.getcwd(), "parquet")
+    if args.pg:
+        url = os.environ["POSTGRESQL_URI"]
+        main.pg_engine = create_async_engine(main.async_database_url(url))
+        if not args.reuse_export:
+            conn = psycopg2.connect(url)
+            with conn.cursor() as cur:
+                cur.execute("SELECT version FROM data_version WHERE table_name = 'liquorsales'")
+                version = cur.fetchone()[0]
+            start = time.perf_counter()
+            rows = DataLoader.export_parquet(conn, parquet_dir, version)
+            conn.close()
+            print(f"Exported {rows} rows to {parquet_dir} in {time.perf_counter() - start:.1f}s")
+    else:
+        data = SyntheticLiquorSales(args.rows, seed=args.seed)
+        path = os.path.join(os.getcwd(), "liquorsales.db")
+        start = time.perf_counter()
+        load_sqlite(path, data)
+        export_parquet(parquet_dir, data, version=1)
+        print(f"Loaded {args.rows} synthetic rows into SQLite and Parquet in {time.perf_counter() - start:.1f}s")
+        main.pg_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+
+    # iter_sql_rows only uses DuckDB for an export of the current data_version
+    main.result_cache = ResultCache()
+    async with main.pg_engine.connect() as conn:
+        await main.result_cache.refresh_version(conn)
+    engine = ParquetEngine(parquet_dir, threads=args.threads)
+    if not engine.serves(main.result_cache.version):
+        raise SystemExit(f"export in {parquet_dir} is not of data version {main.result_cache.version}")
+    row_store = main.pg_engine.dialect.name
+
+    results = {}
+    print(f"{'query':<44}{row_store + ' ms':>14}{'duckdb ms':>12}{'speedup':>10}")
+    for name, (sql, params) in queries(args.pg).items():
+        main.sql_engine = None
+        expected = await run_query(sql, params)
+        main.sql_engine = engine
+        fallbacks = engine.fallbacks
+        got = await run_query(sql, params)
+        if engine.fallbacks != fallbacks:
+            print(f"{name:<44}  DuckDB could not run it; fell back to {row_store}")
+            continue
+        if not same_rows(expected, got):
+            print(f"{name:<44}  warning: results differ between {row_store} and duckdb")
+
+        main.sql_engine = None
+        row = await time_query(sql, params, args.repeat)
+        main.sql_engine = engine
+        duck = await time_query(sql, params, args.repeat)
+        results[name] = {row_store: row, "duckdb": duck}
+        speedup = row["median_ms"] / duck["median_ms"] if duck["median_ms"] else float("inf")
+        print(f"{name:<44}{row['median_ms']:>14.1f}{duck['median_ms']:>12.1f}{speedup:>9.1f}x")
+
+    engine.close()
+    await main.pg_engine.dispose()
+    return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000, help="synthetic rows (offline only)")
+    parser.add_argument("--seed", type=int, default=620)
+    parser.add_argument("--pg", action="store_true", help="compare against LiquorSales in POSTGRESQL_URI")
+    parser.add_argument("--parquet-dir", help="where the Parquet export goes (default: a temporary directory)")
+    parser.add_argument("--reuse-export", action="store_true", help="with --pg, use the export already in --parquet-dir")
+    parser.add_argument("--threads", type=int, default=4, help="DuckDB threads")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.json:
+        with open(os.path.join(CWD, args.json), "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
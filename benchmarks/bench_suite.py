@@ -0,0 +1,436 @@
+"""
+Offline benchmark suite: ingestion, embedding and /query, with no OpenAI,
+Socrata or PostgreSQL needed.
+
+Everything runs on deterministic synthetic LiquorSales rows
+(synthetic.py). Socrata, the chat model and the embeddings are replaced
+by stubs with configurable latency (fakes.py):
+
+- ingest: DataLoader.run_pipeline fetching pages from FakeSocrata and
+  COPY-encoding them. Offline, the COPY stream is only read, not sent,
+  so this measures the loader's own rows/s. With --pg it also loads a
+  scratch schema in POSTGRESQL_URI, in both copy and insert mode.
+- embed: embed.summarize_columns over the grouped rows, then
+  EmbeddingPool with HashEmbeddings. Reported as docs/s for summarizing
+  alone and for the whole pipeline.
+- query: POST /query at each --concurrency level, for three branches:
+  "sql" (questions compiled locally to SQL), "llm_sql" (the stub LLM
+  writes the SQL) and "rag" (FAISS retrieval over the synthetic
+  summaries plus the stub LLM). SQL runs on SQLite (aiosqlite) loaded
+  with the synthetic rows, or with --pg on the scratch schema.
+
+Results are a flat JSON of metric -> value, stamped with the git commit.
+Pass --baseline to compare against an earlier run; metrics that got worse
+by more than --threshold are flagged, and --fail-on-regression turns that
+into exit status 1:
+
+    python benchmarks/bench_suite.py --rows 50000 --out base.json
+    git checkout my-branch
+    python benchmarks/bench_suite.py --rows 50000 --out new.json --baseline base.json
+
+    python benchmarks/bench_suite.py --compare base.json new.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+os.environ["EMBEDDINGS_BACKEND"] = "fake"
+os.environ["EMBEDDING_CACHE_DIR"] = ""
+os.environ["TOKEN_SWEEP_INTERVAL"] = "0"
+
+REPO = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(REPO, "backend"))
+sys.path.insert(0, REPO)
+# main.py creates login.db in the working directory; file arguments stay relative to where we started
+CWD = os.getcwd()
+os.chdir(tempfile.mkdtemp())
+
+import httpx  # noqa: E402
+from sqlalchemy.ext.asyncio import create_async_engine  # noqa: E402
+
+import DataLoader  # noqa: E402
+import embed  # noqa: E402
+import main  # noqa: E402
+from embedding_pool import AdaptiveRateLimiter, EmbeddingPool  # noqa: E402
+from embeddings import HashEmbeddings  # noqa: E402
+from record_index import RecordIndex  # noqa: E402
+
+from fakes import SlowChatModel, build_faiss_store, load_sqlite  # noqa: E402
+from synthetic import FakeSocrata, SyntheticLiquorSales, grouped_rows  # noqa: E402
+
+# metrics where a larger value is better, and those where smaller is; anything else (counts) isn't compared
+HIGHER_IS_BETTER = ("_per_second",)
+LOWER_IS_BETTER = ("_ms", ".seconds")
+BENCH_SCHEMA = "bench_suite"
+LLM_SQL = (
+    "SELECT county, SUM(sale_dollars) AS total_sales FROM liquorsales "
+    "GROUP BY county ORDER BY total_sales DESC LIMIT 10"
+)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def git_commit() -> Dict[str, object]:
+    def run(*cmd):
+        return subprocess.run(cmd, cwd=REPO, capture_output=True, text=True).stdout.strip()
+    try:
+        return {"commit": run("git", "rev-parse", "HEAD"), "dirty": bool(run("git", "status", "--porcelain"))}
+    except OSError:
+        return {"commit": None, "dirty": None}
+
+
+# ---------------------------------------------------------------- ingest
+
+class NullCursor:
+    """Accepts what the loader sends and drops it; COPY streams are still read to the end."""
+
+    def execute(self, sql, params=None):
+        pass
+
+    def copy_expert(self, sql, buf):
+        while buf.read(1 << 16):
+            pass
+
+    def close(self):
+        pass
+
+
+class NullConnection:
+    def cursor(self):
+        return NullCursor()
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def bench_ingest(data: SyntheticLiquorSales, args) -> Dict[str, float]:
+    source = FakeSocrata(data, latency=args.socrata_latency)
+    targets = [("offline", NullConnection, ["copy"])]
+    if args.pg:
+        targets.append(("pg", connect_bench_schema, ["copy", "insert"]))
+
+    results = {}
+    for target, connect, modes in targets:
+        for mode in modes:
+            load_page = DataLoader.copy_new_rows if mode == "copy" else DataLoader.insert_rows
+            rows = len(data) if mode == "copy" else min(len(data), args.insert_rows)
+            page_source = source if rows == len(data) else FakeSocrata(SyntheticLiquorSales(rows, args.seed), args.socrata_latency)
+            timings = []
+            for _ in range(args.repeat):
+                conn = connect()
+                if target == "pg":
+                    reset_bench_schema(conn)
+                start = time.perf_counter()
+                loaded, _ = DataLoader.run_pipeline(page_source, conn, load_page, checkpoint=False)
+                timings.append(time.perf_counter() - start)
+                if target == "pg":
+                    conn.close()
+                assert loaded == rows, (loaded, rows)
+            seconds = statistics.median(timings)
+            results[f"ingest.{target}.{mode}.seconds"] = round(seconds, 4)
+            results[f"ingest.{target}.{mode}.rows_per_second"] = round(rows / seconds, 1)
+    return results
+
+
+def connect_bench_schema():
+    import psycopg2
+    conn = psycopg2.connect(os.environ["POSTGRESQL_URI"])
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE SCHEMA IF NOT EXISTS {BENCH_SCHEMA}")
+        cur.execute(f"SET search_path TO {BENCH_SCHEMA}")
+    conn.commit()
+    return conn
+
+
+def reset_bench_schema(conn):
+    """create.sql's tables, recreated empty inside the scratch schema."""
+    with open(os.path.join(REPO, "create.sql")) as f, conn.cursor() as cur:
+        cur.execute(f.read())
+    conn.commit()
+
+
+# ----------------------------------------------------------------- embed
+
+def bench_embed(groups: List[tuple], args) -> Dict[str, float]:
+    embeddings = HashEmbeddings(size=args.dim, latency=args.embed_latency)
+    limiter = AdaptiveRateLimiter(args.embed_rpm, args.embed_tpm, start_fraction=1.0)
+    batches = [groups[i:i + args.sql_batch_size] for i in range(0, len(groups), args.sql_batch_size)]
+
+    summarize, pipeline = [], []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        summaries = sum(len(embed.summarize_columns(batch, RecordIndex())[0]) for batch in batches)
+        summarize.append(time.perf_counter() - start)
+
+        pool = EmbeddingPool(embeddings, limiter=limiter)
+        start = time.perf_counter()
+        embedded = 0
+        for batch in batches:
+            summary_batch, _ = embed.summarize_columns(batch, RecordIndex())
+            chunks = (
+                (chunk, chunk.texts)
+                for chunk in (
+                    summary_batch.slice(i, i + args.embed_batch_size)
+                    for i in range(0, len(summary_batch), args.embed_batch_size)
+                )
+            )
+            for chunk, vectors in pool.map(chunks):
+                assert len(vectors) == len(chunk)
+                chunk.metadata_json()
+                embedded += len(chunk)
+        pipeline.append(time.perf_counter() - start)
+        assert embedded == summaries == len(groups)
+
+    return {
+        "embed.groups": len(groups),
+        "embed.summarize.docs_per_second": round(len(groups) / statistics.median(summarize), 1),
+        "embed.pipeline.docs_per_second": round(len(groups) / statistics.median(pipeline), 1),
+    }
+
+
+# ----------------------------------------------------------------- query
+
+def sql_questions(data: SyntheticLiquorSales) -> List[str]:
+    """Distinct questions the local templates compile to SQL."""
+    questions = []
+    periods = ["in 2022", "in 2023", "in 2024", "in march 2023", "in q2 2024", "in q4 2022", "between 2022 and 2023"]
+    for limit in (3, 5, 10):
+        for dimension in ("stores", "items", "vendors", "categories", "counties", "cities"):
+            for measure in ("sales", "bottles", "liters"):
+                for period in periods:
+                    questions.append(f"top {limit} {dimension} by {measure} {period}")
+    for measure in ("sales", "bottles", "liters"):
+        for county in {store["county"].lower() for store in data.stores}:
+            for period in periods:
+                questions.append(f"total {measure} in {county} county {period}")
+    return questions
+
+
+def llm_sql_questions() -> List[str]:
+    return [
+        f"how did {county} county compare with the rest of iowa over the years, question {i}"
+        for i in range(200)
+        for county in ("polk", "linn")
+    ]
+
+
+def rag_questions(data: SyntheticLiquorSales) -> List[str]:
+    return [f"What did {store['name']} sell most of?" for store in data.stores] + [
+        f"Which {item['im_desc']} products were popular?" for item in data.items
+    ]
+
+
+async def keep_source(questions: List[str], wanted, limit: int) -> List[str]:
+    """Questions whose planned source is in `wanted`, so each branch measures what it says."""
+    kept = []
+    for q in questions:
+        _, _, _, source = await main.plan_sql(q)
+        if source in wanted:
+            kept.append(q)
+            if len(kept) >= limit:
+                break
+    return kept
+
+
+async def run_level(client: httpx.AsyncClient, questions: List[str], concurrency: int, requests: int) -> dict:
+    latencies = []
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(questions[i % len(questions)])
+
+    async def worker():
+        while True:
+            try:
+                question = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            resp = await client.post("/query", json={"question": question})
+            resp.raise_for_status()
+            if "error" in resp.json():
+                raise RuntimeError(f"{question!r}: {resp.json()['error']}")
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests_per_second": round(requests / elapsed, 2),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+async def bench_query(data: SyntheticLiquorSales, groups: List[tuple], directory: str, args) -> Dict[str, float]:
+    if args.pg:
+        conn = connect_bench_schema()
+        reset_bench_schema(conn)
+        DataLoader.run_pipeline(FakeSocrata(data), conn, DataLoader.copy_new_rows, checkpoint=False)
+        conn.close()
+        url = main.async_database_url(os.environ["POSTGRESQL_URI"])
+        main.pg_engine = create_async_engine(url, connect_args={"server_settings": {"search_path": BENCH_SCHEMA}})
+    else:
+        path = os.path.join(directory, "liquorsales.db")
+        load_sqlite(path, data)
+        main.pg_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    # every request should do the work it measures
+    main.sql_cache = None
+    main.result_cache = None
+
+    documents, _ = embed.summarize_groups(groups[:args.rag_docs], RecordIndex())
+    store = build_faiss_store(
+        os.path.join(directory, "faiss"),
+        [doc.page_content for doc in documents],
+        [doc.metadata for doc in documents],
+        HashEmbeddings(size=args.dim),
+    )
+
+    limit = max(args.requests, max(args.concurrency) * 2)
+    branches = [
+        ("sql", sql_questions(data), ("template",), "Not answerable with SQL."),
+        ("llm_sql", llm_sql_questions(), ("llm",), LLM_SQL),
+        ("rag", rag_questions(data), ("router", "llm"), "Not answerable with SQL."),
+    ]
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for branch, questions, wanted, response in branches:
+            if args.branches and branch not in args.branches:
+                continue
+            stub = SlowChatModel(latency=args.llm_latency, response=response)
+            main.rag_chain = main.create_rag_chain(vectorstore=store, chat_model=stub)
+            questions = await keep_source(questions, wanted, limit)
+            if not questions:
+                print(f"no questions planned as {wanted} for {branch}; skipped")
+                continue
+            # one untimed pass so lazy imports and connection setup don't land in the first level
+            await run_level(client, questions, 1, 2)
+            for concurrency in args.concurrency:
+                level = await run_level(client, questions, concurrency, max(args.requests, concurrency * 2))
+                for name, value in level.items():
+                    results[f"query.{branch}.c{concurrency}.{name}"] = value
+                print(f"query {branch:<8} concurrency {concurrency:<4} {level}")
+    await main.pg_engine.dispose()
+    return results
+
+
+# ------------------------------------------------------------ comparison
+
+def compare(baseline: dict, current: dict, threshold: float) -> List[str]:
+    """Print every shared metric with its change; return the ones that regressed past `threshold`."""
+    old, new = baseline["results"], current["results"]
+    regressions = []
+    print(f"\n{'metric':<44}{'baseline':>14}{'current':>14}{'change':>10}")
+    for name in sorted(set(old) & set(new)):
+        before, after = old[name], new[name]
+        if not name.endswith(HIGHER_IS_BETTER + LOWER_IS_BETTER) or not before:
+            continue
+        change = (after - before) / before
+        better = change > 0 if name.endswith(HIGHER_IS_BETTER) else change < 0
+        flag = ""
+        if not better and abs(change) > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<44}{before:>14,.2f}{after:>14,.2f}{change:>+9.1%}{flag}")
+    for name in sorted(set(old) ^ set(new)):
+        print(f"{name:<44} only in {'baseline' if name in old else 'current'}")
+    if baseline.get("params") != current.get("params"):
+        print("\nwarning: runs used different parameters; see \"params\" in both files")
+    return regressions
+
+
+async def run(args) -> dict:
+    data = SyntheticLiquorSales(args.rows, seed=args.seed)
+    results = {}
+    if "ingest" in args.only:
+        results.update(bench_ingest(data, args))
+    groups = grouped_rows(data) if {"embed", "query"} & set(args.only) else []
+    if "embed" in args.only:
+        results.update(bench_embed(groups, args))
+    if "query" in args.only:
+        with tempfile.TemporaryDirectory() as directory:
+            results.update(await bench_query(data, groups, directory, args))
+    params = {
+        k: v for k, v in vars(args).items()
+        if k not in ("out", "baseline", "compare", "threshold", "fail_on_regression")
+    }
+    return {
+        **git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs",
+        "params": params,
+        "results": results,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000, help="synthetic LiquorSales rows")
+    parser.add_argument("--seed", type=int, default=620)
+    parser.add_argument("--only", nargs="+", default=["ingest", "embed", "query"], choices=["ingest", "embed", "query"])
+    parser.add_argument("--repeat", type=int, default=3, help="ingest/embed runs; the median is reported")
+    parser.add_argument("--pg", action="store_true",
+                        help=f"also load and query a scratch schema ({BENCH_SCHEMA}) in POSTGRESQL_URI")
+    parser.add_argument("--insert-rows", type=int, default=5000, help="rows for the (slow) insert mode with --pg")
+    parser.add_argument("--socrata-latency", type=float, default=0.05, help="seconds per fake Socrata page")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="seconds per fake embedding call")
+    parser.add_argument("--embed-rpm", type=float, default=1e6, help="embedding rate limit; raise to take it out of the picture")
+    parser.add_argument("--embed-tpm", type=float, default=1e9)
+    parser.add_argument("--embed-batch-size", type=int, default=2000)
+    parser.add_argument("--sql-batch-size", type=int, default=16000)
+    parser.add_argument("--dim", type=int, default=256, help="fake embedding size")
+    parser.add_argument("--rag-docs", type=int, default=20000, help="summaries indexed for the RAG branch")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per stub LLM call")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=64, help="requests per level (at least 2x concurrency)")
+    parser.add_argument("--branches", nargs="+", choices=["sql", "llm_sql", "rag"], help="query branches to run (default all)")
+    parser.add_argument("--out", help="write the result JSON here")
+    parser.add_argument("--baseline", help="result JSON of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change that counts as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="only compare two result files")
+    args = parser.parse_args()
+    for name in ("out", "baseline"):
+        if getattr(args, name):
+            setattr(args, name, os.path.join(CWD, getattr(args, name)))
+    if args.compare:
+        args.compare = [os.path.join(CWD, path) for path in args.compare]
+
+    if args.compare:
+        with open(args.compare[0]) as a, open(args.compare[1]) as b:
+            regressions = compare(json.load(a), json.load(b), args.threshold)
+    else:
+        current = asyncio.run(run(args))
+        print(json.dumps(current["results"], indent=2))
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump(current, f, indent=2)
+        regressions = []
+        if args.baseline:
+            with open(args.baseline) as f:
+                regressions = compare(json.load(f), current, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}")
+        if args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
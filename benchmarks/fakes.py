@@ -0,0 +1,114 @@
+"""
+Stand-ins for the remote services, shared by the benchmarks.
+
+- SlowChatModel: a chat model that answers a fixed text after `latency` seconds
+- embeddings.HashEmbeddings (backend): deterministic local embeddings with `latency`
+- synthetic.FakeSocrata: the Socrata client over synthetic LiquorSales rows
+
+build_faiss_store() indexes texts into a throwaway local FAISS store so
+retrieval runs without PGVector. load_sqlite() puts synthetic rows in a
+SQLite database that stands in for PostgreSQL, and export_parquet() writes
+them as the Parquet dataset DataLoader.py would export.
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+REPO = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(REPO, "backend"))
+sys.path.insert(0, REPO)
+
+import pyarrow as pa  # noqa: E402
+import pyarrow.compute as pc  # noqa: E402
+from langchain.callbacks.manager import (  # noqa: E402
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain.chat_models.base import BaseChatModel  # noqa: E402
+from langchain.embeddings.base import Embeddings  # noqa: E402
+from langchain.schema import AIMessage, BaseMessage, ChatGeneration, ChatResult  # noqa: E402
+
+import DataLoader  # noqa: E402
+from faiss_store import FaissStore, write_faiss_index  # noqa: E402
+from synthetic import SyntheticLiquorSales  # noqa: E402
+
+
+class SlowChatModel(BaseChatModel):
+    """Answers `response` after `latency` seconds, without blocking the event loop on the async path."""
+
+    latency: float = 0.5
+    response: str = "Not answerable with SQL."
+
+    @property
+    def _llm_type(self) -> str:
+        return "slow-stub"
+
+    def _result(self) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.response))])
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any
+    ) -> ChatResult:
+        time.sleep(self.latency)
+        return self._result()
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any
+    ) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return self._result()
+
+
+def build_faiss_store(
+    directory: str,
+    texts: List[str],
+    metadatas: List[Dict[str, Any]],
+    embeddings: Embeddings,
+    method: str = "hnsw"
+) -> FaissStore:
+    rows = list(zip(embeddings.embed_documents(texts), texts, metadatas))
+    write_faiss_index(iter([rows]), len(rows), directory, method)
+    return FaissStore(embedding=embeddings, directory=directory)
+
+
+def load_sqlite(path: str, data: SyntheticLiquorSales):
+    """The synthetic rows in a SQLite liquorsales table, create.sql's columns, plus data_version."""
+    columns = DataLoader.COLUMNS
+    conn = sqlite3.connect(path)
+    conn.execute(f"CREATE TABLE liquorsales ({', '.join(columns)})")
+    conn.execute("CREATE INDEX liquorsales_date ON liquorsales (date)")
+    page = DataLoader.page_to_columns
+    for offset in range(0, len(data), DataLoader.PAGE_SIZE):
+        cols = page(data.page(offset, DataLoader.PAGE_SIZE))
+        cols["date"] = [d.replace("T", " ")[:19] if d else None for d in cols["date"]]
+        conn.executemany(
+            f"INSERT INTO liquorsales VALUES ({', '.join('?' * len(columns))})",
+            zip(*(cols[c] for c in columns)),
+        )
+    conn.execute("CREATE TABLE data_version (table_name TEXT PRIMARY KEY, version INTEGER)")
+    conn.execute("INSERT INTO data_version VALUES ('liquorsales', 1)")
+    conn.commit()
+    conn.close()
+
+
+def export_parquet(directory: str, data: SyntheticLiquorSales, version: int = 1) -> int:
+    """The synthetic rows as DataLoader.export_parquet lays them out, stamped with `version`."""
+    pages = range(0, len(data), DataLoader.PAGE_SIZE)
+    table = pa.concat_tables(DataLoader.page_to_table(data.page(offset, DataLoader.PAGE_SIZE)) for offset in pages)
+    table = table.sort_by([("date", "ascending"), ("invoice_line_no", "ascending")])
+    months = pc.floor_temporal(table["date"], unit="month")
+    for month in pc.unique(months).to_pylist():
+        DataLoader.write_parquet_partition(directory, month, [table.filter(pc.equal(months, month))])
+    DataLoader.write_parquet_version(directory, version)
+    return table.num_rows
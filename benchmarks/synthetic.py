@@ -0,0 +1,249 @@
+"""
+Deterministic synthetic LiquorSales data for offline benchmarks.
+
+Rows look like Socrata's API output for the Iowa liquor sales dataset
+(cc6f-sgik): every create.sql column, values as strings, store_location
+as a GeoJSON point. The same --rows and --seed always produce the same
+rows, so runs on different commits load identical data. Store, item and
+vendor popularity is skewed the way real sales are, which keeps GROUP BY
+and top-N queries realistic.
+
+    python benchmarks/synthetic.py --rows 100000 --out rows.jsonl
+    SOCRATA_FIXTURE=rows.jsonl python DataLoader.py
+
+Also provides FakeSocrata, a stand-in for the Socrata client with
+configurable per-page latency, and grouped_rows(), which rolls the rows
+up the way embed.py's GROUPED_QUERY does.
+"""
+import argparse
+import json
+import random
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List
+
+COUNTIES = [
+    ("POLK", "77", "DES MOINES", 41.59, -93.62),
+    ("LINN", "57", "CEDAR RAPIDS", 41.98, -91.67),
+    ("SCOTT", "82", "DAVENPORT", 41.52, -90.58),
+    ("JOHNSON", "52", "IOWA CITY", 41.66, -91.53),
+    ("BLACK HAWK", "07", "WATERLOO", 42.49, -92.34),
+    ("WOODBURY", "97", "SIOUX CITY", 42.50, -96.40),
+    ("DUBUQUE", "31", "DUBUQUE", 42.50, -90.66),
+    ("STORY", "85", "AMES", 42.03, -93.62),
+    ("POTTAWATTAMIE", "78", "COUNCIL BLUFFS", 41.26, -95.86),
+    ("DALLAS", "25", "WEST DES MOINES", 41.57, -93.78),
+    ("CERRO GORDO", "17", "MASON CITY", 43.15, -93.20),
+    ("WARREN", "91", "INDIANOLA", 41.36, -93.56),
+]
+CATEGORIES = [
+    ("1031100", "AMERICAN VODKAS"),
+    ("1031200", "AMERICAN FLAVORED VODKA"),
+    ("1032100", "IMPORTED VODKAS"),
+    ("1011100", "BLENDED WHISKIES"),
+    ("1011200", "STRAIGHT BOURBON WHISKIES"),
+    ("1011300", "TENNESSEE WHISKIES"),
+    ("1012100", "CANADIAN WHISKIES"),
+    ("1022100", "MIXTO TEQUILA"),
+    ("1022200", "100% AGAVE TEQUILA"),
+    ("1062200", "SPICED RUM"),
+    ("1081200", "CREAM LIQUEURS"),
+    ("1081300", "WHISKEY LIQUEUR"),
+]
+VENDORS = [
+    ("260", "DIAGEO AMERICAS"),
+    ("421", "SAZERAC COMPANY INC"),
+    ("65", "JIM BEAM BRANDS"),
+    ("434", "LUXCO INC"),
+    ("259", "HEAVEN HILL BRANDS"),
+    ("35", "BACARDI USA INC"),
+    ("370", "PERNOD RICARD USA"),
+    ("395", "PROXIMO"),
+    ("297", "LAIRD & COMPANY"),
+    ("85", "BROWN FORMAN CORP."),
+]
+BRAND_WORDS = [
+    "BLACK", "CROWN", "OLD", "RIVER", "PRAIRIE", "HAWKEYE", "SILVER", "ROYAL",
+    "GOLDEN", "NORTHERN", "CAPTAIN", "TITAN", "EAGLE", "STONE", "OAK", "FIVE STAR",
+]
+STORE_KINDS = ["HY-VEE", "FAREWAY STORES", "CASEY'S GENERAL STORE", "KUM & GO", "WALMART", "LIQUOR TOBACCO & VAPE"]
+PACKS = [6, 12, 24, 48]
+VOLUMES = [50, 200, 375, 750, 1000, 1750]
+
+START_DATE = date(2022, 1, 1)
+END_DATE = date(2024, 12, 31)
+
+
+def _zipf_weights(n: int, s: float = 1.1) -> List[float]:
+    return [1.0 / (rank + 1) ** s for rank in range(n)]
+
+
+class SyntheticLiquorSales:
+    """
+    `rows` LiquorSales rows drawn from `stores` stores and `items` items
+    between START_DATE and END_DATE. Row i only depends on (seed, i), so
+    any page can be generated on its own.
+    """
+
+    def __init__(self, rows: int, seed: int = 620, stores: int = None, items: int = None):
+        self.rows = rows
+        self.seed = seed
+        # catalog size grows slowly with scale, roughly like the real dataset
+        self.n_stores = stores or max(20, min(2000, rows // 500))
+        self.n_items = items or max(50, min(5000, rows // 200))
+        self.days = (END_DATE - START_DATE).days + 1
+
+        rng = random.Random(seed)
+        self.stores = []
+        for i in range(self.n_stores):
+            county, county_number, city, lat, lon = COUNTIES[i % len(COUNTIES)]
+            self.stores.append({
+                "store": str(2000 + i),
+                "name": f"{rng.choice(STORE_KINDS)} #{i + 1} / {city}",
+                "address": f"{100 + rng.randrange(9000)} {rng.choice(['MAIN', 'GRAND', 'UNIVERSITY', '1ST'])} ST",
+                "city": city,
+                "zipcode": str(50000 + rng.randrange(2800)),
+                # a few stores have no geocoded location, as in the real data
+                "store_location": None if i % 20 == 19 else {
+                    "type": "Point",
+                    "coordinates": [round(lon + rng.uniform(-0.1, 0.1), 5), round(lat + rng.uniform(-0.1, 0.1), 5)],
+                },
+                "county_number": county_number,
+                "county": county,
+            })
+        self.items = []
+        for i in range(self.n_items):
+            category, category_name = CATEGORIES[rng.randrange(len(CATEGORIES))]
+            vendor_no, vendor_name = VENDORS[rng.randrange(len(VENDORS))]
+            volume = rng.choice(VOLUMES)
+            cost = round(rng.uniform(3, 40) * volume / 750, 2)
+            self.items.append({
+                "category": category,
+                "category_name": category_name,
+                "vendor_no": vendor_no,
+                "vendor_name": vendor_name,
+                "itemno": str(10000 + i),
+                "im_desc": f"{rng.choice(BRAND_WORDS)} {rng.choice(BRAND_WORDS)} {category_name.split()[-1].rstrip('S')} {i}",
+                "pack": str(rng.choice(PACKS)),
+                "bottle_volume_ml": str(volume),
+                "state_bottle_cost": f"{cost:.2f}",
+                "state_bottle_retail": f"{cost * 1.5:.2f}",
+            })
+        self.store_weights = _zipf_weights(self.n_stores)
+        self.item_weights = _zipf_weights(self.n_items)
+
+    def __len__(self):
+        return self.rows
+
+    def row(self, i: int) -> Dict[str, object]:
+        rng = random.Random(self.seed * 1_000_003 + i)
+        store = rng.choices(self.stores, self.store_weights)[0]
+        item = rng.choices(self.items, self.item_weights)[0]
+        day = START_DATE + timedelta(days=rng.randrange(self.days))
+        bottles = rng.choice((1, 1, 2, 3, 6, 6, 12, 12, 24, 48))
+        volume = int(item["bottle_volume_ml"])
+        liters = bottles * volume / 1000
+        row = {
+            "invoice_line_no": f"INV-{10_000_000_000 + i}",
+            "date": f"{day.isoformat()}T00:00:00.000",
+            **store,
+            **item,
+            "sale_bottles": str(bottles),
+            "sale_dollars": f"{bottles * float(item['state_bottle_retail']):.2f}",
+            "sale_liters": f"{liters:.2f}",
+            "sale_gallons": f"{liters * 0.264172:.2f}",
+        }
+        if row["store_location"] is None:
+            del row["store_location"]
+        return row
+
+    def page(self, offset: int, limit: int) -> List[Dict[str, object]]:
+        return [self.row(i) for i in range(offset, min(offset + limit, self.rows))]
+
+    def __iter__(self) -> Iterator[Dict[str, object]]:
+        for i in range(self.rows):
+            yield self.row(i)
+
+
+class FakeSocrata:
+    """
+    The parts of sodapy.Socrata that DataLoader.py uses, serving a
+    SyntheticLiquorSales. Each get() sleeps `latency` seconds like a
+    network round trip. Pages are generated up front (outside any timing)
+    unless `pregenerate` is False. `where` and `order` are ignored: rows
+    always come back in index order.
+    """
+
+    def __init__(self, data: SyntheticLiquorSales, latency: float = 0.0, pregenerate: bool = True):
+        self.data = data
+        self.latency = latency
+        self.rows = list(data) if pregenerate else None
+        self.calls = 0
+
+    def get(self, dataset_identifier, limit=1000, offset=0, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.rows is not None:
+            return self.rows[offset:offset + limit]
+        return self.data.page(offset, limit)
+
+
+def grouped_rows(rows) -> List[tuple]:
+    """
+    Rows rolled up per store / item / month with the columns of embed.py's
+    GROUPED_QUERY (agg_id is None), in the same order.
+    """
+    groups = defaultdict(list)
+    for row in rows:
+        month = datetime.strptime(row["date"][:7], "%Y-%m")
+        groups[(row["name"], row["im_desc"], month, row["category_name"])].append(row)
+
+    result = []
+    for (name, im_desc, month, category_name), members in groups.items():
+        members.sort(key=lambda r: r["invoice_line_no"])
+        first = members[0]
+        packs = Counter(int(r["pack"]) for r in members)
+        # MODE() WITHIN GROUP (ORDER BY pack): most common, smallest on ties
+        common_pack = min(packs, key=lambda p: (-packs[p], p))
+        result.append((
+            first["invoice_line_no"],
+            (
+                None,
+                name,
+                min(r["city"] for r in members),
+                min(r["zipcode"] for r in members),
+                min(r["county"] for r in members),
+                month,
+                category_name,
+                im_desc,
+                ", ".join(sorted({r["vendor_name"] for r in members})),
+                len(members),
+                sum(int(r["sale_bottles"]) for r in members),
+                sum(float(r["sale_dollars"]) for r in members),
+                sum(float(r["sale_liters"]) for r in members),
+                sum(float(r["bottle_volume_ml"]) for r in members) / len(members),
+                common_pack,
+            ),
+        ))
+    result.sort(key=lambda x: (x[1][1], x[1][7], x[1][5], x[0]))
+    return [row for _, row in result]
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=620)
+    parser.add_argument("--out", required=True, help="JSON-lines file to write")
+    args = parser.parse_args()
+
+    data = SyntheticLiquorSales(args.rows, seed=args.seed)
+    with open(args.out, "w") as f:
+        for row in data:
+            f.write(json.dumps(row) + "\n")
+    print(f"Wrote {args.rows} rows ({data.n_stores} stores, {data.n_items} items) to {args.out}")
+
+
+if __name__ == "__main__":
+    main_cli()
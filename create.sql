@@ -24,5 +24,75 @@ CREATE TABLE LiquorSales(
     sale_bottles INTEGER,
     sale_dollars FLOAT,
     sale_liters FLOAT,
-    sale_gallons FLOAT
-);
\ No newline at end of file
+    sale_gallons FLOAT,
+    CONSTRAINT liquorsales_invoice_line_no_key UNIQUE (invoice_line_no)
+);
+
+-- Pages already loaded by DataLoader.py; cleared together with LiquorSales
+DROP TABLE IF EXISTS load_checkpoints;
+
+CREATE TABLE load_checkpoints(
+    dataset TEXT NOT NULL,
+    page_offset BIGINT NOT NULL,
+    row_count INTEGER NOT NULL,
+    loaded_at TIMESTAMP NOT NULL DEFAULT now(),
+    PRIMARY KEY (dataset, page_offset)
+);
+
+
+-- Bumped by DataLoader.py after every load; caches and the embedding job
+-- compare it to detect changes. The watermark is the newest
+-- (date, invoice_line_no) loaded and drives SYNC_MODE=incremental.
+DROP TABLE IF EXISTS data_version;
+
+CREATE TABLE data_version(
+    table_name TEXT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    watermark_date TEXT,
+    watermark_invoice TEXT,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+INSERT INTO data_version (table_name) VALUES ('liquorsales');
+
+
+-- Per store / item / month rollup read by backend/embed.py. DataLoader.py
+-- rebuilds it after a full load and refreshes only touched groups during an
+-- incremental sync; dirty rows still need (re-)embedding.
+DROP TABLE IF EXISTS liquorsales_monthly_agg;
+
+CREATE TABLE liquorsales_monthly_agg(
+    id BIGSERIAL PRIMARY KEY,
+    name TEXT,
+    im_desc TEXT,
+    month TIMESTAMP NOT NULL,
+    category_name TEXT,
+    city TEXT,
+    zipcode TEXT,
+    county TEXT,
+    first_invoice TEXT,
+    vendor_names TEXT,
+    total_orders BIGINT,
+    total_bottles BIGINT,
+    total_sales FLOAT,
+    total_liters FLOAT,
+    avg_bottle_volume FLOAT,
+    common_pack INTEGER,
+    dirty BOOLEAN NOT NULL DEFAULT true,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX liquorsales_monthly_agg_key ON liquorsales_monthly_agg (name, im_desc, month);
+CREATE INDEX liquorsales_monthly_agg_dirty ON liquorsales_monthly_agg (id) WHERE dirty;
+
+-- Groups an incremental sync emptied (every line moved to another store, item,
+-- category or month); backend/embed.py deletes their embeddings, then the rows.
+DROP TABLE IF EXISTS liquorsales_monthly_agg_removed;
+
+CREATE TABLE liquorsales_monthly_agg_removed(
+    id BIGSERIAL PRIMARY KEY,
+    name TEXT,
+    im_desc TEXT,
+    month TIMESTAMP NOT NULL,
+    category_name TEXT
+);
@@ -0,0 +1,138 @@
+-- Alternative to create.sql: LiquorSales range-partitioned by month on date,
+-- with indexes for the columns generated SQL and embed.py filter and group on.
+-- Load it with LIQUOR_SCHEMA=partitioned python DataLoader.py
+DROP TABLE IF EXISTS LiquorSales CASCADE;
+
+CREATE TABLE LiquorSales(
+    invoice_line_no TEXT,
+    date TIMESTAMP,
+    store TEXT,
+    name TEXT,
+    address TEXT,
+    city TEXT,
+    zipcode TEXT,
+    store_location POINT,
+    county_number TEXT,
+    county TEXT,
+    category TEXT,
+    category_name TEXT,
+    vendor_no TEXT,
+    vendor_name TEXT,
+    itemno TEXT,
+    im_desc TEXT,
+    pack INTEGER,
+    bottle_volume_ml FLOAT,
+    state_bottle_cost FLOAT,
+    state_bottle_retail FLOAT,
+    sale_bottles INTEGER,
+    sale_dollars FLOAT,
+    sale_liters FLOAT,
+    sale_gallons FLOAT,
+    -- unique keys on a partitioned table must include the partition key, so this is
+    -- weaker than create.sql's UNIQUE (invoice_line_no): a line whose date is corrected
+    -- upstream is inserted as a second row instead of updating the first, and rows with
+    -- a NULL date never conflict (DataLoader.py skips those rather than duplicate them)
+    CONSTRAINT liquorsales_invoice_line_no_key UNIQUE (invoice_line_no, date)
+) PARTITION BY RANGE (date);
+
+-- Creates the partition holding month_start's month if it does not exist yet.
+-- DataLoader.py calls this for every month in a page before loading it.
+CREATE OR REPLACE FUNCTION liquorsales_ensure_partition(month_start DATE)
+RETURNS void AS $$
+DECLARE
+    lo DATE := date_trunc('month', month_start)::date;
+    part TEXT := format('liquorsales_y%sm%s', to_char(lo, 'YYYY'), to_char(lo, 'MM'));
+BEGIN
+    IF to_regclass(part) IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF LiquorSales FOR VALUES FROM (%L) TO (%L)',
+            part, lo, (lo + INTERVAL '1 month')::date
+        );
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- The dataset starts in January 2012; pre-create a year past today as well
+SELECT liquorsales_ensure_partition(m::date)
+FROM generate_series(
+    DATE '2012-01-01',
+    date_trunc('month', now()) + INTERVAL '12 months',
+    INTERVAL '1 month'
+) AS m;
+
+-- Rows without a date (DataLoader.py doesn't load any, see the unique key above)
+CREATE TABLE liquorsales_default PARTITION OF LiquorSales DEFAULT;
+
+-- Indexes on the parent are created on every partition
+CREATE INDEX liquorsales_date_brin ON LiquorSales USING brin (date);
+CREATE INDEX liquorsales_name_idx ON LiquorSales (name);
+CREATE INDEX liquorsales_im_desc_idx ON LiquorSales (im_desc);
+CREATE INDEX liquorsales_category_name_idx ON LiquorSales (category_name);
+CREATE INDEX liquorsales_county_idx ON LiquorSales (county);
+CREATE INDEX liquorsales_vendor_name_idx ON LiquorSales (vendor_name);
+
+
+DROP TABLE IF EXISTS load_checkpoints;
+
+CREATE TABLE load_checkpoints(
+    dataset TEXT NOT NULL,
+    page_offset BIGINT NOT NULL,
+    row_count INTEGER NOT NULL,
+    loaded_at TIMESTAMP NOT NULL DEFAULT now(),
+    PRIMARY KEY (dataset, page_offset)
+);
+
+
+DROP TABLE IF EXISTS data_version;
+
+CREATE TABLE data_version(
+    table_name TEXT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    watermark_date TEXT,
+    watermark_invoice TEXT,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+INSERT INTO data_version (table_name) VALUES ('liquorsales');
+
+
+-- Per store / item / month rollup read by backend/embed.py. DataLoader.py
+-- rebuilds it after a full load and refreshes only touched groups during an
+-- incremental sync; dirty rows still need (re-)embedding.
+DROP TABLE IF EXISTS liquorsales_monthly_agg;
+
+CREATE TABLE liquorsales_monthly_agg(
+    id BIGSERIAL PRIMARY KEY,
+    name TEXT,
+    im_desc TEXT,
+    month TIMESTAMP NOT NULL,
+    category_name TEXT,
+    city TEXT,
+    zipcode TEXT,
+    county TEXT,
+    first_invoice TEXT,
+    vendor_names TEXT,
+    total_orders BIGINT,
+    total_bottles BIGINT,
+    total_sales FLOAT,
+    total_liters FLOAT,
+    avg_bottle_volume FLOAT,
+    common_pack INTEGER,
+    dirty BOOLEAN NOT NULL DEFAULT true,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX liquorsales_monthly_agg_key ON liquorsales_monthly_agg (name, im_desc, month);
+CREATE INDEX liquorsales_monthly_agg_dirty ON liquorsales_monthly_agg (id) WHERE dirty;
+
+-- Groups an incremental sync emptied (every line moved to another store, item,
+-- category or month); backend/embed.py deletes their embeddings, then the rows.
+DROP TABLE IF EXISTS liquorsales_monthly_agg_removed;
+
+CREATE TABLE liquorsales_monthly_agg_removed(
+    id BIGSERIAL PRIMARY KEY,
+    name TEXT,
+    im_desc TEXT,
+    month TIMESTAMP NOT NULL,
+    category_name TEXT
+);
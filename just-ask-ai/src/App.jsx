@@ -39,7 +39,7 @@ const App = () => {
     setCurrentChatIndex(index);
   };
 
-  // Append new message to the current chat
+  // Append new message to the current chat; returns where it went so streamed updates find it
   const handleSendMessage = (newMessage) => {
     if (currentChatIndex === null) {
       handleNewChat(); // Ensure there’s an active chat
@@ -47,6 +47,20 @@ const App = () => {
     const updatedChats = [...chats];
     updatedChats[currentChatIndex].messages.push(newMessage);
     setChats(updatedChats);
+    return { chatIndex: currentChatIndex, messageIndex: updatedChats[currentChatIndex].messages.length - 1 };
+  };
+
+  // Merge streamed fields (answer text, stage) into the message they belong to,
+  // even if another chat was opened or started while the answer streams
+  const handleUpdateMessage = ({ chatIndex, messageIndex }, patch) => {
+    setChats((prevChats) => {
+      const updatedChats = [...prevChats];
+      const chat = updatedChats[chatIndex];
+      const messages = [...chat.messages];
+      messages[messageIndex] = { ...messages[messageIndex], ...patch };
+      updatedChats[chatIndex] = { ...chat, messages };
+      return updatedChats;
+    });
   };
 
   // Automatically start a new chat on initial load
@@ -78,7 +92,7 @@ const App = () => {
     <div className="app-container">
       <Sidebar chats={chats} onNewChat={handleNewChat} onSelectChat={handleSelectChat} />
       {currentChatIndex !== null ? (
-        <ChatWindow messages={chats[currentChatIndex].messages} onSendMessage={handleSendMessage} />
+        <ChatWindow messages={chats[currentChatIndex].messages} onSendMessage={handleSendMessage} onUpdateMessage={handleUpdateMessage} />
       ) : null}
     </div>
   );
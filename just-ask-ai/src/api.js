@@ -15,4 +15,44 @@ export const sendUserQuery = async (question) => {
     }
   };
   
+// POST /query/stream and hand each server-sent event to onEvent(event, data)
+// as it arrives: "stage", "sql", "token", then "done" or "error".
+export const streamUserQuery = async (question, onEvent) => {
+    try {
+      const response = await fetch(`${api.defaults.baseURL}/query/stream`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ question }),
+      });
+      if (!response.ok || !response.body) {
+        throw new Error(`HTTP ${response.status}`);
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+          const raw = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+          let event = "message";
+          let data = "";
+          for (const line of raw.split("\n")) {
+            if (line.startsWith("event:")) event = line.slice(6).trim();
+            else if (line.startsWith("data:")) data += line.slice(5).trim();
+          }
+          if (data) onEvent(event, JSON.parse(data));
+        }
+      }
+    } catch (error) {
+      console.error("Stream Error:", error.message);
+      onEvent("error", { error: "Error streaming query." });
+    }
+  };
+
 export default api;
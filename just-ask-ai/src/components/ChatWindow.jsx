@@ -1,8 +1,16 @@
 import React, { useState } from "react";
 import PacmanLoader from "react-spinners/PacmanLoader";
-import { sendUserQuery } from "../api";
+import { streamUserQuery } from "../api";
 
-const ChatWindow = ({ messages, onSendMessage }) => {
+const STAGE_LABELS = {
+  routing: "Reading your question…",
+  generating_sql: "Writing SQL…",
+  running_sql: "Running SQL…",
+  retrieving: "Searching the data…",
+  generating: "Writing the answer…",
+};
+
+const ChatWindow = ({ messages, onSendMessage, onUpdateMessage }) => {
   const [query, setQuery] = useState("");
   const [loading, setLoading] = useState(false);
 
@@ -10,12 +18,25 @@ const ChatWindow = ({ messages, onSendMessage }) => {
     e.preventDefault();
     setLoading(true);
 
-    const result = await sendUserQuery(query);
-    const chatResponse = result.response || "Unexpected response format.";
+    const question = query;
+    setQuery("");
+    const target = onSendMessage({ query: question, response: "", stage: "routing" });
 
-    onSendMessage({ query, response: chatResponse });
+    // the answer grows in place as tokens arrive
+    let answer = "";
+    await streamUserQuery(question, (event, data) => {
+      if (event === "stage") {
+        onUpdateMessage(target, { stage: data.stage });
+      } else if (event === "token") {
+        answer += data.text;
+        onUpdateMessage(target, { response: answer, stage: null });
+      } else if (event === "error") {
+        onUpdateMessage(target, { response: data.error, stage: null });
+      } else if (event === "done") {
+        onUpdateMessage(target, { stage: null });
+      }
+    });
 
-    setQuery("");
     setLoading(false);
   };
 
@@ -28,6 +49,7 @@ const ChatWindow = ({ messages, onSendMessage }) => {
               <strong>You:</strong> {msg.query}
               <br />
               <strong>AI:</strong> {msg.response}
+              {msg.stage && <em className="stage"> {STAGE_LABELS[msg.stage] || msg.stage}</em>}
             </div>
           ))
         }
@@ -12,7 +12,15 @@ const Sidebar = ({ chats, onNewChat, onSelectChat }) => {
           </li>
         ))}
       </ul>
-      <button className="sign-out-button" onClick={() => {
+      <button className="sign-out-button" onClick={async () => {
+        const token = localStorage.getItem("token");
+        // revoke the session server-side so the token stops verifying right away
+        if (token) {
+          await fetch("http://localhost:8000/auth/logout", {
+            method: "POST",
+            headers: { Authorization: `Bearer ${token}` },
+          }).catch(() => {});
+        }
         localStorage.removeItem("token");
         window.location.href = "/login";
       }}>